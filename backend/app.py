@@ -1,22 +1,36 @@
 import os
 import json
-import requests
 import uuid
 import time
 import urllib.parse
-import websocket # 用于与ComfyUI进行实时通信
-import shutil
 import mimetypes
 import re
+import queue
+import sqlite3
+import threading
 from flask import Flask, request, jsonify, send_from_directory, render_template, send_file, abort, Response
 from flask_cors import CORS
 from dotenv import load_dotenv
 from typing import Optional
+from datetime import datetime, timedelta
 from moviepy import VideoFileClip, concatenate_videoclips,ImageClip,AudioFileClip,concatenate_audioclips
 # 导入之前设计的数据库操作模块
 from database import update_node, get_tree_as_json
 import database
+from asset_gc import AssetCollector
+from tree_cache import TreeCache
+from jobs import JobQueue, JobError, JobCancelled, FINISHED_STATUSES
+from comfyui_events import PromptTimeout, PromptExecutionError
+from comfyui_pool import BackendPool # 多个ComfyUI后端的调度（HTTP连接池、WebSocket事件监听）
+from workflow_registry import WorkflowRegistry, WorkflowGraph
+from result_cache import ResultCache, execution_seconds
+from progress import ProgressTracker
+from scheduler import GenerationScheduler, PRIORITY_PREVIEW
+import tree_transfer
 import random
+import itertools
+import hashlib
+import shutil
 import sys
 import base64
 from pathlib import Path
@@ -43,7 +57,31 @@ print(f"--- 应用程序正在以 {APP_MODE.upper()} 模式运行 ---")
 
 # --- 配置常量 ---
 COMFYUI_SERVER_ADDRESS = "223.193.6.178:8188" # ComfyUI后端的地址和端口
+# 多个 ComfyUI 后端用逗号分隔，如 "10.0.0.1:8188,10.0.0.2:8188"（它们需要共享 input / output 目录）
+COMFYUI_SERVERS = [s.strip() for s in os.getenv('COMFYUI_SERVERS', COMFYUI_SERVER_ADDRESS).split(',') if s.strip()]
 CLIENT_ID = str(uuid.uuid4()) # 为我们的后端应用生成一个唯一的客户端ID
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', '3')) # 同时执行的生成任务数
+SCHED_TREE_CONCURRENCY = int(os.getenv('SCHED_TREE_CONCURRENCY', '2')) # 每棵树同时执行的生成任务数上限（预览和渲染合计）
+SCHED_TREE_PREVIEW_EXTRA = int(os.getenv('SCHED_TREE_PREVIEW_EXTRA', '1')) # 树已达上限时仍可额外执行的预览任务数，一棵树最多占用上面两项之和个工作线程
+SCHED_PREVIEW_RESERVED = int(os.getenv('SCHED_PREVIEW_RESERVED', '1')) # 只给预览（图片等）任务使用的工作线程数
+COMFYUI_PROMPT_TIMEOUT = float(os.getenv('COMFYUI_PROMPT_TIMEOUT', '1800')) # 单个 prompt 的最长等待时间（秒）
+# 生成任务的截止时间（秒，从第一次开始执行算起，重启后不重置），超过后中断 ComfyUI 上的 prompt 并判定失败
+GENERATION_DEADLINE = float(os.getenv('GENERATION_DEADLINE', str(COMFYUI_PROMPT_TIMEOUT)))
+# 按工作流覆盖截止时间，如 "ImageGenerateVideo=3600,TextGenerateImage=300"
+GENERATION_DEADLINES = {
+    module_id.strip(): float(seconds)
+    for module_id, seconds in (item.split('=', 1) for item in os.getenv('GENERATION_DEADLINES', '').split(',') if '=' in item)
+}
+COMFYUI_CONNECT_TIMEOUT = float(os.getenv('COMFYUI_CONNECT_TIMEOUT', '5')) # HTTP 连接超时（秒）
+COMFYUI_READ_TIMEOUT = float(os.getenv('COMFYUI_READ_TIMEOUT', '60')) # HTTP 读取超时（秒）
+COMFYUI_MAX_RETRIES = int(os.getenv('COMFYUI_MAX_RETRIES', '3')) # 连接错误 / 临时 5xx 的最大重试次数
+COMFYUI_DEBUG_DUMP = os.getenv('COMFYUI_DEBUG_DUMP', '0').lower() not in ('0', 'false') # 打印每次提交的工作流和返回的 history JSON（调试用）
+SSE_REFRESH_INTERVAL = 2.0 # 进度推送：没有新事件时多久刷新一次排队位置 / 检查任务是否已结束（秒）
+SSE_KEEPALIVE_INTERVAL = 15.0 # 进度推送：长时间没有消息时发送注释行，防止代理断开空闲连接（秒）
+SWEEP_MAX_VARIANTS = int(os.getenv('SWEEP_MAX_VARIANTS', '64')) # 一次参数扫描最多创建的节点数
+GENERATION_CACHE = os.getenv('GENERATION_CACHE', '1').lower() not in ('0', 'false') # 相同工作流 + 相同输入文件时复用已有输出
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv('GENERATION_CACHE_MAX_ENTRIES', '10000')) # 缓存记录数上限（按最近使用淘汰）
+GENERATION_CACHE_MAX_AGE_DAYS = float(os.getenv('GENERATION_CACHE_MAX_AGE_DAYS', '30')) # 缓存记录的最长保留天数
 # UPLOAD_FOLDER = 'assets'
 # os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -54,7 +92,8 @@ if APP_MODE == 'local':
     COMFYUI_OUTPUT_PATH = os.path.join(LOCAL_ASSETS_PATH, 'output')
     print(f"本地模式：使用 '{LOCAL_ASSETS_PATH}' 作为资源根目录")
 else:
-    BASE_COMFYUI_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'comfyui', 'comfyui'))
+    # ComfyUI 根目录（其下的 input / output），可用环境变量 COMFYUI_ROOT 指定（如配合 fake_comfyui.py 测试）
+    BASE_COMFYUI_PATH = os.path.abspath(os.getenv('COMFYUI_ROOT') or os.path.join(os.path.dirname(__file__), '..', '..', 'comfyui', 'comfyui'))
     COMFYUI_INPUT_PATH = os.path.join(BASE_COMFYUI_PATH, 'input')
     COMFYUI_OUTPUT_PATH = os.path.join(BASE_COMFYUI_PATH, 'output')
     print(f"服务器模式：使用 '{BASE_COMFYUI_PATH}' 作为 ComfyUI 根目录")
@@ -68,73 +107,95 @@ IMAGE_DIR = os.path.join(COMFYUI_OUTPUT_PATH)
 VIDEO_DIR = os.path.join(IMAGE_DIR, "video")
 STITCHED_OUTPUT_FOLDER = os.path.join(os.path.dirname(__file__), 'stitched_videos') # 存放拼接结果
 os.makedirs(STITCHED_OUTPUT_FOLDER, exist_ok=True)
+# 删除节点后在后台回收不再被引用的资源文件（本地模式的 output 是示例文件，不回收）
+asset_collector = AssetCollector(COMFYUI_INPUT_PATH, COMFYUI_OUTPUT_PATH, collect_output=(APP_MODE != 'local'))
+# 已编码的树响应缓存，数据库写入时自动失效
+tree_cache = TreeCache()
+comfyui_pool = BackendPool(
+    COMFYUI_SERVERS, CLIENT_ID,
+    connect_timeout=COMFYUI_CONNECT_TIMEOUT,
+    read_timeout=COMFYUI_READ_TIMEOUT,
+    max_retries=COMFYUI_MAX_RETRIES,
+)
+# 按任务汇总 ComfyUI 的执行进度，供 /api/jobs/<id>/events 推送
+progress_tracker = ProgressTracker(comfyui_pool)
+workflow_registry = WorkflowRegistry(
+    os.path.join(BASE_DIR, 'workflows'),
+    bindings_file=os.path.join(BASE_DIR, 'workflow_bindings.json'),  # 请求参数 -> 节点输入的声明式绑定
+)
+# 生成结果缓存：参数、种子、输入文件都没变时直接复用上一次的输出，不再占用 GPU
+result_cache = ResultCache(
+    COMFYUI_INPUT_PATH, COMFYUI_OUTPUT_PATH,
+    max_entries=GENERATION_CACHE_MAX_ENTRIES,
+    max_age_days=GENERATION_CACHE_MAX_AGE_DAYS,
+    enabled=GENERATION_CACHE,
+)
+# 生成任务调度：优先级分类、成本估算、每棵树的并发上限和加权公平排队
+generation_scheduler = GenerationScheduler(
+    workflow_registry, GENERATION_WORKERS,
+    tree_concurrency=SCHED_TREE_CONCURRENCY,
+    tree_preview_extra=SCHED_TREE_PREVIEW_EXTRA,
+    preview_reserved=SCHED_PREVIEW_RESERVED,
+)
+database.add_change_listener(tree_cache.invalidate)
 
 # --- 2. 核心辅助函数 ---
 
 def find_node_id_by_title(workflow: dict, target_title: str) -> Optional[str]:
-    """遍历工作流JSON，根据自定义的节点标题查找节点ID。"""
+    """根据自定义的节点标题查找节点ID。注册表加载的工作流直接查预建的标题索引，其它 dict 逐个遍历。"""
+    if isinstance(workflow, WorkflowGraph):
+        return workflow.title_index.get(target_title)
     for node_id, node_info in workflow.items():
         if '_meta' in node_info and node_info['_meta'].get('title') == target_title:
             return node_id
     return None
 
 def load_workflow(module_id: str) -> Optional[dict]:
-    """根据模块ID从workflows文件夹加载对应的工作流JSON文件。"""
-    workflow_path = os.path.join('workflows', f"{module_id}.json")
-    if not os.path.exists(workflow_path):
-        return None
-    with open(workflow_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """根据模块ID返回对应工作流模板的一份副本（模板由注册表缓存，文件修改后自动重新加载）。"""
+    return workflow_registry.get(module_id)
 
-def queue_comfyui_prompt(workflow: dict) -> dict:
-    """将工作流提交到ComfyUI的队列中。"""
-    prompt_data = {"prompt": workflow, "client_id": CLIENT_ID}
+def queue_comfyui_prompt(workflow: dict, front: bool = False) -> dict:
+    """
+    将工作流提交到负载最低的可用 ComfyUI 后端的队列中，返回值中的 backend 为所选后端地址。
+    front=True 时插到队列最前面，排在已排队的视频渲染之前（预览任务，见 scheduler.py）。
+    """
     print(">>> 正在向ComfyUI提交工作流...")
     
-    # 【关键调试代码】打印最终要发送的工作流JSON
-    print("--- 最终发送给 ComfyUI 的工作流 (可复制用于调试) ---")
-    print(json.dumps(workflow, indent=2, ensure_ascii=False))
-    print("----------------------------------------------------")
+    if COMFYUI_DEBUG_DUMP:
+        print("--- 最终发送给 ComfyUI 的工作流 (可复制用于调试) ---")
+        print(json.dumps(workflow, indent=2, ensure_ascii=False))
+        print("----------------------------------------------------")
     
-    response = requests.post(f"http://{COMFYUI_SERVER_ADDRESS}/prompt", json=prompt_data)
-    response.raise_for_status()
+    queued = comfyui_pool.submit(workflow, front=front)
     print("<<< ComfyUI已接受任务。")
-    return response.json()
+    return queued
 
-def get_comfyui_outputs(prompt_id: str) -> dict:
+def get_comfyui_outputs(prompt_id: str, timeout: float | None = None) -> dict:
     """
-    通过WebSocket连接，等待ComfyUI任务执行完成，并获取输出结果。
-    这是处理耗时任务的关键。
+    等待ComfyUI任务执行完成，并获取输出结果。
+    完成事件来自各后端共享的 WebSocket 监听器（见 comfyui_events），多个任务可以同时等待；
+    后端中途不可用时会自动换一个后端重新执行（见 comfyui_pool）。
+    执行出错抛出 PromptExecutionError，超过 timeout（默认 COMFYUI_PROMPT_TIMEOUT）秒抛出 PromptTimeout。
     """
-    ws = websocket.WebSocket()
-    ws.connect(f"ws://{COMFYUI_SERVER_ADDRESS}/ws?clientId={CLIENT_ID}")
-    
-    while True:
-        try:
-            out = ws.recv()
-            if isinstance(out, str):
-                message = json.loads(out)
-                if message['type'] == 'executing':
-                    data = message['data']
-                    if data['node'] is None and data['prompt_id'] == prompt_id:
-                        # 执行完成的标志
-                        break 
-        except websocket.WebSocketConnectionClosedException:
-            print("WebSocket连接已关闭，任务可能已完成或中断。")
-            break
-    ws.close()
+    return parse_history_outputs(wait_comfyui_history(prompt_id, timeout))
+
+def wait_comfyui_history(prompt_id: str, timeout: float | None = None) -> dict:
+    """等待任务执行完成，返回它在 /history 中的记录（含 outputs 和带时间戳的 status.messages）"""
+    prompt_id, backend = comfyui_pool.wait(prompt_id, COMFYUI_PROMPT_TIMEOUT if timeout is None else timeout)
 
     # 从/history API获取最终的输出信息
-    history_response = requests.get(f"http://{COMFYUI_SERVER_ADDRESS}/history/{prompt_id}")
-    history_response.raise_for_status()
-    history = history_response.json()
-    # --- 【请在这里添加关键调试代码】---
-    print("--- ComfyUI History Output (DEBUG) ---")
-    print(json.dumps(history, indent=2, ensure_ascii=False))
-    print("---------------------------------------")
+    history = backend.client.get_history(prompt_id)
+    if COMFYUI_DEBUG_DUMP:
+        print("--- ComfyUI History Output (DEBUG) ---")
+        print(json.dumps(history, indent=2, ensure_ascii=False))
+        print("---------------------------------------")
+    return history[prompt_id]
+
+def parse_history_outputs(history_entry: dict) -> dict:
+    """把 /history 记录中的输出转换为 assets.output 格式 {"images": [/view URL, ...], "videos": [...], "audio": [...]}"""
     outputs = {}
     # 遍历历史记录中的输出
-    for node_id, node_output in history[prompt_id]['outputs'].items():
+    for node_id, node_output in history_entry['outputs'].items():
         if 'images' in node_output:
             image_list = []
             for image in node_output['images']:
@@ -164,79 +225,229 @@ def get_comfyui_outputs(prompt_id: str) -> dict:
 
     return outputs
 
-import urllib.parse
+def run_seed_variants(workflow: dict, seed_node_id: Optional[str], count: int,
+                      module_id: Optional[str] = None, use_cache: bool = True,
+                      job: Optional[dict] = None, deadline: Optional[float] = None) -> tuple[dict, int]:
+    """
+    先把 count 个只有 noise_seed 不同的工作流变体全部提交到 ComfyUI，再统一等待结果，
+    这样 ComfyUI 队列不会空转，多 GPU / 多实例的后端也能并行执行。
+    第 1 个变体使用工作流中已有的种子；输出按变体顺序合并，结果顺序与完成先后无关。
+    命中生成结果缓存的变体不提交，直接复用缓存的输出；use_cache=False 时跳过查找，但仍用新结果刷新缓存。
+    job 不为空时：提交的每个 prompt 都记录到 job_prompts 表和节点上，执行进度汇报给 progress_tracker；
+    任务上次执行（进程重启前）提交过、仍在 ComfyUI 队列中或已经完成的 prompt 直接接管，不再重新生成。
+    deadline（time.time() 时间戳）之前没有全部完成时抛出 PromptTimeout。
+    返回 (合并后的输出, 命中缓存的变体数)。
+    """
+    job_id = job['job_id'] if job else None
+    previous_prompts = {p['variant']: p for p in database.get_job_prompts(job_id)} if job_id else {}
+    used_seeds = set()
+    if seed_node_id:
+        used_seeds.add(workflow[seed_node_id]["inputs"].get("noise_seed"))
+
+    variants = [] # [(缓存键, 缓存的输出 或 None, ComfyUI 的提交响应 或 None), ...]
+    for i in range(count):
+        if i > 0 and seed_node_id:
+            seed = random.randint(0, 999999999999999)
+            while seed in used_seeds:
+                seed = random.randint(0, 999999999999999)
+            used_seeds.add(seed)
+            # queue_comfyui_prompt 提交时即序列化，可以直接改写同一个工作流
+            workflow[seed_node_id]["inputs"]["noise_seed"] = seed
+        cache_key = result_cache.compute_key(workflow) if result_cache.enabled else None
+        cached_outputs = None
+        if cache_key and use_cache:
+            cached_outputs = result_cache.lookup(cache_key)
+        elif cache_key:
+            result_cache.record_bypass()
+        if cached_outputs is not None:
+            print(f">>> 第 {i+1}/{count} 个变体命中生成结果缓存 ({cache_key[:12]})，跳过 ComfyUI。")
+            variants.append((cache_key, cached_outputs, None))
+            continue
+        if count > 1:
+            print(f">>> 提交第 {i+1}/{count} 个变体")
+        previous = previous_prompts.get(i + 1)
+        if previous and comfyui_pool.adopt(previous['prompt_id'], previous['backend'], workflow):
+            print(f">>> 接管上次提交的第 {i+1}/{count} 个变体 (prompt_id: {previous['prompt_id']})")
+            queued = {"prompt_id": previous['prompt_id'], "backend": previous['backend']}
+            cache_key = None  # 上次的随机种子可能与本次不同，结果不能记到本次工作流的缓存键下
+        else:
+            queued = queue_comfyui_prompt(workflow, front=bool(job) and job.get('priority') == PRIORITY_PREVIEW)
+            if job_id:
+                database.record_job_prompt(job_id, job['node_id'], i + 1, queued['prompt_id'], queued.get('backend'))
+        if job_id:
+            progress_tracker.prompt_submitted(job_id, queued['prompt_id'], workflow)
+            # 先记录 prompt 再检查取消标记：与取消接口的「先标记再读取 prompt」配合，不会漏掉刚提交的 prompt
+            check_job_cancelled(job_id)
+        variants.append((cache_key, None, queued))
+
+    # 所有变体都已在队列中，按提交顺序等待即可：等待第一个时其余变体也在执行
+    outputs = {}
+    cache_hits = 0
+    for i, (cache_key, variant_outputs, queued) in enumerate(variants):
+        if variant_outputs is None:
+            if job_id:
+                progress_tracker.waiting_for(job_id, queued['prompt_id'], queued.get('backend'), i + 1, count)
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+            history_entry = wait_comfyui_history(queued['prompt_id'], timeout)
+            variant_outputs = parse_history_outputs(history_entry)
+            if cache_key:
+                result_cache.store(cache_key, module_id, variant_outputs, execution_seconds(history_entry))
+        else:
+            cache_hits += 1
+        for media_type, urls in variant_outputs.items():
+            outputs.setdefault(media_type, []).extend(urls)
+    return outputs, cache_hits
+
+def check_job_cancelled(job_id: str):
+    """任务已被请求取消时，取消它在 ComfyUI 上剩余的 prompt 并抛出 JobCancelled"""
+    if database.is_job_cancel_requested(job_id):
+        cancel_job_prompts(job_id, '任务已取消')
+        raise JobCancelled()
+
+def cancel_job_prompts(job_id: str, reason: str) -> int:
+    """中断 / 从队列删除任务在 ComfyUI 上还没结束的 prompt，返回实际取消的数量"""
+    return sum(comfyui_pool.cancel(p['prompt_id'], p['backend'], reason) for p in database.get_job_prompts(job_id))
 
 def get_input_image_filenames_from_db(node_id: str) -> list[str]:
     """
-    从数据库加载节点数据，提取 assets.input.images 中图片的文件名（仅 filename）
+    获取节点 assets.input.images 中图片的文件名（仅 filename），直接查 node_assets 索引表
     Args: node_id: 节点ID   
     Returns: list[str]: 图片文件名列表（若不存在则返回空列表）
     """
-    try:
-        # 1. 从数据库获取节点数据
-        node_data = database.get_node(node_id)
-        if not node_data:
-            print(f"节点 {node_id} 不存在于数据库中")
-            return []
-        
-        # 2. 层级解析 assets.input.images 字段
-        assets = node_data.get('assets', {})
-        input_assets = assets.get('input', {})
-        images_urls = input_assets.get('images', [])
-        
-        # 3. 确保是列表类型
-        if not isinstance(images_urls, list):
-            print(f"节点 {node_id} 的 assets.input.images 不是列表类型")
-            return []
-        
-        # 4. 提取每个URL中的filename参数（仅保留文件名）
-        filenames = []
-        for url in images_urls:
-            if not isinstance(url, str):
-                continue  # 跳过非字符串类型的URL
-            parsed_url = urllib.parse.urlparse(url)
-            query_params = urllib.parse.parse_qs(parsed_url.query)
-            filename = query_params.get('filename', [None])[0]
-            if filename:
-                filenames.append(filename)
-        
-        return filenames
-    
-    except Exception as e:
-        print(f"获取节点 {node_id} 的 input.images 文件名时出错: {str(e)}")
-        return []
+    return database.get_node_asset_filenames(node_id, 'input', 'images')
 
 def get_input_image_count_from_db(node_id: str) -> int:
     """
-    从数据库加载节点数据，计算 assets.input.images 中的图片数量
+    计算节点 assets.input.images 中的图片数量
     Args:
         node_id: 节点ID
     Returns:
         int: 图片数量（不存在则返回0）
     """
-    try:
-        # 1. 从数据库加载节点数据
-        node_data = database.get_node(node_id)
-        if not node_data:
-            print(f"节点 {node_id} 不存在于数据库中")
-            return 0
-        
-        # 2. 解析 assets 字段（兼容可能的空值或缺失）
-        assets = node_data.get('assets', {})
-        input_assets = assets.get('input', {})  # 获取 input 子字段
-        images_list = input_assets.get('images', [])  # 获取 images 列表
-        
-        # 3. 确保是列表类型，避免非列表数据导致错误
-        if not isinstance(images_list, list):
-            print(f"节点 {node_id} 的 assets.input.images 不是列表类型")
-            return 0
-        
-        # 4. 返回列表长度（即图片数量）
-        return len(images_list)
-    
-    except Exception as e:
-        print(f"计算节点 {node_id} 的 input.images 数量时出错: {str(e)}")
-        return 0
+    return len(get_input_image_filenames_from_db(node_id))
+
+def parent_output_files(parent_ids: list[str], module_id: str) -> list[str | None]:
+    """
+    父节点（按 parent_ids 顺序）当前的第一个输出文件路径，重新执行下游时替换节点对应位置的输入；
+    没有输出的父节点（AddText、只上传了输入的 AddWorkflow 等）对应 None，保留原来的输入。
+    FrameInterpolation 的输入是视频，优先取视频
+    """
+    kinds = ('videos', 'images') if module_id == 'FrameInterpolation' else ('images', 'videos')
+    files = []
+    for parent_id in parent_ids:
+        parent = database.get_node(parent_id) or {}
+        output = parent.get('assets', {}).get('output') or {}
+        url = next((output[kind][0] for kind in kinds if output.get(kind)), None)
+        if url is None:
+            files.append(None)
+            continue
+        path = result_cache.resolve_path(url)
+        if path is None:
+            raise FileNotFoundError(f"父节点 {parent_id} 的输出文件已不存在: {url}")
+        files.append(path)
+    return files
+
+def fed_input_paths(fed_files: list[str | None], input_filenames: list[str]) -> list[str]:
+    """父节点的输出替换对应位置后，节点的全部输入文件路径（用于计算输入哈希）"""
+    paths = [os.path.join(COMFYUI_INPUT_PATH, filename) for filename in input_filenames]
+    for slot, path in enumerate(fed_files):
+        if path is None:
+            continue
+        if slot < len(paths):
+            paths[slot] = path
+        else:
+            paths.append(path)
+    return paths
+
+def feed_parent_outputs(fed_files: list[str | None], input_filenames: list[str]) -> tuple[list[str], dict[int, str]]:
+    """
+    把父节点的输出文件复制到 input 目录，返回 (替换后的输入文件名列表, {位置: 新文件名})。
+    只复制文件，节点的 assets.input 由生成成功后的写回事务更新（见 write_fed_inputs）
+    """
+    filenames = list(input_filenames)
+    copies = {}
+    for slot, path in enumerate(fed_files):
+        if path is None:
+            continue
+        filename = f"{uuid.uuid4()}{os.path.splitext(path)[1]}"
+        try:
+            shutil.copyfile(path, os.path.join(COMFYUI_INPUT_PATH, filename))
+        except OSError:
+            discard_input_copies(copies)
+            raise
+        copies[slot] = filename
+        if slot < len(filenames):
+            filenames[slot] = filename
+        else:
+            filenames.append(filename)
+    return filenames, copies
+
+def write_fed_inputs(node_id: str, assets: dict, copies: dict[int, str]) -> list[dict]:
+    """
+    在写回事务中把复制的文件写入 assets.input.images 的对应位置（格式与上传接口相同），其余输入原样保留。
+    返回被替换掉的输入文件（交给 asset_collector，没有其它节点引用时回收）
+    """
+    images = list((assets.get('input') or {}).get('images') or [])
+    previous = database.get_node_asset_filenames(node_id, 'input', 'images')
+    superseded = []
+    for slot, filename in sorted(copies.items()):
+        url = f"/view?filename={urllib.parse.quote_plus(filename)}&subfolder=&type=input"
+        if slot < len(images):
+            if slot < len(previous):
+                superseded.append({"filename": previous[slot], "subfolder": "", "storage_type": "input"})
+            images[slot] = url
+        else:
+            images.append(url)
+    assets['input'] = {**(assets.get('input') or {}), "images": images}
+    print(f"    - 已将父节点的输出作为节点 {node_id} 的输入: {images}")
+    return superseded
+
+def discard_input_copies(copies: dict[int, str]):
+    """生成失败时，复制到 input 目录但没有写入节点的文件交给 asset_collector 回收"""
+    asset_collector.submit([{"filename": filename, "subfolder": "", "storage_type": "input"} for filename in copies.values()])
+
+def compute_input_hash(module_id: str, parameters: dict, files: list[str]) -> str:
+    """节点输入的哈希：模块、参数（键排序）和按顺序的每个输入文件的内容哈希，与文件名无关"""
+    digest = hashlib.sha256(f"{module_id}\n".encode('utf-8'))
+    digest.update(json.dumps(parameters, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    for path in files:
+        digest.update(f"\n{result_cache.hash_file(path)}".encode('utf-8'))
+    return digest.hexdigest()
+
+def node_outputs_exist(node_id: str) -> bool:
+    """节点有输出，且输出文件都还在磁盘上（没有被资源回收删除）"""
+    node = database.get_node(node_id) or {}
+    urls = [url for urls in (node.get('assets', {}).get('output') or {}).values() for url in urls]
+    return bool(urls) and all(result_cache.resolve_path(url) for url in urls)
+
+def tree_response(tree_id: int, status: int = 200) -> Response:
+    """
+    返回整棵树的 JSON 响应。响应体按 (tree_id, rev) 缓存，带强 ETag；
+    GET 请求的 If-None-Match 命中当前版本时直接返回 304，不再查询和编码整棵树。
+    """
+    revision = database.get_tree_revision(tree_id)
+    if revision is None:
+        return jsonify({"error": f"Tree with ID {tree_id} not found."}), 404
+
+    etag = f"tree-{tree_id}-{revision['rev']}"
+    if status == 200 and request.method == 'GET' and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        body = tree_cache.get(tree_id, revision['rev'])
+        if body is None:
+            tree_data = database.get_tree_as_json(tree_id)
+            if tree_data is None:
+                return jsonify({"error": f"Tree with ID {tree_id} not found."}), 404
+            body = f"{app.json.dumps(tree_data)}\n".encode('utf-8')
+            # 以实际读到的快照版本为准（查询期间可能又有写入）
+            etag = f"tree-{tree_id}-{tree_data['rev']}"
+            tree_cache.put(tree_id, tree_data['rev'], body)
+        response = Response(body, status=status, mimetype=app.json.mimetype)
+
+    response.set_etag(etag)
+    # 允许浏览器缓存，但每次使用前都要带 ETag 回来验证
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 def encode_image_to_base64(path):
     mime, _ = mimetypes.guess_type(path)
@@ -488,35 +699,36 @@ def upload_asset():
             asset_url = f"/view?filename={urllib.parse.quote_plus(filename)}&subfolder=&type=input"
             asset_urls.append((asset_url, ext.lower()))
 
-        # 5. 获取目标节点
-        target_node = database.get_node(target_node_id)
-        if not target_node:
-            raise Exception(f"目标节点 {target_node_id} 不存在")
-
-        # 6. 批量更新assets字段
-        updated_assets = target_node.get('assets', {})
-        updated_assets['input'] = updated_assets.get('input', {})  # 初始化input
-
-        # 按文件类型分类添加
-        for asset_url, ext in asset_urls:
-            updated_assets['input']['images'] = updated_assets['input'].get('images', []) + [asset_url]
-
-        print(updated_assets)
-        # 7. 更新数据库
-        database.update_node(
-            node_id=target_node_id,
-            payload={
-                "assets": updated_assets,
-                "parameters": target_node.get('parameters', {})
-            }
-        )
+        # 5~7 在同一个事务中读取并更新节点，避免并发上传互相覆盖 assets
+        with database.transaction():
+            # 5. 获取目标节点
+            target_node = database.get_node(target_node_id)
+            if not target_node:
+                raise Exception(f"目标节点 {target_node_id} 不存在")
+
+            # 6. 批量更新assets字段
+            updated_assets = target_node.get('assets', {})
+            updated_assets['input'] = updated_assets.get('input', {})  # 初始化input
+
+            # 按文件类型分类添加
+            for asset_url, ext in asset_urls:
+                updated_assets['input']['images'] = updated_assets['input'].get('images', []) + [asset_url]
+
+            print(updated_assets)
+            # 7. 更新数据库
+            database.update_node(
+                node_id=target_node_id,
+                payload={
+                    "assets": updated_assets,
+                    "parameters": target_node.get('parameters', {})
+                }
+            )
 
         # 8. 返回更新后的树
-        updated_tree = database.get_tree_as_json(tree_id)
-        if not updated_tree:
+        if database.get_tree_revision(tree_id) is None:
             raise Exception("获取更新后的树失败")
 
-        return jsonify(updated_tree), 200
+        return tree_response(tree_id)
 
     except Exception as e:
         print(f"处理上传并更新节点时出错: {e}")
@@ -549,8 +761,7 @@ def update_node_media(node_id):
         database.update_node(node_id, data)
 
         # 获取更新后的树
-        tree_data = get_tree_as_json(database.get_node(node_id)['tree_id'])
-        return jsonify(tree_data), 200
+        return tree_response(database.get_node(node_id)['tree_id'])
 
     except Exception as e:
         print("更新节点失败:", e)
@@ -560,28 +771,59 @@ def update_node_media(node_id):
 
 @app.route('/api/trees/<int:tree_id>', methods=['GET'])
 def get_tree(tree_id):
-    """API: 获取一棵树的完整结构，如果项目或根节点不存在，则自动创建。"""
-    tree_data = database.get_tree_as_json(tree_id)
+    """
+    API: 获取一棵树的完整结构，如果项目或根节点不存在，则自动创建。
+    带 ?since=<rev> 时只返回该版本之后新增/修改/删除的节点和关系（见 database.get_tree_changes）。
+    """
+    since = request.args.get('since', type=int)
+    if since is not None:
+        changes = database.get_tree_changes(tree_id, since)
+        if changes is None:
+            return jsonify({"error": f"Tree with ID {tree_id} not found."}), 404
+        return jsonify(changes)
+
+    revision = database.get_tree_revision(tree_id)
     
     # 场景1：连项目（树）本身都不存在
-    if not tree_data:
+    if not revision:
         print(f"项目 {tree_id} 不存在，正在自动创建...")
         # 简单处理：只为ID为1的项目自动创建
         if tree_id == 1:
             new_tree_id = database.create_tree("我的第一个项目")
             database.add_node(new_tree_id, None, "Init", {"description": "项目根节点"})
-            tree_data = database.get_tree_as_json(new_tree_id)
+            tree_id = new_tree_id
         else:
             return jsonify({"error": f"Tree with ID {tree_id} not found."}), 404
         
     #  场景2：项目存在，但里面是空的（没有任何节点）
-    elif not tree_data.get('nodes'):
+    elif not revision['has_nodes']:
         print(f"项目 {tree_id} 为空，正在自动添加根节点...")
         database.add_node(tree_id, None, "Init", {"description": "项目根节点"})
-        # 重新获取一次数据
-        tree_data = database.get_tree_as_json(tree_id)
         
-    return jsonify(tree_data)
+    # 未变化时直接 304，否则使用缓存的响应体
+    return tree_response(tree_id)
+
+@app.route('/api/nodes/<node_id>/subtree', methods=['GET'])
+def get_node_subtree(node_id):
+    """
+    API: 分页加载以某个节点为根的子树，供大项目的树视图逐步加载。
+    参数: depth=最多展开的层数, limit=每页节点数, cursor=上一页的 next_cursor,
+         fields=逗号分隔的返回字段，例如 fields=title,status,thumbnail,child_count
+    """
+    fields = request.args.get('fields')
+    try:
+        subtree = database.get_subtree(
+            node_id,
+            max_depth=request.args.get('depth', type=int),
+            limit=request.args.get('limit', database.SUBTREE_DEFAULT_LIMIT, type=int),
+            cursor=request.args.get('cursor'),
+            fields=[f.strip() for f in fields.split(',') if f.strip()] if fields else None,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if subtree is None:
+        return jsonify({"error": f"Node {node_id} not found."}), 404
+    return jsonify(subtree)
 
 # --- 【新增】删除节点的API接口 ---
 @app.route('/api/nodes/<node_id>', methods=['DELETE'])
@@ -589,12 +831,60 @@ def delete_node(node_id):
     """API: 删除一个节点及其所有后代。"""
     try:
         # 调用我们新创建的数据库函数
-        database.delete_node_and_descendants(node_id)
+        deleted_assets = database.delete_node_and_descendants(node_id)
+        if deleted_assets is None:
+            return jsonify({"error": "删除节点失败。"}), 500
+        # 资源文件交给后台回收，不阻塞删除请求
+        asset_collector.submit(deleted_assets)
         return jsonify({"status": "success", "message": f"节点 {node_id} 及其后代已被删除。"}), 200
     except Exception as e:
         print(f"删除节点 {node_id} 时出错: {e}")
         return jsonify({"error": "删除节点失败。"}), 500
 
+@app.route('/api/assets/gc', methods=['GET'])
+def get_asset_gc_stats():
+    """API: 查看资源回收统计（已删除文件数、释放的字节数等）"""
+    return jsonify(asset_collector.get_stats())
+
+@app.route('/api/comfyui/stats', methods=['GET'])
+def get_comfyui_stats():
+    """API: 查看各 ComfyUI 后端的状态（健康状况、队列长度、显存）及通信统计（各接口调用次数、重试次数、耗时，WebSocket 连接状态）"""
+    return jsonify({"backends": comfyui_pool.get_stats()})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_result_cache_stats():
+    """API: 查看生成结果缓存的命中 / 未命中次数和节省的 GPU 时间"""
+    return jsonify(result_cache.get_stats())
+
+@app.route('/api/scheduler/stats', methods=['GET'])
+def get_scheduler_stats():
+    """API: 查看生成任务调度的并发上限、各优先级排队 / 执行中的任务数和估计的 GPU 秒数"""
+    return jsonify(generation_scheduler.get_stats())
+
+@app.route('/api/cache', methods=['DELETE'])
+def clear_result_cache():
+    """API: 清空生成结果缓存（不删除任何输出文件）"""
+    return jsonify({"removed": result_cache.clear()})
+
+# 需要 seed 的工作流列表
+REQUIRES_SEED_MODULES = [
+    'TextGenerateImage', 
+    'ImageGenerateImage_Basic', 
+    'ImageGenerateImage_Canny',
+    'ImageGenerateVideo', 
+    'ImageHDREstoration',
+    'PartialRepainting',
+    'Put_It_Here',
+    'TextGenerateVideo',
+    'CameraControl',
+    'FLFrameToVideo'  # 根据实际需要补充工作流ID
+]
+
+# 定义需要 audio_seed 的工作流列表
+REQUIRES_AUDIO_SEED_MODULES = [
+    'TextToAudio'
+]
+
 @app.route('/api/nodes', methods=['POST'])
 def create_node():
     # --- 本地模式 ---
@@ -655,8 +945,7 @@ def create_node():
                     raise Exception("保存 AddText 节点到数据库失败。")
 
             # 返回更新后的树
-            updated_tree = database.get_tree_as_json(tree_id)
-            return jsonify(updated_tree), 201
+            return tree_response(tree_id, 201)
 
         if module_id_from_frontend == 'AddWorkflow':
             print(">>> 检测到 AddWorkflow 模块，仅保存文本节点到数据库。")
@@ -768,8 +1057,7 @@ def create_node():
                 raise Exception("模拟节点执行成功但保存到数据库失败。")
 
             # 返回更新后的树
-            updated_tree = database.get_tree_as_json(tree_id)
-            return jsonify(updated_tree), 201
+            return tree_response(tree_id, 201)
 
         except Exception as e:
             print(f"本地模拟生成失败: {e}")
@@ -790,24 +1078,6 @@ def create_node():
 
     # --- 【新增】开始：处理随机 Seed ---
     # 检查 'seed' 是否存在并且其值是否为 None (来自前端的 null)
-    REQUIRES_SEED_MODULES = [
-        'TextGenerateImage', 
-        'ImageGenerateImage_Basic', 
-        'ImageGenerateImage_Canny',
-        'ImageGenerateVideo', 
-        'ImageHDREstoration',
-        'PartialRepainting',
-        'Put_It_Here',
-        'TextGenerateVideo',
-        'CameraControl',
-        'FLFrameToVideo'  # 根据实际需要补充工作流ID
-    ]
-
-    # 定义需要 audio_seed 的工作流列表
-    REQUIRES_AUDIO_SEED_MODULES = [
-        'TextToAudio'
-    ]
-
     # 处理 seed
     if module_id_from_frontend in REQUIRES_SEED_MODULES:
         # 若参数中没有 seed，新增并赋值
@@ -832,13 +1102,10 @@ def create_node():
     # --- 【修改结束】---
     
     
-    workflow = None
     final_module_id = module_id_from_frontend # 最终使用的模块ID
-    image_filenames = {} # 用于存储需要注入的文件名 { "node_title": "filename.png" }
-    video_filenames = {}
 
     try:
-        # --- 根据输入情况决定加载哪个工作流和处理输入 ---
+        # --- 无需 ComfyUI 的模块：直接保存节点 ---
         if final_module_id == 'AddText':
             print(">>> 检测到 AddText 模块，仅保存文本节点到数据库。")
             # "AddText" 模块没有 ComfyUI 操作，它只保存节点
@@ -887,8 +1154,7 @@ def create_node():
                     raise Exception("保存 AddText 节点到数据库失败。")
             
             # 返回更新后的树
-            updated_tree = database.get_tree_as_json(tree_id)
-            return jsonify(updated_tree), 201
+            return tree_response(tree_id, 201)
 
         if final_module_id == 'AddWorkflow':
             print(">>> 检测到 AddWorkflow 模块，仅保存文本节点到数据库。")
@@ -938,8 +1204,76 @@ def create_node():
                     raise Exception("保存 AddWorkflow 节点到数据库失败。")
             
             # 返回更新后的树
-            updated_tree = database.get_tree_as_json(tree_id)
-            return jsonify(updated_tree), 201
+            return tree_response(tree_id, 201)
+    except Exception as e:
+        print(f"保存节点时发生错误: {e}")
+        return jsonify({"error": "执行工作流时发生内部错误。"}), 500
+
+    # --- 生成类模块：写入任务队列后立即返回，由后台工作线程执行 run_generation_job ---
+    # 优先级（请求体 "priority": preview / final，默认按模块判断）和估计成本决定排队顺序，见 scheduler.py
+    schedule = generation_scheduler.plan(module_id_from_frontend, parameters, data.get('priority'))
+    job = generation_queue.submit(node_id, tree_id, {
+        "tree_id": tree_id,
+        "node_id": node_id,
+        "title": node_title,
+        "parent_ids": parent_ids,
+        "module_id": module_id_from_frontend,
+        "parameters": parameters,
+        # 强制重新生成：不复用生成结果缓存（请求体 "no_cache": true 或 ?no_cache=1）
+        "no_cache": bool(data.get('no_cache')) or request.args.get('no_cache', '').lower() in ('1', 'true'),
+    }, **schedule)
+    if not job:
+        return jsonify({"error": "创建生成任务失败。"}), 500
+
+    # 兼容旧的同步调用方式：?wait=true 时等生成结束再返回整棵树
+    if request.args.get('wait', '').lower() in ('1', 'true'):
+        job = generation_queue.wait(job['job_id'])
+        if job['status'] in ('failed', 'cancelled'):
+            return jsonify({"error": job['error'], "job": job}), job['error_code'] or 500
+        return tree_response(tree_id, 201)
+
+    response = jsonify({"job_id": job['job_id'], "node_id": node_id, "status": job['status'], "job": job})
+    response.headers['Location'] = f"/api/jobs/{job['job_id']}"
+    return response, 202
+
+
+def run_generation_job(job: dict):
+    """
+    生成任务的处理函数（在任务队列的工作线程中执行）：
+    根据输入情况构建工作流，提交到 ComfyUI 并等待结果，最后把输出写回节点。
+    出错时抛出 JobError（参数/输入问题为 400，其它为 500）。
+    """
+    data = job['payload']
+    tree_id = data.get('tree_id')
+    node_id = data.get('node_id')
+    node_title = data.get('title')
+    parent_ids = data.get('parent_ids', [])
+    module_id_from_frontend = data.get('module_id')
+    parameters = data.get('parameters', {})
+    progress_tracker.job_started(job)
+    deadline_seconds = GENERATION_DEADLINES.get(module_id_from_frontend, GENERATION_DEADLINE)
+    deadline_at = database.set_job_deadline(job['job_id'], datetime.now() + timedelta(seconds=deadline_seconds))
+
+    workflow = None
+    final_module_id = module_id_from_frontend # 最终使用的模块ID
+    image_filenames = {} # 用于存储需要注入的文件名 { "node_title": "filename.png" }
+    video_filenames = {}
+    fed_copies = {} # 重新执行下游时从父节点输出复制来的输入 {位置: 文件名}，生成成功后才写入节点
+    generated = False
+
+    try:
+        # --- 重新执行下游（见 /api/nodes/<id>/rerun）：先用父节点的新输出替换本节点对应位置的输入，输入没有变化时直接跳过 ---
+        rerun = data.get('rerun')
+        input_filenames = get_input_image_filenames_from_db(node_id)
+        fed_files = parent_output_files(parent_ids, module_id_from_frontend) if rerun else []
+        input_hash = compute_input_hash(module_id_from_frontend, parameters, fed_input_paths(fed_files, input_filenames))
+        if rerun and not rerun.get('force') and input_hash == database.get_node_input_hash(node_id) \
+                and node_outputs_exist(node_id):
+            print(f">>> 节点 {node_id} 的输入没有变化，跳过重新执行。")
+            database.set_node_status(node_id, 'completed')
+            return {"skipped": True, "input_hash": input_hash}
+        input_filenames, fed_copies = feed_parent_outputs(fed_files, input_filenames)
+
         # 情况3: Mask 输入 (最高优先级判断)
         # if 'mask_filename' in parameters:
         #     print(">>> 检测到 Mask 输入，加载 Inpainting 工作流...")
@@ -962,84 +1296,55 @@ def create_node():
         #     print(f"    - 原图: {original_image_filename}, Mask图: {mask_filename}")
 
         # 情况2: 两个父节点 -> 图像合并
-        count = get_input_image_count_from_db(node_id)
+        count = len(input_filenames)
         if count == 2:
             if(module_id_from_frontend == 'FLFrameToVideo'):
                 final_module_id = module_id_from_frontend 
                 workflow = load_workflow(final_module_id)
                 if workflow is None: raise ValueError(f"未找到 FLFrameToVideo 工作流 '{final_module_id}.json'")
-                image1_filename = get_input_image_filenames_from_db(node_id)[0]
-                image2_filename = get_input_image_filenames_from_db(node_id)[1]
+                image1_filename = input_filenames[0]
+                image2_filename = input_filenames[1]
                 image_filenames["LoadStartImage"] = image1_filename
                 image_filenames["LoadLastImage"] = image2_filename 
             elif(module_id_from_frontend == 'LayerStacking'):
                 final_module_id = module_id_from_frontend 
                 workflow = load_workflow(final_module_id)
                 if workflow is None: raise ValueError(f"未找到 LayerStacking 工作流 '{final_module_id}.json'")
-                image1_filename = get_input_image_filenames_from_db(node_id)[0]
-                image2_filename = get_input_image_filenames_from_db(node_id)[1]
+                image1_filename = input_filenames[0]
+                image2_filename = input_filenames[1]
                 image_filenames["LoadBackgroundImage"] = image1_filename
                 image_filenames["LoadMoveImage"] = image2_filename 
+            elif(module_id_from_frontend == 'ImageMerging'):
+                # 目标本身就是 ImageMerging：两张图片直接作为它的两个输入，不需要合并预处理
+                final_module_id = module_id_from_frontend
+                workflow = load_workflow(final_module_id)
+                if workflow is None: raise ValueError(f"未找到 ImageMerging 工作流 '{final_module_id}.json'")
+                image_filenames["LoadImage"] = input_filenames[0]
+                image_filenames["LoadImage(Move)"] = input_filenames[1]
             else:
-                print(">>> 检测到两个输入,执行ImageMerging工作流...")
-                image1_filename = get_input_image_filenames_from_db(node_id)[0]
-                image2_filename = get_input_image_filenames_from_db(node_id)[1]
-                image_filenames["LoadImage"] = image1_filename
-                image_filenames["LoadImage(Move)"] = image2_filename 
-                merge_workflow = load_workflow('ImageMerging')
-                for node_title, filename in image_filenames.items():
-                    target_node_id = find_node_id_by_title(merge_workflow, node_title)
-                    if target_node_id:
-                        merge_workflow[target_node_id]["inputs"]["image"] = filename
-                        print(f"    - 已将文件名 '{filename}' 注入到节点 '{node_title}' (ID: {target_node_id})。")
-                queued_prompt = queue_comfyui_prompt(merge_workflow)
-                prompt_id = queued_prompt['prompt_id']
-                # 使用WebSocket等待并获取输出
-                merge_outputs = get_comfyui_outputs(prompt_id)
-                print("merge_outputs",merge_outputs)
-
-                # 1. 提取 images 列表中的 URL 字符串（核心修复：列表取第一个元素）
-                merge_image_urls = merge_outputs.get("images", [])
-                if not merge_image_urls:
-                    raise Exception("ImageMerging 工作流执行成功，但未返回任何图片URL")
-                merge_image_url = merge_image_urls[0]  # 取第一个URL字符串（解决list无get的问题）
-                
-                # 2. 解析 URL 中的 filename 参数（从URL中提取文件名）
-                parsed_url = urllib.parse.urlparse(merge_image_url)
-                query_params = urllib.parse.parse_qs(parsed_url.query)
-                merge_filename_merge = query_params.get('filename', [None])[0]
-                if not merge_filename_merge:
-                    raise Exception("从图片URL中解析 filename 失败: " + merge_image_url)
-                print(f"    - 从URL解析出合并后的文件名: {merge_filename_merge}")
-                
-                # 3. 定义路径并复制文件到 input 目录
-                # 确保 COMFYUI_OUTPUT_PATH/COMFYUI_INPUT_PATH 已定义（按需修改路径）
-                # 若未全局定义，取消下面注释并修改为实际路径
-                # COMFYUI_OUTPUT_PATH = "/home/zhengzy/comfyui/comfyui/output"
-                # COMFYUI_INPUT_PATH = "/home/zhengzy/comfyui/comfyui/input"
-                
-                # 拼接完整路径
-                output_img_path = os.path.join(COMFYUI_OUTPUT_PATH, merge_filename_merge)
-                input_img_path = os.path.join(COMFYUI_INPUT_PATH, merge_filename_merge)
-                
-                # 确保 input 目录存在
-                os.makedirs(COMFYUI_INPUT_PATH, exist_ok=True)
-                
-                # 检查 output 目录文件是否存在
-                if not os.path.exists(output_img_path):
-                    raise FileNotFoundError(f"合并后的图片在 output 目录不存在: {output_img_path}")
-                
-                # 4. 复制文件到 input 目录
-                try:
-                    shutil.copy2(output_img_path, input_img_path)
-                    print(f"    - 已将合并后的图片复制到 input 目录: {input_img_path}")
-                except Exception as e:
-                    raise Exception(f"复制图片到 input 目录失败: {str(e)}")
-                
-                # 5. 注入 input 目录下的文件名
-                image_filenames["LoadImage"] = merge_filename_merge
+                image1_filename, image2_filename = input_filenames[:2]
                 final_module_id = module_id_from_frontend
-                workflow = load_workflow(final_module_id)            
+                workflow = load_workflow(final_module_id)
+                if workflow is None: raise ValueError(f"未找到工作流 '{final_module_id}.json'")
+                load_image_node_id = find_node_id_by_title(workflow, "LoadImage")
+                if not load_image_node_id:
+                    print(f"警告：工作流 '{final_module_id}' 中没有 LoadImage 节点，跳过 ImageMerging 预处理，两张输入图片不会被使用。")
+                else:
+                    print(">>> 检测到两个输入,将 ImageMerging 工作流拼接到目标工作流前...")
+                    merge_workflow = load_workflow('ImageMerging')
+                    if merge_workflow is None: raise ValueError("未找到 ImageMerging 工作流 'ImageMerging.json'")
+                    # 合并结果不再保存到 output 再复制到 input，而是直接连到目标工作流中 LoadImage 的下游
+                    save_node_id = next((nid for nid, node in merge_workflow.items() if node.get('class_type') == 'SaveImage'), None)
+                    if not save_node_id:
+                        raise ValueError("ImageMerging 工作流中没有 SaveImage 节点")
+                    merged_ids = workflow.splice(merge_workflow, merge_workflow[save_node_id]["inputs"]["images"], load_image_node_id, prefix='merge')
+                    # 按拼接后的节点 ID 注入两张图片，不按标题查找（目标工作流中可能有同名节点）
+                    for merge_title, filename in (("LoadImage", image1_filename), ("LoadImage(Move)", image2_filename)):
+                        merged_node_id = merged_ids.get(find_node_id_by_title(merge_workflow, merge_title))
+                        if not merged_node_id:
+                            raise ValueError(f"ImageMerging 工作流中没有连到合并结果的 '{merge_title}' 节点")
+                        workflow[merged_node_id]["inputs"]["image"] = filename
+                        print(f"    - 已将文件名 '{filename}' 注入到节点 '{merge_title}' (ID: {merged_node_id})。")
 
         # 情况1: 一个父节点 -> 标准图生图/图生视频
         elif count == 1:
@@ -1050,11 +1355,11 @@ def create_node():
 
             # 处理单个父节点的图像输入 (仅当模块需要时才处理)
             if final_module_id in ['ImageGenerateImage_Basic', 'ImageGenerateImage_Canny','ImageGenerateVideo','CameraControl','ImageCanny','ImageHDRestoration','PartialRepainting','Put_It_Here','RemoveBackground']: # 根据你的模块ID调整
-                image_filename = get_input_image_filenames_from_db(node_id)[0]
+                image_filename = input_filenames[0]
                 image_filenames["LoadImage"] = image_filename
                 print(f"    - 输入图: {image_filename}")
             elif final_module_id in ['FrameInterpolation']:
-                image_filename = get_input_image_filenames_from_db(node_id)[0]
+                image_filename = input_filenames[0]
                 video_filenames["LoadVideo"] = image_filename
             else:
                 print("    - 当前模块不需要父节点图像输入。")
@@ -1094,101 +1399,15 @@ def create_node():
         # --- 动态修改工作流 ---
         isVideo = (final_module_id in ['TextGenerateVideo', 'ImageGenerateVideo', 'FLFrameToVideo','CameraControl'])
     
-        # PROMPT
-        prompt_positive_node_id = find_node_id_by_title(workflow, "CLIP Text Encode (Positive Prompt)")
-        if prompt_positive_node_id:
-            # 优先使用 optimized_positive_prompt（前端传递的完整 prompt），没有则用原始 prompt
-            positive_prompt = parameters.get('optimized_positive_prompt', parameters.get('positive_prompt', ''))
-            workflow[prompt_positive_node_id]["inputs"]["text"] = positive_prompt
-
-        # prompt_negative_node_id = find_node_id_by_title(workflow, "CLIP Text Encode (Negative Prompt)")
-        # if prompt_negative_node_id:
-        #     # 同理：用 optimized_negative_prompt 执行生成
-        #     negative_prompt = parameters.get('optimized_negative_prompt', parameters.get('negative_prompt', ''))
-        #     workflow[prompt_negative_node_id]["inputs"]["text"] = negative_prompt
-
-        # WIDTH HEIGHT LENGTH BATCH_SIZE SPEED CAMERA
-        size_node_id = find_node_id_by_title(workflow, "Size_Setting")
-        if size_node_id:
-            if 'width' in parameters:
-                workflow[size_node_id]["inputs"]["width"] = parameters['width']
-            if 'height' in parameters:
-                workflow[size_node_id]["inputs"]["height"] = parameters['height']
-            if 'batch_size' in parameters and not isVideo:
-                workflow[size_node_id]["inputs"]["batch_size"] = parameters['batch_size']
-            if 'time' in parameters:
-                workflow[size_node_id]["inputs"]["length"] = parameters['time'] * 8 + 1
-            if 'speed' in parameters:
-                workflow[size_node_id]["inputs"]["speed"] = parameters['speed']
-            if 'camera_pose' in parameters:
-                workflow[size_node_id]["inputs"]["camera_pose"] = parameters['camera_pose']
-       
-        # RIFE
-        rife_node_id = find_node_id_by_title(workflow,"RIFE VFI")
-        if rife_node_id:
-            if 'multiplier' in parameters:
-                workflow[rife_node_id]["inputs"]["multiplier"] = parameters['multiplier']
-
-        # CANNY
-        canny_node_id = find_node_id_by_title(workflow,"Canny")
-        if canny_node_id:
-            if 'low_threshold' in parameters:
-                workflow[canny_node_id]["inputs"]["low_threshold"] = parameters['low_threshold']
-            if 'high_threshold' in parameters:
-                workflow[canny_node_id]["inputs"]["high_threshold"] = parameters['high_threshold']
-
-        # KSAMPLE
-        sampler_node_id = find_node_id_by_title(workflow, "KSampler")
-        if sampler_node_id:
-            if 'seed' in parameters:
-                workflow[sampler_node_id]["inputs"]["seed"] = parameters['seed']
-            if 'cfg' in parameters:
-                workflow[sampler_node_id]["inputs"]["cfg"] = parameters['cfg']
-            if 'steps' in parameters:
-                workflow[sampler_node_id]["inputs"]["steps"] = parameters['steps']
-            if 'denoise' in parameters:
-                workflow[sampler_node_id]["inputs"]["denoise"] = parameters['denoise']
-
-        # FLUX GUIDANCE
-        guidance_node_id = find_node_id_by_title(workflow, "FluxGuidance")
-        if guidance_node_id and 'guidance' in parameters:
-            workflow[guidance_node_id]["inputs"]["guidance"] = parameters['guidance']
-
-        # FPS
-        fps_node_id = find_node_id_by_title(workflow, "CreateVideo")
-        if fps_node_id:
-            if 'fps' in parameters:
-                workflow[fps_node_id]["inputs"]["fps"] = parameters['fps']
-        # video seed
+        # 按 workflow_bindings.json 编译好的计划注入参数，只遍历当前模板中存在的目标节点
+        # 视频的 batch_size 由 run_seed_variants 处理，scale 需要读取图片尺寸，在下面单独处理
+        handled_parameters = {'batch_size', 'scale'} if isVideo else {'scale'}
+        unknown_parameters = workflow.plan.apply(workflow, parameters, handled=handled_parameters)
+        if unknown_parameters:
+            print(f"警告：工作流 '{final_module_id}' 未使用以下参数: {', '.join(unknown_parameters)}")
+
         sampleradv_node_id = find_node_id_by_title(workflow, "KSamplerAdvanced2")
-        if sampleradv_node_id:
-            if 'seed' in parameters:
-                workflow[sampleradv_node_id]["inputs"]["noise_seed"] = parameters['seed']
-        
-        # STITICH
-        stitch_node_id = find_node_id_by_title(workflow,"Image Stitch")
-        if stitch_node_id:
-            if 'stitch' in parameters:
-                workflow[stitch_node_id]["inputs"]["stitch"] = parameters['stitch']
-
-        # REMBG
-        rembg_node_id = find_node_id_by_title(workflow,"Image Rembg (Remove Background)")
-        if rembg_node_id:
-            if 'model' in parameters:
-                workflow[rembg_node_id]["inputs"]["model"] = parameters['model']
-            if 'foreground_threshold' in parameters:
-                workflow[rembg_node_id]["inputs"]["alpha_matting_foreground_threshold"] = parameters['foreground_threshold']
-            if 'background_threshold' in parameters:
-                workflow[rembg_node_id]["inputs"]["alpha_matting_background_threshold"] = parameters['background_threshold']
-            if 'erode_size' in parameters:
-                workflow[rembg_node_id]["inputs"]["alpha_matting_erode_size"] = parameters['erode_size']
-        
-        # Layer Stack
         LayerStack_node_id = find_node_id_by_title(workflow,"LayerUtility: ImageBlendAdvance")
-        if LayerStack_node_id:
-            if 'position' in parameters:
-                workflow[LayerStack_node_id]["inputs"]["x_percent"] = parameters['position']*100
-
         LayerScale_node_id = find_node_id_by_title(workflow,"LayerUtility: ImageScaleByAspectRatio")
         if LayerScale_node_id and 'scale' in parameters:
             if image_filenames.get("LoadMoveImage"):
@@ -1205,81 +1424,542 @@ def create_node():
                 workflow[LayerStack_node_id]["inputs"]["scale_to_length"] = scaled_height
 
 
-        # VOICE
-        voice_node_id = find_node_id_by_title(workflow,"VibeVoice Single Speaker")
-        if voice_node_id:
-            if 'text' in parameters:
-                workflow[voice_node_id]["inputs"]["text"] = parameters['text']
-            if 'voice_speed_factor' in parameters:
-                workflow[voice_node_id]["inputs"]["voice_speed_factor"] = parameters['voice_speed_factor']
-            if 'audio_seed' in parameters:
-                workflow[voice_node_id]["inputs"]["seed"] = parameters['audio_seed']
-
         # --- 调用ComfyUI并等待结果 ---
-        queued_prompt = queue_comfyui_prompt(workflow)
-        prompt_id = queued_prompt['prompt_id']
-        
-        # 使用WebSocket等待并获取输出
-        outputs = get_comfyui_outputs(prompt_id)
-        
+        # 视频工作流没有 batch 输入，batch_size > 1 时一次性提交多个不同种子的变体
         batch_size = parameters.get('batch_size', 1)
-        toVideos = isVideo and batch_size > 1
-        
-        if ( toVideos ) :
-            for i in range(1, batch_size):
-                print(f"\n>>> 开始第 {i+1}/{batch_size} 批次生成")
-                
-                workflow[sampleradv_node_id]["inputs"]["noise_seed"] = random.randint(0, 999999999999999)
-                
-                # --- 【调用】当前批次的ComfyUI生成 ---
-                queued_prompt = queue_comfyui_prompt(workflow)
-                prompt_id = queued_prompt['prompt_id']
-                batch_outputs = get_comfyui_outputs(prompt_id)  # 单批生成的结果
-                
-                # --- 【合并】当前批次的输出到总结果 ---
-                outputs["images"].extend(batch_outputs.get("images", []))
-        
-       
-
+        variant_count = batch_size if isVideo and batch_size > 1 else 1
+        outputs, cache_hits = run_seed_variants(
+            workflow, sampleradv_node_id, variant_count,
+            module_id=final_module_id, use_cache=not data.get('no_cache'), job=job,
+            deadline=deadline_at.timestamp() if deadline_at else None,
+        )
+        generated = True
+
+
+    # 任何失败都要取消同一任务已提交、还没结束的其它变体（同时清理 comfyui_pool 中等待它们的记录）
+    except JobError as e:
+        cancel_job_prompts(job['job_id'], e.message)
+        raise
+    except PromptTimeout as e:
+        print(f"生成任务 {job['job_id']} 超过截止时间: {e}")
+        cancel_job_prompts(job['job_id'], '超过截止时间')
+        raise JobError(f"生成超过截止时间（{deadline_seconds:g} 秒），已中断。", 504) from e
+    except PromptExecutionError as e:
+        # 在其它进程中取消时，本进程只会收到 execution_interrupted（执行失败）
+        if database.is_job_cancel_requested(job['job_id']):
+            raise JobCancelled() from e
+        print(f"生成任务 {job['job_id']} 执行失败: {e}")
+        cancel_job_prompts(job['job_id'], '同一任务的其它变体执行失败')
+        raise JobError(str(e), 500) from e
     except (ValueError, FileNotFoundError, IOError) as e:
         print(f"处理节点创建请求时出错: {e}")
-        return jsonify({"error": str(e)}), 400 # 返回 400 Bad Request 更合适
+        cancel_job_prompts(job['job_id'], '任务失败')
+        raise JobError(str(e), 400) from e
     except Exception as e:
+        if database.is_job_cancel_requested(job['job_id']):
+            raise JobCancelled() from e
         print(f"执行 ComfyUI 工作流或数据库操作时发生未知错误: {e}")
-        return jsonify({"error": "执行工作流时发生内部错误。"}), 500
+        cancel_job_prompts(job['job_id'], '任务失败')
+        raise JobError("执行工作流时发生内部错误。", 500) from e
+    finally:
+        if not generated:
+            discard_input_copies(fed_copies)
+
+    # 读取已有 assets 并写回结果放在同一个事务中，避免与并发的上传互相覆盖；
+    # 重新执行下游时换上的输入也在这里写入，失败的任务不会留下「新输入 + 旧输出」
+    try:
+        with database.transaction():
+            node_data = database.get_node(node_id)
+            if not node_data:
+                raise JobError(f"节点 {node_id} 不存在于数据库中", 404)
+
+            # 1. 原样获取节点已有的 assets（包括 input 所有内容，不做任何修改）
+            existing_assets = node_data.get('assets', {})
+
+            # 2. 构建新的 assets：保留原有所有内容，仅新增/更新 output 字段
+            assets_with_output = {
+                **existing_assets,  # 解构原有 assets（原样保留 input 及其他所有字段）
+                "output": outputs   # 新增/覆盖 output 字段（生成结果）
+            }
+            superseded_inputs = write_fed_inputs(node_id, assets_with_output, fed_copies) if fed_copies else []
 
-    node_data = database.get_node(node_id)
-    if not node_data:
-        print(f"节点 {node_id} 不存在于数据库中")
-        return []
 
-    # 1. 原样获取节点已有的 assets（包括 input 所有内容，不做任何修改）
-    existing_assets = node_data.get('assets', {})
+            # --- 在数据库中记录新节点 ---
+            database.update_node(
+                node_id=node_id,
+                payload={
+                        "title": node_title,
+                        "module_id": final_module_id,
+                        "assets": assets_with_output,
+                        "parameters": parameters,
+                        "status":'completed'
+                    }
 
-    # 2. 构建新的 assets：保留原有所有内容，仅新增/更新 output 字段
-    assets_with_output = {
-        **existing_assets,  # 解构原有 assets（原样保留 input 及其他所有字段）
-        "output": outputs   # 新增/覆盖 output 字段（生成结果）
-    }
+            )
+            database.set_node_input_hash(node_id, input_hash)
+    except BaseException:
+        discard_input_copies(fed_copies)
+        raise
+    asset_collector.submit(superseded_inputs)
 
+    # 记录到任务的 result 中，前端可以提示哪些参数没有生效、结果是否来自缓存
+    return {"unknown_parameters": unknown_parameters, "cache_hits": cache_hits}
+
+
+# 生成任务队列（工作线程数可通过环境变量 GENERATION_WORKERS 调整）
+generation_queue = JobQueue(run_generation_job, workers=GENERATION_WORKERS,
+                            claim_limits=generation_scheduler.claim_limits())
+generation_queue.add_finish_listener(progress_tracker.job_finished)
+# prompt 因后端不可用被改到其它后端重新执行时，同步更新 job_prompts 和节点上的记录
+comfyui_pool.add_resubmit_listener(database.replace_job_prompt)
 
-    # --- 在数据库中记录新节点 ---
-    database.update_node(
-        node_id=node_id,
-        payload={
-                "title": node_title,
-                "module_id": final_module_id,
-                "assets": assets_with_output,
-                "parameters": parameters,
-                "status":'completed'
-            }
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    API: 查询生成任务状态。
+    带 ?wait=<秒> 时为长轮询：任务结束或超时（最多 60 秒）才返回。
+    """
+    wait_seconds = request.args.get('wait', type=float)
+    if wait_seconds:
+        job = generation_queue.wait(job_id, timeout=min(wait_seconds, 60))
+    else:
+        job = database.get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found."}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """
+    API: 取消生成任务。排队中的任务直接取消；执行中的任务中断（/interrupt）或从 ComfyUI 队列删除它的 prompt，
+    由执行它的工作线程把任务标记为 cancelled。
+    """
+    job = database.get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found."}), 404
+    if job['status'] in FINISHED_STATUSES:
+        return jsonify({"error": f"任务已结束（{job['status']}），无法取消。", "job": job}), 409
+    if not database.cancel_queued_job(job_id) and database.request_job_cancel(job_id):
+        cancelled = cancel_job_prompts(job_id, '用户取消')
+        print(f">>> 已请求取消任务 {job_id}，取消了 {cancelled} 个 ComfyUI prompt。")
+    return jsonify(database.get_job(job_id)), 202
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """
+    API: 以 Server-Sent Events 推送生成任务的进度（排队位置、正在执行的节点、步数、预计剩余时间），
+    每条消息的 data 是进度快照（字段见 progress.py）；任务结束时发送 event: done（data 为任务字典）后关闭。
+    """
+    job = database.get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found."}), 404
+    return _job_event_stream(job)
+
+@app.route('/api/nodes/<node_id>/events', methods=['GET'])
+def stream_node_events(node_id):
+    """API: 推送节点最近一个生成任务的进度，格式同 /api/jobs/<job_id>/events"""
+    jobs = database.get_jobs(node_id=node_id, limit=1)
+    if not jobs:
+        return jsonify({"error": f"No job found for node {node_id}."}), 404
+    return _job_event_stream(jobs[0])
+
+def _job_event_stream(job: dict) -> Response:
+    def sse(event: str, payload: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+
+    def stream():
+        job_id = job['job_id']
+        if job['status'] in FINISHED_STATUSES:
+            yield sse('done', job)
+            return
+        subscriber = progress_tracker.subscribe(job_id)
+        try:
+            last_sent = time.monotonic()
+            state = progress_tracker.snapshot(job_id) or {"job_id": job_id, "node_id": job['node_id'], "status": job['status']}
+            yield sse('progress', state)
+            while True:
+                try:
+                    state = subscriber.get(timeout=SSE_REFRESH_INTERVAL)
+                except queue.Empty:
+                    state = None
+                if state is None or state.get('stage') == 'done':
+                    # 任务可能已经结束，或者在其它进程中执行（收不到进度事件），以数据库状态为准
+                    latest = database.get_job(job_id)
+                    if latest is None or latest['status'] in FINISHED_STATUSES:
+                        yield sse('done', latest or job)
+                        return
+                    state = progress_tracker.snapshot(job_id)  # 刷新排队位置
+                if state is not None:
+                    yield sse('progress', state)
+                    last_sent = time.monotonic()
+                elif time.monotonic() - last_sent > SSE_KEEPALIVE_INTERVAL:
+                    yield ": keepalive\n\n"
+                    last_sent = time.monotonic()
+        finally:
+            progress_tracker.unsubscribe(job_id, subscriber)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # 禁止 nginx 缓冲，事件才能即时到达浏览器
+    })
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """API: 列出生成任务，可按 node_id / status 过滤"""
+    jobs = database.get_jobs(
+        node_id=request.args.get('node_id'),
+        status=request.args.get('status'),
+        limit=min(request.args.get('limit', 100, type=int), 1000),
     )
+    return jsonify({"jobs": jobs})
 
 
-    # --- 返回更新后的树结构 ---
-    updated_tree = database.get_tree_as_json(tree_id)
-    return jsonify(updated_tree), 201
+def expand_sweep(base_parameters: dict, grid: dict, seeds, seed_param: str | None) -> list[tuple[dict, dict]]:
+    """
+    把参数网格和随机种子展开为变体列表 [(完整参数, 本变体变化的参数), ...]。
+    grid 形如 {"cfg": [5, 7], "steps": [20, 30]}，取笛卡尔积；
+    seeds 为整数 N（N 个不重复的随机种子）或种子列表，与网格再取笛卡尔积。参数不合法时抛出 ValueError。
+    """
+    if not isinstance(grid, dict):
+        raise ValueError("grid 必须是 {参数名: [取值, ...]} 形式的对象")
+    axes = []
+    for key, values in grid.items():
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"grid 中参数 '{key}' 的取值必须是非空列表")
+        axes.append((key, values))
+    if seeds:
+        if seed_param is None:
+            raise ValueError("该工作流没有随机种子参数，不能使用 seeds")
+        if isinstance(seeds, bool) or not isinstance(seeds, (int, list)) or (isinstance(seeds, int) and seeds < 0):
+            raise ValueError("seeds 必须是种子数量或种子列表")
+        axes.append((seed_param, seeds if isinstance(seeds, list) else [None] * seeds))
+    if not axes:
+        raise ValueError("需要提供 grid 或 seeds")
+
+    total = 1
+    for _, values in axes:
+        total *= len(values)
+    if total > SWEEP_MAX_VARIANTS:
+        raise ValueError(f"参数扫描共 {total} 个变体，超过上限 {SWEEP_MAX_VARIANTS}")
+    if isinstance(seeds, int) and seeds:
+        # N 个不重复、且与基准节点不同的随机种子
+        max_seed = 4294967295 if seed_param == 'audio_seed' else 999999999999999
+        used = {base_parameters.get(seed_param)}
+        values = []
+        while len(values) < seeds:
+            seed = random.randint(0, max_seed)
+            if seed not in used:
+                used.add(seed)
+                values.append(seed)
+        axes[-1] = (seed_param, values)
+    keys = [key for key, _ in axes]
+    return [
+        (dict(base_parameters, **dict(zip(keys, combo))), dict(zip(keys, combo)))
+        for combo in itertools.product(*(values for _, values in axes))
+    ]
+
+@app.route('/api/nodes/<node_id>/sweep', methods=['POST'])
+def create_sweep(node_id):
+    """
+    API: 参数扫描。以 node_id 为基准节点，按参数网格 / 随机种子展开成多个变体，每个变体是基准节点的兄弟节点
+    （默认与基准节点相同的父节点和模块），并复制基准节点的输入（assets.input，文件本身共用）。
+    全部节点和生成任务在一个事务中创建，随即返回 202，各变体由任务队列的工作线程并发提交到 ComfyUI。
+    请求体:
+        grid        {"cfg": [5, 7], "steps": [20, 30], "camera_pose": [...]}，取笛卡尔积
+        seeds       N（N 个不重复的随机种子）或种子列表，与网格再取笛卡尔积
+        parameters  在基准节点参数上覆盖的公共参数（可选）
+        module_id / parent_ids / priority / no_cache   同 POST /api/nodes，前两者默认与基准节点相同
+    结果通过 GET /api/sweeps/<sweep_id>（?wait=秒 长轮询）或 GET /api/sweeps/<sweep_id>/events（SSE，每完成一个变体推送一次）获取。
+    """
+    if APP_MODE == 'local':
+        return jsonify({"error": "本地模式不支持参数扫描。"}), 501
+    base = database.get_node(node_id)
+    if base is None:
+        return jsonify({"error": f"Node {node_id} not found."}), 404
+    data = request.get_json(silent=True) or {}
+    module_id = data.get('module_id') or base['module_id']
+    title_index = workflow_registry.get_title_index(module_id)
+    if title_index is None:
+        return jsonify({"error": f"模块 '{module_id}' 不是生成类工作流，不能进行参数扫描。"}), 400
+    base_input = (base.get('assets') or {}).get('input') or {}
+    # 模板中有 LoadImage / LoadVideo 等加载节点的模块需要输入文件，没有输入时会退回模板里的默认图片
+    if any(title.startswith('Load') for title in title_index) and not base_input.get('images'):
+        return jsonify({"error": f"模块 '{module_id}' 需要输入图像，但基准节点 {node_id} 没有输入。"}), 400
+    parent_ids = data.get('parent_ids', base.get('parent_ids') or [])
+    base_parameters = dict(base.get('parameters') or {}, **(data.get('parameters') or {}))
+    seed_param = 'seed' if module_id in REQUIRES_SEED_MODULES else 'audio_seed' if module_id in REQUIRES_AUDIO_SEED_MODULES else None
+    try:
+        expanded = expand_sweep(base_parameters, data.get('grid') or {}, data.get('seeds'), seed_param)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    sweep_id = str(uuid.uuid4())
+    base_title = base.get('title') or module_id
+    no_cache = bool(data.get('no_cache')) or request.args.get('no_cache', '').lower() in ('1', 'true')
+    variants = []
+    for index, (parameters, varied) in enumerate(expanded):
+        if seed_param and parameters.get(seed_param) is None:
+            parameters[seed_param] = random.randint(0, 4294967295 if seed_param == 'audio_seed' else 999999999999999)
+        variant_node_id = str(uuid.uuid4())
+        title = f"{base_title} ({', '.join(f'{key}={value}' for key, value in varied.items())})"
+        variants.append({
+            "node_id": variant_node_id, "parent_ids": parent_ids, "module_id": module_id,
+            "parameters": parameters, "title": title,
+            "assets": {"input": base_input} if base_input else {},
+            "payload": {
+                "tree_id": base['tree_id'], "node_id": variant_node_id, "title": title, "parent_ids": parent_ids,
+                "module_id": module_id, "parameters": parameters, "no_cache": no_cache,
+                "sweep": {"sweep_id": sweep_id, "index": index, "base_node_id": node_id, "varied": varied},
+            },
+            "schedule": generation_scheduler.plan(module_id, parameters, data.get('priority')),
+        })
+    if database.create_sweep(base['tree_id'], sweep_id, variants) is None:
+        return jsonify({"error": "创建参数扫描失败。"}), 500
+    generation_queue.wake()
+    print(f">>> 参数扫描 {sweep_id}: 基于节点 {node_id} 创建了 {len(variants)} 个变体")
+
+    response = jsonify(sweep_status(sweep_id))
+    response.headers['Location'] = f"/api/sweeps/{sweep_id}"
+    return response, 202
+
+def sweep_variant(job: dict) -> dict:
+    """参数扫描中一个变体的状态；已完成的变体带上节点的 assets"""
+    sweep = job['payload'].get('sweep') or {}
+    variant = {"index": sweep.get('index'), "node_id": job['node_id'], "job_id": job['job_id'],
+               "status": job['status'], "error": job['error'], "varied": sweep.get('varied')}
+    if job['status'] == 'completed':
+        node = database.get_node(job['node_id'])
+        variant['assets'] = node['assets'] if node else None
+    return variant
+
+def sweep_status(sweep_id: str, jobs: list[dict] | None = None, with_variants: bool = True) -> dict | None:
+    """参数扫描的汇总状态（各状态的变体数），with_variants 时附带每个变体的状态和结果"""
+    jobs = jobs if jobs is not None else database.get_sweep_jobs(sweep_id)
+    if not jobs:
+        return None
+    counts = {}
+    for job in jobs:
+        counts[job['status']] = counts.get(job['status'], 0) + 1
+    sweep = jobs[0]['payload'].get('sweep') or {}
+    status = {
+        "sweep_id": sweep_id, "tree_id": jobs[0]['tree_id'], "base_node_id": sweep.get('base_node_id'),
+        "total": len(jobs), "counts": counts, "done": all(job['status'] in FINISHED_STATUSES for job in jobs),
+    }
+    if with_variants:
+        status['variants'] = [sweep_variant(job) for job in jobs]
+    return status
+
+@app.route('/api/sweeps/<sweep_id>', methods=['GET'])
+def get_sweep(sweep_id):
+    """
+    API: 查询参数扫描的进度和各变体的结果。
+    带 ?wait=<秒> 时为长轮询：全部变体结束或超时（最多 60 秒）才返回。
+    """
+    wait_seconds = min(request.args.get('wait', 0, type=float), 60)
+    deadline = time.monotonic() + wait_seconds
+    jobs = database.get_sweep_jobs(sweep_id)
+    while jobs and time.monotonic() < deadline and not all(job['status'] in FINISHED_STATUSES for job in jobs):
+        generation_queue.wait_for_any(min(deadline - time.monotonic(), SSE_REFRESH_INTERVAL))
+        jobs = database.get_sweep_jobs(sweep_id)
+    status = sweep_status(sweep_id, jobs)
+    if status is None:
+        return jsonify({"error": f"Sweep {sweep_id} not found."}), 404
+    return jsonify(status)
+
+@app.route('/api/sweeps/<sweep_id>/events', methods=['GET'])
+def stream_sweep_events(sweep_id):
+    """
+    API: 以 Server-Sent Events 推送参数扫描的结果：先发送一次 sweep（全部变体的当前状态），
+    之后每有一个变体结束发送一次 result，全部结束后发送 done 并关闭连接。单个变体的执行进度见 /api/jobs/<id>/events。
+    """
+    jobs = database.get_sweep_jobs(sweep_id)
+    if not jobs:
+        return jsonify({"error": f"Sweep {sweep_id} not found."}), 404
+
+    def sse(event: str, payload: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+
+    def stream():
+        reported = {job['job_id'] for job in jobs if job['status'] in FINISHED_STATUSES}
+        yield sse('sweep', sweep_status(sweep_id, jobs))
+        last_sent = time.monotonic()
+        while True:
+            latest = database.get_sweep_jobs(sweep_id)
+            for job in latest:
+                if job['status'] in FINISHED_STATUSES and job['job_id'] not in reported:
+                    reported.add(job['job_id'])
+                    yield sse('result', sweep_variant(job))
+                    last_sent = time.monotonic()
+            if len(reported) >= len(latest):
+                yield sse('done', sweep_status(sweep_id, latest, with_variants=False))
+                return
+            if time.monotonic() - last_sent > SSE_KEEPALIVE_INTERVAL:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+            # 其它进程中结束的任务不会通知本进程，最多等 SSE_REFRESH_INTERVAL 秒再查一次数据库
+            generation_queue.wait_for_any(SSE_REFRESH_INTERVAL)
+
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+
+def plan_rerun(descendants: list[dict]) -> tuple[list[tuple[dict, list[str]]], list[str]]:
+    """
+    把后代节点（database.get_descendant_graph 的结果）按拓扑顺序排列（Kahn 算法，同时就绪的按到起点的距离），
+    返回 ([(生成类节点, 它依赖的生成类节点 ID 列表), ...], [非生成类节点 ID, ...])。
+    依赖只包含本次重新执行的节点；非生成类节点（AddText / AddWorkflow 等）不创建任务，它的下游改为依赖它的上游任务。
+    父子关系存在环时抛出 ValueError。
+    """
+    nodes = {node['node_id']: node for node in descendants}
+    children, waiting = {}, {}
+    for node_id, node in nodes.items():
+        parents = [parent_id for parent_id in node['parent_ids'] if parent_id in nodes]
+        waiting[node_id] = len(parents)
+        for parent_id in parents:
+            children.setdefault(parent_id, []).append(node_id)
+    ready = [node_id for node_id in nodes if waiting[node_id] == 0]
+    order = []
+    while ready:
+        node_id = ready.pop(0)
+        order.append(node_id)
+        for child_id in children.get(node_id, []):
+            waiting[child_id] -= 1
+            if waiting[child_id] == 0:
+                ready.append(child_id)
+    if len(order) < len(nodes):
+        raise ValueError("下游节点的父子关系存在环，无法确定执行顺序。")
+
+    steps, passthrough = [], []
+    upstream = {}  # 节点 -> 它的下游需要等待的生成类节点
+    for node_id in order:
+        node = nodes[node_id]
+        depends_on = list(dict.fromkeys(
+            dependency for parent_id in node['parent_ids'] if parent_id in nodes for dependency in upstream[parent_id]
+        ))
+        if workflow_registry.get_title_index(node['module_id']) is None:
+            passthrough.append(node_id)
+            upstream[node_id] = depends_on
+        else:
+            steps.append((node, depends_on))
+            upstream[node_id] = [node_id]
+    return steps, passthrough
+
+@app.route('/api/nodes/<node_id>/rerun', methods=['POST'])
+def create_rerun(node_id):
+    """
+    API: 重新执行下游。node_id 的输出变化后（重新生成或重新上传），沿 node_parents 找出它的全部后代，
+    按拓扑顺序为其中的生成类节点各创建一个任务（在一个事务中），随即返回 202。
+    每个任务只依赖它上游的生成任务，依赖全部完成后才会被工作线程领取，互不依赖的分支并发执行。
+    执行时先把父节点的新输出复制为节点的输入（见 feed_parent_outputs），输入哈希与上次生成时相同的节点直接跳过；
+    某个任务失败或取消时，依赖它的任务一并取消，这些节点保留原有输出。
+    请求体（可选）:
+        force       true 时不按输入哈希跳过，全部重新生成
+        priority / no_cache   同 POST /api/nodes
+    结果通过 GET /api/reruns/<rerun_id>（?wait=秒 长轮询）获取，POST /api/reruns/<rerun_id>/cancel 取消。
+    """
+    if APP_MODE == 'local':
+        return jsonify({"error": "本地模式不支持重新执行下游。"}), 501
+    root = database.get_node(node_id)
+    if root is None:
+        return jsonify({"error": f"Node {node_id} not found."}), 404
+    data = request.get_json(silent=True) or {}
+    try:
+        steps, passthrough = plan_rerun(database.get_descendant_graph(node_id))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    if not steps:
+        return jsonify({"error": f"节点 {node_id} 没有需要重新执行的下游生成节点。"}), 400
+    busy = [
+        node['node_id'] for node, _ in steps
+        if any(database.get_jobs(node_id=node['node_id'], status=status, limit=1) for status in ('queued', 'running'))
+    ]
+    if busy:
+        return jsonify({"error": "部分下游节点已有排队中或执行中的生成任务。", "node_ids": busy}), 409
+
+    rerun_id = str(uuid.uuid4())
+    force = bool(data.get('force'))
+    no_cache = bool(data.get('no_cache')) or request.args.get('no_cache', '').lower() in ('1', 'true')
+    rerun_steps = []
+    for index, (node, depends_on) in enumerate(steps):
+        rerun_steps.append({
+            "node_id": node['node_id'],
+            "depends_on": depends_on,
+            "payload": {
+                "tree_id": node['tree_id'], "node_id": node['node_id'], "title": node['title'],
+                "parent_ids": node['parent_ids'], "module_id": node['module_id'], "parameters": node['parameters'],
+                "no_cache": no_cache,
+                "rerun": {"rerun_id": rerun_id, "index": index, "root_node_id": node_id,
+                          "depends_on": depends_on, "force": force},
+            },
+            "schedule": generation_scheduler.plan(node['module_id'], node['parameters'], data.get('priority')),
+        })
+    if database.create_rerun(root['tree_id'], rerun_id, rerun_steps) is None:
+        return jsonify({"error": "创建重新执行任务失败。"}), 500
+    generation_queue.wake()
+    print(f">>> 重新执行 {rerun_id}: 节点 {node_id} 的下游共 {len(rerun_steps)} 个生成节点"
+          f"（另有 {len(passthrough)} 个非生成节点保持不变）")
+
+    status = rerun_status(rerun_id)
+    status['passthrough'] = passthrough
+    response = jsonify(status)
+    response.headers['Location'] = f"/api/reruns/{rerun_id}"
+    return response, 202
+
+def rerun_step(job: dict) -> dict:
+    """重新执行中一个节点的状态；skipped 表示输入没有变化、没有重新生成"""
+    rerun = job['payload'].get('rerun') or {}
+    return {"index": rerun.get('index'), "node_id": job['node_id'], "job_id": job['job_id'],
+            "status": job['status'], "error": job['error'], "depends_on": rerun.get('depends_on', []),
+            "skipped": bool((job['result'] or {}).get('skipped'))}
+
+def rerun_status(rerun_id: str, jobs: list[dict] | None = None) -> dict | None:
+    """重新执行的汇总状态（各状态的节点数、跳过的节点数）和每个节点的状态"""
+    jobs = jobs if jobs is not None else database.get_rerun_jobs(rerun_id)
+    if not jobs:
+        return None
+    counts = {}
+    for job in jobs:
+        counts[job['status']] = counts.get(job['status'], 0) + 1
+    steps = [rerun_step(job) for job in jobs]
+    return {
+        "rerun_id": rerun_id, "tree_id": jobs[0]['tree_id'],
+        "root_node_id": (jobs[0]['payload'].get('rerun') or {}).get('root_node_id'),
+        "total": len(jobs), "counts": counts, "skipped": sum(1 for step in steps if step['skipped']),
+        "done": all(job['status'] in FINISHED_STATUSES for job in jobs), "nodes": steps,
+    }
+
+@app.route('/api/reruns/<rerun_id>', methods=['GET'])
+def get_rerun(rerun_id):
+    """
+    API: 查询重新执行下游的进度。
+    带 ?wait=<秒> 时为长轮询：全部节点结束或超时（最多 60 秒）才返回。
+    """
+    wait_seconds = min(request.args.get('wait', 0, type=float), 60)
+    deadline = time.monotonic() + wait_seconds
+    jobs = database.get_rerun_jobs(rerun_id)
+    while jobs and time.monotonic() < deadline and not all(job['status'] in FINISHED_STATUSES for job in jobs):
+        generation_queue.wait_for_any(min(deadline - time.monotonic(), SSE_REFRESH_INTERVAL))
+        jobs = database.get_rerun_jobs(rerun_id)
+    status = rerun_status(rerun_id, jobs)
+    if status is None:
+        return jsonify({"error": f"Rerun {rerun_id} not found."}), 404
+    return jsonify(status)
+
+@app.route('/api/reruns/<rerun_id>/cancel', methods=['POST'])
+def cancel_rerun(rerun_id):
+    """API: 取消重新执行中尚未结束的全部任务（排队中的直接取消，执行中的中断），已完成的节点保留新结果"""
+    jobs = database.get_rerun_jobs(rerun_id)
+    if not jobs:
+        return jsonify({"error": f"Rerun {rerun_id} not found."}), 404
+    for job in jobs:
+        if job['status'] in FINISHED_STATUSES:
+            continue
+        if not database.cancel_queued_job(job['job_id']) and database.request_job_cancel(job['job_id']):
+            cancel_job_prompts(job['job_id'], '用户取消')
+    return jsonify(rerun_status(rerun_id)), 202
 
 
 # --- 【核心修改】视频拼接 API 接口 (使用 moviepy) ---
@@ -1524,6 +2204,73 @@ def download_stitched_video(filename):
     except FileNotFoundError:
         abort(404)
 
+_initialized_project_dbs: set[str] = set() # 本进程中已建表并执行过迁移的项目数据库
+_initialized_project_dbs_lock = threading.Lock()
+
+def resolve_project_db(db_name: str | None) -> str:
+    """
+    把请求中的 db 参数（如 video_tree_camel.db）解析为 backend/ 下的数据库路径，默认为当前数据库（启动时已初始化）。
+    其它项目数据库第一次打开时执行 init_db（建表、迁移），之后的请求直接使用。
+    """
+    if not db_name:
+        return database.DATABASE_FILE
+    if not re.fullmatch(r'[\w.-]+\.db', db_name):
+        raise ValueError(f"无效的数据库名称: {db_name}")
+    db_path = os.path.join(BASE_DIR, db_name)
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"数据库 {db_name} 不存在")
+    with _initialized_project_dbs_lock:
+        if db_path not in _initialized_project_dbs and database.init_db(db_path):
+            _initialized_project_dbs.add(db_path)
+    return db_path
+
+@app.route('/api/trees/<int:tree_id>/export', methods=['GET'])
+def export_tree_ndjson(tree_id):
+    """API: 以 NDJSON 流的形式导出一棵树。参数 db=项目数据库文件名（默认当前数据库）"""
+    try:
+        db_path = resolve_project_db(request.args.get('db'))
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    lines = tree_transfer.export_tree(tree_id, db_path)
+    try:
+        first_line = next(lines)  # 先读出第一行，树不存在时可以正常返回 404
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+
+    def generate():
+        yield first_line
+        yield from lines
+
+    return Response(
+        generate(), mimetype='application/x-ndjson',
+        headers={"Content-Disposition": f"attachment; filename=tree_{tree_id}.ndjson"}
+    )
+
+@app.route('/api/trees/import', methods=['POST'])
+def import_tree_ndjson():
+    """
+    API: 从请求体中的 NDJSON 流导入一棵树。
+    参数: db=目标数据库文件名（默认当前数据库）, tree_id=合并到已有的树（默认新建）, name=新建树的名称
+    """
+    try:
+        db_path = resolve_project_db(request.args.get('db'))
+    except (ValueError, FileNotFoundError) as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        stats = tree_transfer.import_tree(
+            request.stream, db_path,
+            into_tree_id=request.args.get('tree_id', type=int),
+            name=request.args.get('name'),
+        )
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except (ValueError, KeyError) as e:
+        return jsonify({"error": f"导入数据格式错误: {e}"}), 400
+    except sqlite3.Error as e:
+        print(f"导入树失败: {e}")
+        return jsonify({"error": f"导入失败: {e}"}), 500
+    return jsonify(stats), 201
+
 @app.route('/api/database/download', methods=['GET'])
 def download_database():
     """提供SQLite数据库文件的下载"""
@@ -1543,6 +2290,19 @@ def download_database():
 if __name__ == '__main__':
     # 在启动应用前，确保数据库和表已创建
     database.init_db()
+    # 预加载所有工作流模板
+    workflow_registry.load_all()
+    # 淘汰过期 / 超量的生成结果缓存
+    result_cache.evict()
+    app.debug = True
+    # debug 模式下 Werkzeug 的 reloader 会在监视进程和实际提供服务的子进程（WERKZEUG_RUN_MAIN=true）中各执行一次
+    # __main__，后台线程只在提供服务的进程中启动，否则两个进程都会领取并执行任务；不使用 reloader 时直接启动
+    if not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        # 服务器模式下开始轮询各 ComfyUI 后端的状态
+        if APP_MODE != 'local':
+            comfyui_pool.start()
+        # 启动生成任务的工作线程（会把已退出的进程遗留的任务重新排队）
+        generation_queue.start()
     
     # 初始化时可以创建一个默认的树/项目
     if not database.get_tree_as_json(1):
@@ -1561,5 +2321,5 @@ if __name__ == '__main__':
         print(f"已创建默认项目，ID为: {tree_id}")
 
 
-    app.run(host='0.0.0.0', port=5005, debug=True)
+    app.run(host='0.0.0.0', port=5005, debug=app.debug)
 
@@ -0,0 +1,97 @@
+"""
+资源文件回收：删除节点后，在后台线程中清理不再被任何节点引用的图片/视频/音频文件。
+
+删除接口只负责把被删节点引用的文件（来自 node_assets 表）交给 AssetCollector，真正的磁盘清理在后台完成，
+不会拖慢删除请求。每个文件删除前都会重新检查数据库中是否仍有节点引用它。
+"""
+import os
+import queue
+import threading
+
+import database
+
+
+class AssetCollector:
+    """后台资源回收器，路径解析规则与 /view 接口保持一致"""
+
+    def __init__(self, input_path: str, output_path: str, collect_output: bool = True):
+        self.input_path = os.path.abspath(input_path)
+        self.output_path = os.path.abspath(output_path)
+        # 本地模式下 output 目录里是被多个节点反复复用的示例文件，不能回收
+        self.collect_output = collect_output
+        self.stats = {"files_deleted": 0, "bytes_freed": 0, "files_skipped": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='asset-gc', daemon=True)
+            self._thread.start()
+
+    def submit(self, deleted_assets: list[dict]):
+        """提交被删除节点引用的文件 [{filename, subfolder, storage_type}, ...]，由后台线程回收"""
+        if deleted_assets:
+            self._queue.put(deleted_assets)
+            self.start()
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            return dict(self.stats, pending=self._queue.qsize())
+
+    def _run(self):
+        while True:
+            deleted_assets = self._queue.get()
+            try:
+                self.collect(deleted_assets)
+            except Exception as e:
+                print(f"资源回收出错: {e}")
+            finally:
+                self._queue.task_done()
+
+    def resolve_path(self, filename: str, subfolder: str, file_type: str) -> str | None:
+        """把资源记录映射为磁盘路径；不存在、越界或不允许回收时返回 None"""
+        if file_type == 'input':
+            root = self.input_path
+            candidates = [os.path.join(root, filename)]
+        else:
+            if not self.collect_output:
+                return None
+            root = self.output_path
+            candidates = [os.path.join(root, subfolder, filename)]
+            if subfolder != 'video':
+                candidates.append(os.path.join(root, 'video', filename))
+
+        for candidate in candidates:
+            path = os.path.abspath(candidate)
+            # 防止 filename / subfolder 中的 .. 跳出资源目录
+            if os.path.commonpath([path, root]) != root:
+                return None
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def collect(self, deleted_assets: list[dict]) -> dict:
+        """同步回收一批资源，返回本次的统计结果"""
+        result = {"files_deleted": 0, "bytes_freed": 0, "files_skipped": 0, "errors": 0}
+        for asset in deleted_assets:
+            filename = asset['filename']
+            path = self.resolve_path(filename, asset['subfolder'], asset['storage_type'])
+            if not path or database.is_asset_referenced(filename):
+                result["files_skipped"] += 1
+                continue
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                result["files_deleted"] += 1
+                result["bytes_freed"] += size
+            except OSError as e:
+                print(f"删除资源文件 {path} 失败: {e}")
+                result["errors"] += 1
+
+        with self._stats_lock:
+            for key, value in result.items():
+                self.stats[key] += value
+        if result["files_deleted"]:
+            print(f"资源回收: 删除 {result['files_deleted']} 个文件，释放 {result['bytes_freed'] / 1024 / 1024:.2f} MB")
+        return result
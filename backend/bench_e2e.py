@@ -0,0 +1,323 @@
+"""
+端到端吞吐量基准：多个客户端线程并发调用 POST /api/nodes（生成）、POST /api/stitch（拼接）和
+GET /api/trees/<id>（读取整棵树），统计每类请求的吞吐量和 p50 / p95 / p99 延迟。
+
+默认完全在本机运行、不需要 GPU：在进程内启动 fake_comfyui.FakeComfyUI 和 Flask 应用，
+数据库、ComfyUI input / output 目录都放在临时目录中，不会触碰 backend/ 下的任何项目数据库。
+也可以用 --base-url 压测已经在运行的服务器（例如连接 fake_comfyui.py 或真实 ComfyUI 的 app.py）。
+
+生成请求的流程与前端相同：先用 AddWorkflow 建一个空节点，再 POST /api/nodes 提交生成，
+然后用 GET /api/jobs/<id>?wait= 长轮询到任务结束。统计中：
+    POST /api/nodes         提交请求本身的延迟（写入任务队列后立即返回 202）
+    generate:<模块>          从提交到任务完成的端到端延迟
+拼接请求使用预热阶段生成的图片作为片段（假 ComfyUI 的视频输出只是占位字节，无法解码）。
+
+用法：
+    python bench_e2e.py                                     # 60 秒，8 个客户端
+    python bench_e2e.py --duration 30 --clients 16 --mix "generate=2,tree=10,stitch=1"
+    python bench_e2e.py --modules "TextGenerateImage=3,CameraControl=1" --latency "CameraControl=5"
+    python bench_e2e.py --base-url http://127.0.0.1:5005 --tree-id 1 --json result.json
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+DEFAULT_MIX = "generate=2,tree=8,stitch=1"
+DEFAULT_MODULES = "TextGenerateImage=3,TextGenerateVideo=1"
+DEFAULT_LATENCY = "TextGenerateImage=0.5,TextGenerateVideo=3"
+STITCH_CLIPS = 3
+JOB_POLL_WAIT = 30  # GET /api/jobs/<id>?wait= 每次长轮询的秒数
+
+
+class Recorder:
+    """按请求类型记录延迟和错误"""
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, op: str, seconds: float, ok: bool = True):
+        with self._lock:
+            if ok:
+                self.latencies.setdefault(op, []).append(seconds)
+            else:
+                self.errors[op] = self.errors.get(op, 0) + 1
+
+    def summary(self, elapsed: float) -> dict:
+        with self._lock:
+            ops = sorted(set(self.latencies) | set(self.errors))
+            result = {}
+            for op in ops:
+                samples = sorted(self.latencies.get(op, []))
+                result[op] = {
+                    "ok": len(samples),
+                    "errors": self.errors.get(op, 0),
+                    "throughput": round(len(samples) / elapsed, 3) if elapsed else 0.0,
+                    "p50": percentile(samples, 50),
+                    "p95": percentile(samples, 95),
+                    "p99": percentile(samples, 99),
+                    "max": round(samples[-1], 4) if samples else None,
+                }
+            return result
+
+
+def percentile(samples: list[float], pct: int) -> float | None:
+    """已排序样本的百分位数（与 statistics.quantiles 的 inclusive 方法一致）"""
+    if not samples:
+        return None
+    if len(samples) == 1:
+        return round(samples[0], 4)
+    return round(statistics.quantiles(samples, n=100, method='inclusive')[pct - 1], 4)
+
+
+def parse_weights(text: str) -> dict[str, float]:
+    return {
+        name.strip(): float(weight)
+        for name, weight in (item.split('=', 1) for item in text.split(',') if '=' in item)
+        if float(weight) > 0
+    }
+
+
+class Bench:
+    def __init__(self, base_url: str, tree_id: int, modules: dict[str, float], mix: dict[str, float],
+                 recorder: Recorder, cleanup_stitched: str | None = None):
+        """:param cleanup_stitched: 拼接结果所在目录；指定时每次拼接后删除生成的视频（进程内模式）"""
+        self.base_url = base_url.rstrip('/')
+        self.tree_id = tree_id
+        self.modules = modules
+        self.mix = mix
+        self.recorder = recorder
+        self.cleanup_stitched = cleanup_stitched
+        self.root_id = None
+        self.images: list[str] = []  # 已生成的图片 URL，作为拼接片段
+        self.generated = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def timed(self, op: str, method: str, path: str, ok_status=(200,), **kwargs) -> requests.Response | None:
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=600, **kwargs)
+        except requests.RequestException as e:
+            self.recorder.record(op, time.perf_counter() - start, ok=False)
+            print(f"  {op} 请求失败: {e}", file=sys.stderr)
+            return None
+        ok = response.status_code in ok_status
+        self.recorder.record(op, time.perf_counter() - start, ok=ok)
+        if not ok:
+            print(f"  {op} 返回 {response.status_code}: {response.text[:200]}", file=sys.stderr)
+        return response if ok else None
+
+    def find_root(self):
+        response = self.session.get(f"{self.base_url}/api/trees/{self.tree_id}", timeout=60)
+        response.raise_for_status()
+        nodes = response.json().get('nodes', [])
+        root = next((n for n in nodes if not n.get('parent_id') and n.get('module_id') == 'Init'), None)
+        if root is None:
+            raise RuntimeError(f"树 {self.tree_id} 中没有 Init 根节点")
+        self.root_id = root['node_id']
+
+    # --- 三类请求 ---
+
+    def generate(self, module_id: str | None = None) -> bool:
+        module_id = module_id or weighted_choice(self.modules)
+        node_id = str(uuid.uuid4())
+        placeholder = {"tree_id": self.tree_id, "node_id": node_id, "title": module_id,
+                       "parent_ids": [self.root_id], "module_id": "AddWorkflow", "parameters": {}}
+        if self.timed("POST /api/nodes (AddWorkflow)", 'POST', '/api/nodes', ok_status=(201,), json=placeholder) is None:
+            return False
+
+        start = time.perf_counter()
+        response = self.timed("POST /api/nodes", 'POST', '/api/nodes', ok_status=(202,), json={
+            "tree_id": self.tree_id, "node_id": node_id, "title": module_id, "parent_ids": [self.root_id],
+            "module_id": module_id,
+            "parameters": {"positive_prompt": f"bench {node_id[:8]}", "seed": random.randint(0, 999999999999)},
+        })
+        if response is None:
+            self.recorder.record(f"generate:{module_id}", 0, ok=False)
+            return False
+        job = response.json()['job']
+        while job['status'] not in ('completed', 'failed', 'cancelled'):
+            try:
+                job = self.session.get(f"{self.base_url}/api/jobs/{job['job_id']}",
+                                       params={"wait": JOB_POLL_WAIT}, timeout=JOB_POLL_WAIT + 30).json()
+            except (requests.RequestException, ValueError) as e:
+                print(f"  查询任务 {job['job_id']} 失败: {e}", file=sys.stderr)
+                time.sleep(1)
+        ok = job['status'] == 'completed'
+        self.recorder.record(f"generate:{module_id}", time.perf_counter() - start, ok=ok)
+        if not ok:
+            print(f"  生成任务 {job['job_id']} ({module_id}) {job['status']}: {job.get('error')}", file=sys.stderr)
+            return False
+        with self._lock:
+            self.generated += 1
+        if module_id in ('TextGenerateImage', 'ImageGenerateImage_Basic'):
+            self._collect_images(node_id)
+        return True
+
+    def get_tree(self) -> bool:
+        return self.timed("GET /api/trees", 'GET', f"/api/trees/{self.tree_id}") is not None
+
+    def stitch(self) -> bool:
+        with self._lock:
+            images = list(self.images)
+        if not images:
+            return self.get_tree()
+        clips = [{"path": url, "type": "image", "duration": 0.5} for url in random.sample(images, min(STITCH_CLIPS, len(images)))]
+        response = self.timed("POST /api/stitch", 'POST', '/api/stitch', json={"clips": clips, "audio_clips": []})
+        if response is not None and self.cleanup_stitched:
+            path = os.path.join(self.cleanup_stitched, os.path.basename(response.json()['output_url']))
+            if os.path.exists(path):
+                os.remove(path)
+        return response is not None
+
+    def _collect_images(self, node_id: str):
+        response = self.session.get(f"{self.base_url}/api/trees/{self.tree_id}", timeout=60)
+        node = next((n for n in response.json().get('nodes', []) if n['node_id'] == node_id), None)
+        urls = ((node or {}).get('assets') or {}).get('output', {}).get('images', [])
+        with self._lock:
+            self.images.extend(url for url in urls if url.split('?')[0].endswith('/view'))
+
+    # --- 压测 ---
+
+    def client(self, stop_at: float):
+        operations = {"generate": self.generate, "tree": self.get_tree, "stitch": self.stitch}
+        while time.monotonic() < stop_at:
+            operations[weighted_choice(self.mix)]()
+
+
+def weighted_choice(weights: dict[str, float]) -> str:
+    return random.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def start_local_stack(tmp_dir: str, latencies: dict[str, float], fail_rates: dict[str, float], jitter: float):
+    """在进程内启动假 ComfyUI 和 Flask 应用，返回 (base_url, tree_id, 拼接结果目录, fake)"""
+    import fake_comfyui
+
+    output_dir = os.path.join(tmp_dir, 'comfyui', 'output')
+    fake = fake_comfyui.FakeComfyUI(port=0, delay=1.0, output_dir=output_dir,
+                                    latencies=latencies, fail_rates=fail_rates, jitter=jitter).start()
+    os.environ.update(APP_MODE='server', COMFYUI_SERVERS=fake.address,
+                      COMFYUI_ROOT=os.path.join(tmp_dir, 'comfyui'), GENERATION_CACHE='0')
+
+    import database
+    database.DATABASE_FILE = os.path.join(tmp_dir, 'bench_e2e.db')
+    import app as app_module
+    from werkzeug.serving import make_server
+
+    database.init_db()
+    app_module.workflow_registry.load_all()
+    app_module.comfyui_pool.start()
+    app_module.generation_queue.start()
+    tree_id = database.create_tree("bench_e2e")
+    database.add_node(node_id=str(uuid.uuid4()), tree_id=tree_id, parent_ids=None, module_id="Init",
+                      parameters={"description": "项目根节点"}, title="Initial Node")
+
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", tree_id, app_module.STITCHED_OUTPUT_FOLDER, fake
+
+
+def print_report(summary: dict, elapsed: float, generated: int):
+    print()
+    print(f"{'request':<34} | {'ok':>6} | {'err':>4} | {'req/s':>7} | {'p50 (s)':>8} | {'p95 (s)':>8} | {'p99 (s)':>8}")
+    print("-" * 94)
+    for op, row in summary.items():
+        cells = [f"{row[key]:>8.3f}" if row[key] is not None else f"{'-':>8}" for key in ('p50', 'p95', 'p99')]
+        print(f"{op:<34} | {row['ok']:>6} | {row['errors']:>4} | {row['throughput']:>7.2f} | {' | '.join(cells)}")
+    print("-" * 94)
+    print(f"耗时 {elapsed:.1f} 秒，完成生成 {generated} 个（{generated / elapsed:.2f} 个/秒）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端吞吐量 / 延迟基准")
+    parser.add_argument("--base-url", help="压测已在运行的服务器（不指定时在进程内启动假 ComfyUI 和应用）")
+    parser.add_argument("--tree-id", type=int, default=1, help="--base-url 模式下使用的树（需要有 Init 根节点）")
+    parser.add_argument("--duration", type=float, default=60, help="压测时长（秒）")
+    parser.add_argument("--clients", type=int, default=8, help="并发客户端线程数")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f'请求类型的权重，默认 "{DEFAULT_MIX}"')
+    parser.add_argument("--modules", default=DEFAULT_MODULES, help=f'生成请求的模块权重，默认 "{DEFAULT_MODULES}"')
+    parser.add_argument("--warmup", type=int, default=3, help="压测前先生成几张图片，作为拼接片段")
+    parser.add_argument("--latency", default=DEFAULT_LATENCY, help="进程内模式：假 ComfyUI 按工作流的执行时间（秒）")
+    parser.add_argument("--fail-rates", default="", help="进程内模式：假 ComfyUI 按工作流的失败概率")
+    parser.add_argument("--jitter", type=float, default=0.2, help="进程内模式：执行时间的随机浮动比例")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子（请求顺序可复现）")
+    parser.add_argument("--json", help="把统计结果另存为 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="进程内模式：保留应用和假 ComfyUI 的日志输出")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    mix, modules = parse_weights(args.mix), parse_weights(args.modules)
+    if not mix or not modules:
+        parser.error("--mix 和 --modules 至少需要一个正的权重")
+
+    report = sys.stdout
+    with tempfile.TemporaryDirectory() as tmp_dir, contextlib.ExitStack() as stack:
+        fake = None
+        stitched_dir = None
+        if args.base_url:
+            base_url, tree_id = args.base_url, args.tree_id
+        else:
+            # 应用每次提交都会打印完整的工作流，默认丢弃进程内的日志，只输出统计结果
+            if not args.verbose:
+                stack.enter_context(contextlib.redirect_stdout(open(os.devnull, 'w')))
+                logging.getLogger('werkzeug').setLevel(logging.ERROR)
+            import fake_comfyui
+            base_url, tree_id, stitched_dir, fake = start_local_stack(
+                tmp_dir, fake_comfyui.parse_module_values(args.latency),
+                fake_comfyui.parse_module_values(args.fail_rates), args.jitter)
+        print(f"压测目标: {base_url}（树 {tree_id}），{args.clients} 个客户端，{args.duration:g} 秒", file=report)
+
+        bench = Bench(base_url, tree_id, modules, mix, Recorder(), cleanup_stitched=stitched_dir)
+        bench.find_root()
+        if 'stitch' in mix:
+            for _ in range(args.warmup):
+                bench.generate('TextGenerateImage')
+        # 预热的请求不计入统计
+        recorder = bench.recorder = Recorder()
+        bench.generated = 0
+
+        start = time.monotonic()
+        threads = [threading.Thread(target=bench.client, args=(start + args.duration,), daemon=True)
+                   for _ in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start  # 包括最后一批请求跑完的时间
+        stack.close()
+
+        summary = recorder.summary(elapsed)
+        print_report(summary, elapsed, bench.generated)
+        if fake is not None:
+            print(f"假 ComfyUI: {json.dumps(fake.stats, ensure_ascii=False)}")
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({"base_url": base_url, "clients": args.clients, "duration": elapsed,
+                           "mix": mix, "modules": modules, "generated": bench.generated,
+                           "requests": summary, "fake_comfyui": fake.stats if fake else None},
+                          f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+get_tree_as_json 性能基准：对比旧的 N+1 查询实现与当前的单次查询实现。
+
+用法：
+    python bench_tree_loader.py                 # 默认 1k / 10k / 100k 节点
+    python bench_tree_loader.py 2000 20000      # 自定义规模
+    python bench_tree_loader.py --repeat 5
+
+基准在临时目录中生成合成数据库，不会触碰 backend/ 下的任何项目数据库。
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import database
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+
+
+def legacy_get_tree_as_json(tree_id: int) -> dict | None:
+    """旧实现（逐节点查询父节点），仅用于对比，逻辑与改造前保持一致。"""
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT name FROM trees WHERE tree_id = ?", (tree_id,))
+        tree_info = cursor.fetchone()
+        if not tree_info:
+            return None
+
+        cursor.execute("""
+            SELECT node_id, module_id, parameters, title, assets, status, created_at
+            FROM nodes
+            WHERE tree_id = ?
+            ORDER BY created_at ASC
+        """, (tree_id,))
+        nodes_for_frontend = []
+        for node_row in cursor.fetchall():
+            node_dict = dict(node_row)
+            node_dict['parameters'] = json.loads(node_dict['parameters']) if node_dict['parameters'] else {}
+            node_dict['assets'] = json.loads(node_dict['assets']) if node_dict['assets'] else {}
+            cursor.execute("SELECT parent_node_id FROM node_parents WHERE child_node_id = ?", (node_dict['node_id'],))
+            parent_ids_list = [p['parent_node_id'] for p in cursor.fetchall()]
+            node_dict['parent_id'] = parent_ids_list or None
+            nodes_for_frontend.append(node_dict)
+
+        return {"tree_id": tree_id, "name": tree_info['name'], "nodes": nodes_for_frontend}
+    finally:
+        conn.close()
+
+
+def build_synthetic_tree(db_file: str, node_count: int, seed: int = 42) -> int:
+    """在 db_file 中生成一棵包含 node_count 个节点的合成树（约 10% 的节点有两个父节点）。"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_file)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO trees (name) VALUES (?)", (f"bench_{node_count}",))
+        tree_id = cursor.lastrowid
+
+        base_time = datetime(2025, 1, 1)
+        node_ids = []
+        node_rows = []
+        edge_rows = []
+        for i in range(node_count):
+            node_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            parameters = {"positive_prompt": f"prompt {i}", "seed": rng.randint(0, 999999999), "steps": 20}
+            assets = {
+                "input": {"images": [f"/view?filename=in_{i}.png&subfolder=&type=input"]} if i else {},
+                "output": {"images": [f"/view?filename=out_{i}.png&subfolder=&type=output"]},
+            }
+            module_id = "Init" if i == 0 else rng.choice(["TextGenerateImage", "ImageGenerateVideo", "ImageCanny"])
+            node_rows.append((
+                node_id, tree_id, module_id, json.dumps(parameters), module_id,
+                json.dumps(assets), 'completed', base_time + timedelta(seconds=i),
+            ))
+            if i:
+                parents = {node_ids[rng.randrange(len(node_ids))]}
+                if i > 1 and rng.random() < 0.1:
+                    parents.add(node_ids[rng.randrange(len(node_ids))])
+                edge_rows.extend((node_id, parent_id) for parent_id in parents)
+            node_ids.append(node_id)
+
+        cursor.executemany(
+            """INSERT INTO nodes (node_id, tree_id, module_id, parameters, title, assets, status, created_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            node_rows,
+        )
+        cursor.executemany(
+            "INSERT INTO node_parents (child_node_id, parent_node_id) VALUES (?, ?)",
+            edge_rows,
+        )
+        conn.commit()
+        return tree_id
+    finally:
+        conn.close()
+
+
+def time_call(func, tree_id: int, repeat: int) -> tuple[float, dict]:
+    """返回多次调用的中位耗时（秒）和最后一次的结果。与 timeit 一样，计时期间关闭 GC。"""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        result = None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            result = func(tree_id)
+            durations.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return statistics.median(durations), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="get_tree_as_json 新旧实现性能对比")
+    parser.add_argument("sizes", nargs="*", type=int, default=DEFAULT_SIZES, help="合成树的节点数量")
+    parser.add_argument("--repeat", type=int, default=3, help="每种实现的重复次数（取中位数）")
+    args = parser.parse_args()
+
+    original_db_file = database.DATABASE_FILE
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            print(f"{'nodes':>8} | {'legacy (s)':>11} | {'current (s)':>11} | {'speedup':>8}")
+            print("-" * 48)
+            for size in args.sizes:
+                database.DATABASE_FILE = os.path.join(tmp_dir, f"bench_{size}.db")
+                database.init_db()
+                tree_id = build_synthetic_tree(database.DATABASE_FILE, size)
+
+                legacy_time, legacy_result = time_call(legacy_get_tree_as_json, tree_id, args.repeat)
+                current_time, current_result = time_call(database.get_tree_as_json, tree_id, args.repeat)
+
+                # 两种实现必须返回完全相同的数据结构
+                if current_result['nodes'] != legacy_result['nodes']:
+                    raise AssertionError(f"{size} 个节点时，新旧实现的返回结果不一致")
+
+                speedup = legacy_time / current_time if current_time else float('inf')
+                print(f"{size:>8} | {legacy_time:>11.3f} | {current_time:>11.3f} | {speedup:>7.1f}x")
+        finally:
+            database.DATABASE_FILE = original_db_file
+
+
+if __name__ == '__main__':
+    main()
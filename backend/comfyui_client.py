@@ -0,0 +1,163 @@
+"""
+ComfyUI HTTP 客户端。
+
+每个 ComfyUI 服务器共用一个 requests.Session（连接池 + keep-alive），所有请求都带连接 / 读取超时，
+遇到连接错误和临时性的 5xx 时按指数退避加随机抖动重试有限次数，并按接口统计调用耗时。
+
+POST /prompt 不是幂等的：只有请求确定没有被 ComfyUI 处理时（连接没有建立：连接超时 / 被拒绝 / 域名解析失败，
+或 502/503/504）才会重试；读取超时、请求发出后连接被重置或断开都不重试，避免同一个工作流被提交两次。
+"""
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 60.0
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5          # 第 n 次重试前等待 RETRY_BACKOFF * 2^(n-1) 秒，再加最多同样长的随机抖动
+POOL_SIZE = 16
+RETRY_STATUS = {500, 502, 503, 504}
+UNPROCESSED_STATUS = {502, 503, 504}  # 请求没有到达 ComfyUI 本身，非幂等请求也可以重试
+
+
+class ComfyUIClient:
+    def __init__(self, server_address: str, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, max_retries: int = MAX_RETRIES):
+        self.server_address = server_address
+        self.base_url = f"http://{server_address}"
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._metrics: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    # --- ComfyUI 接口 ---
+
+    def queue_prompt(self, workflow: dict, client_id: str, front: bool = False) -> dict:
+        """front=True 时插到 ComfyUI 队列中已排队的 prompt 之前（正在执行的不受影响）"""
+        body = {"prompt": workflow, "client_id": client_id}
+        if front:
+            body["front"] = True
+        return self.request('POST', '/prompt', idempotent=False, json=body).json()
+
+    def get_history(self, prompt_id: str) -> dict:
+        return self.request('GET', f'/history/{prompt_id}').json()
+
+    def get_queue(self) -> dict:
+        return self.request('GET', '/queue').json()
+
+    def get_system_stats(self) -> dict:
+        return self.request('GET', '/system_stats').json()
+
+    def get_object_info(self) -> dict:
+        return self.request('GET', '/object_info').json()
+
+    def interrupt(self, prompt_id: str | None = None):
+        """中断正在执行的 prompt；指定 prompt_id 时新版 ComfyUI 只在它正在执行时才中断（旧版忽略该参数）"""
+        self.request('POST', '/interrupt', idempotent=False, json={"prompt_id": prompt_id} if prompt_id else None)
+
+    def delete_from_queue(self, prompt_ids: list[str]):
+        self.request('POST', '/queue', idempotent=False, json={"delete": prompt_ids})
+
+    # --- 通用请求 ---
+
+    def request(self, method: str, path: str, idempotent: bool = True, timeout=None,
+                retries: int | None = None, **kwargs) -> requests.Response:
+        """
+        发送请求，返回 2xx 响应；重试用尽后抛出 requests.RequestException（HTTP 错误为 HTTPError）。
+        :param idempotent: 为 False 时只在请求确定没有被处理时重试
+        :param timeout / retries: 覆盖客户端默认的超时和重试次数（如健康检查需要快速失败）
+        """
+        max_retries = self.max_retries if retries is None else retries
+        endpoint = f"{method} /{path.strip('/').split('/')[0]}"  # /history/<id> 统一记为 /history
+        attempt = 0
+        started = time.perf_counter()  # 耗时包含重试
+        while True:
+            try:
+                response = self.session.request(method, self.base_url + path, timeout=timeout or self.timeout, **kwargs)
+                retry_statuses = RETRY_STATUS if idempotent else UNPROCESSED_STATUS
+                if response.status_code in retry_statuses and attempt < max_retries:
+                    raise _RetryableStatus(response)
+                response.raise_for_status()
+                self._record(endpoint, started, ok=True, retried=attempt)
+                return response
+            except _RetryableStatus as e:
+                error = f"HTTP {e.response.status_code}"
+                e.response.close()  # 释放连接回连接池
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # 读取超时、发送后连接被断开时请求可能已经被处理，非幂等请求只在连接没有建立时重试
+                if attempt >= max_retries or (not idempotent and not request_not_sent(e)):
+                    self._record(endpoint, started, ok=False, retried=attempt)
+                    raise
+                error = str(e)
+            except requests.RequestException:
+                self._record(endpoint, started, ok=False, retried=attempt)
+                raise
+
+            attempt += 1
+            delay = RETRY_BACKOFF * 2 ** (attempt - 1)
+            delay += random.uniform(0, delay)
+            print(f"请求 ComfyUI {self.server_address} {method} {path} 失败（{error}），{delay:.1f} 秒后第 {attempt} 次重试。")
+            time.sleep(delay)
+
+    def get_metrics(self) -> dict:
+        """每个接口的调用次数、失败次数、重试次数和耗时（毫秒）"""
+        with self._lock:
+            return {
+                endpoint: dict(
+                    m,
+                    avg_ms=round(m["total_ms"] / m["calls"], 2) if m["calls"] else 0.0,
+                    total_ms=round(m["total_ms"], 2),
+                    max_ms=round(m["max_ms"], 2),
+                    last_ms=round(m["last_ms"], 2),
+                )
+                for endpoint, m in self._metrics.items()
+            }
+
+    def _record(self, endpoint: str, started: float, ok: bool, retried: int):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            m = self._metrics.setdefault(
+                endpoint, {"calls": 0, "errors": 0, "retries": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
+            )
+            m["calls"] += 1
+            m["errors"] += 0 if ok else 1
+            m["retries"] += retried
+            m["total_ms"] += elapsed_ms
+            m["max_ms"] = max(m["max_ms"], elapsed_ms)
+            m["last_ms"] = elapsed_ms
+
+
+def request_not_sent(error: requests.RequestException) -> bool:
+    """连接还没有建立（连接超时、被拒绝、域名解析失败），请求一定没有发到 ComfyUI"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = error.args[0] if error.args else None
+    reason = getattr(reason, 'reason', reason)  # requests 包装的 urllib3 MaxRetryError
+    return isinstance(reason, NewConnectionError)
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, response: requests.Response):
+        super().__init__(response.status_code)
+        self.response = response
+
+
+_clients: dict[str, ComfyUIClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(server_address: str, **kwargs) -> ComfyUIClient:
+    """返回（必要时创建）某个 ComfyUI 服务器共用的客户端；kwargs 只在第一次创建时生效"""
+    with _clients_lock:
+        client = _clients.get(server_address)
+        if client is None:
+            client = _clients[server_address] = ComfyUIClient(server_address, **kwargs)
+        return client
@@ -0,0 +1,259 @@
+"""
+ComfyUI WebSocket 事件监听。
+
+每个 ComfyUI 服务器只保持一条长连接（clientId 与提交 /prompt 时相同），由后台线程接收
+executing / progress / executed / execution_error 等事件，并按 prompt_id 分发给正在等待的任务，
+多个生成任务可以同时等待而不必各自建立连接、各自读取整条事件流。
+
+连接断开后按指数退避重连；每次连上后通过 /history 补查仍在等待的 prompt，避免丢失断线期间的完成事件。
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+import websocket
+
+import comfyui_client
+
+RECONNECT_MIN_DELAY = 1.0    # 重连退避的初始 / 最大间隔（秒）
+RECONNECT_MAX_DELAY = 30.0
+CONNECT_TIMEOUT = 10.0
+RECV_TIMEOUT = 5.0           # recv 超时后继续等待，只用于让线程不会永久卡在一次 recv 上
+RECENT_RESULTS_MAX = 1024    # 记住最近结束的 prompt，完成事件先于 wait() 到达时也不会丢失
+HISTORY_POLL_INTERVAL = 30.0 # 等待期间每隔多久查一次 /history，兜底收不到事件的 prompt（如重启前由旧 clientId 提交的）
+
+
+class PromptExecutionError(RuntimeError):
+    """ComfyUI 执行 prompt 出错或被中断"""
+
+
+class PromptTimeout(RuntimeError):
+    """等待 prompt 完成超过了截止时间"""
+
+
+class PromptCancelled(PromptExecutionError):
+    """prompt 被 cancel() 取消"""
+
+
+class BackendUnavailable(RuntimeError):
+    """等待期间 ComfyUI 后端被判定为不可用（见 comfyui_pool），prompt 需要换一个后端重新执行"""
+
+
+class _PromptWaiter:
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None      # execution_error / execution_interrupted 的 data，成功时为 None
+        self.progress = None   # 最近一次 progress 事件: {"node", "value", "max"}
+        self.executed = {}     # 节点 ID -> executed 事件中的 output
+        self.unavailable = None  # abort_pending() 给出的原因
+
+
+class ComfyUIEventListener:
+    def __init__(self, server_address: str, client_id: str):
+        self.server_address = server_address
+        self.client_id = client_id
+        self.connected = threading.Event()
+        self.stats = {"connects": 0, "messages": 0, "recovered": 0}
+        self._waiters: dict[str, _PromptWaiter] = {}
+        self._recent: OrderedDict[str, dict | None] = OrderedDict()  # prompt_id -> error（成功为 None）
+        self._callbacks = []
+        self._unavailable = None  # abort_pending() 之后、resume() 之前，新的 wait() 也立即失败
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """启动后台监听线程（幂等）"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f'comfyui-ws-{self.server_address}', daemon=True
+                )
+                self._thread.start()
+
+    def add_event_listener(self, callback):
+        """注册事件回调 callback(prompt_id, event_type, data)。回调在监听线程中执行，必须尽快返回"""
+        self._callbacks.append(callback)
+
+    def get_progress(self, prompt_id: str) -> dict | None:
+        waiter = self._waiters.get(prompt_id)
+        return waiter.progress if waiter else None
+
+    def wait(self, prompt_id: str, timeout: float | None = None) -> dict:
+        """
+        等待 prompt 执行结束，返回 executed 事件收集到的输出 {节点ID: output}。
+        执行出错时抛出 PromptExecutionError，超过 timeout 秒抛出 PromptTimeout。
+        """
+        self.start()
+        waiter = self._register(prompt_id)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                if waiter.done.wait(HISTORY_POLL_INTERVAL if remaining is None else min(remaining, HISTORY_POLL_INTERVAL)):
+                    break
+                # 定期（以及截止时间到了时）查一次 /history，确认不是单纯错过了完成事件
+                if self._check_history(prompt_id):
+                    break
+                if remaining is not None and remaining <= HISTORY_POLL_INTERVAL:
+                    raise PromptTimeout(f"等待 ComfyUI 任务 {prompt_id} 超时（{timeout} 秒）")
+        finally:
+            with self._lock:
+                self._waiters.pop(prompt_id, None)
+
+        if waiter.unavailable is not None:
+            raise BackendUnavailable(waiter.unavailable)
+        if waiter.error is not None:
+            message = waiter.error.get('exception_message') or waiter.error.get('status') or '执行被中断'
+            if waiter.error.get('status') == 'cancelled':
+                raise PromptCancelled(f"ComfyUI 任务 {prompt_id} 已取消: {message}")
+            raise PromptExecutionError(f"ComfyUI 任务 {prompt_id} 执行失败: {message}")
+        return waiter.executed
+
+    def cancel(self, prompt_id: str, reason: str = '已取消'):
+        """让等待该 prompt 的 wait() 立即抛出 PromptCancelled（ComfyUI 从队列删除 prompt 时不会推送任何事件）"""
+        self._resolve(prompt_id, {"status": "cancelled", "exception_message": reason})
+
+    def resolve_from_history(self, prompt_id: str, entry: dict):
+        """根据 /history 中的记录把 prompt 标记为结束（如重启前已经完成、完成事件没有收到的 prompt）"""
+        status = entry.get('status') or {}
+        if status.get('status_str') == 'error':
+            messages = [data for kind, data in status.get('messages', []) if kind == 'execution_error']
+            self._resolve(prompt_id, messages[-1] if messages else {"status": "error"})
+        else:
+            self._resolve(prompt_id)
+
+    def abort_pending(self, reason: str):
+        """后端不可用时让所有正在等待（以及 resume() 之前开始等待）的 wait() 立即抛出 BackendUnavailable"""
+        with self._lock:
+            self._unavailable = reason
+            waiters = [waiter for waiter in self._waiters.values() if not waiter.done.is_set()]
+        for waiter in waiters:
+            waiter.unavailable = reason
+            waiter.done.set()
+
+    def resume(self):
+        """后端恢复可用"""
+        with self._lock:
+            self._unavailable = None
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, connected=self.connected.is_set(), waiting=len(self._waiters))
+
+    def _register(self, prompt_id: str) -> _PromptWaiter:
+        with self._lock:
+            waiter = self._waiters.setdefault(prompt_id, _PromptWaiter())
+            if prompt_id in self._recent:
+                waiter.error = self._recent[prompt_id]
+                waiter.done.set()
+            elif self._unavailable is not None:
+                waiter.unavailable = self._unavailable
+                waiter.done.set()
+            return waiter
+
+    def _resolve(self, prompt_id: str, error: dict | None = None):
+        with self._lock:
+            if prompt_id in self._recent:
+                return  # 只认第一个结束事件（出错后 ComfyUI 仍会发送 executing: null）
+            self._recent[prompt_id] = error
+            while len(self._recent) > RECENT_RESULTS_MAX:
+                self._recent.popitem(last=False)
+            waiter = self._waiters.get(prompt_id)
+        if waiter:
+            waiter.error = error
+            waiter.done.set()
+
+    def _check_history(self, prompt_id: str) -> bool:
+        """查询 /history，prompt 已结束时标记完成并返回 True"""
+        try:
+            entry = comfyui_client.get_client(self.server_address).get_history(prompt_id).get(prompt_id)
+        except (requests.RequestException, ValueError) as e:
+            print(f"查询 ComfyUI 历史记录 {prompt_id} 失败: {e}")
+            return False
+        if not entry:
+            return False
+        self.resolve_from_history(prompt_id, entry)
+        return True
+
+    def _recover_pending(self):
+        with self._lock:
+            pending = [prompt_id for prompt_id, waiter in self._waiters.items() if not waiter.done.is_set()]
+        for prompt_id in pending:
+            if self._check_history(prompt_id):
+                self.stats["recovered"] += 1
+                print(f"通过 /history 补回了断线期间完成的 ComfyUI 任务 {prompt_id}")
+
+    def _run(self):
+        url = f"ws://{self.server_address}/ws?clientId={self.client_id}"
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            ws = websocket.WebSocket()
+            try:
+                ws.connect(url, timeout=CONNECT_TIMEOUT)
+                ws.settimeout(RECV_TIMEOUT)
+            except (websocket.WebSocketException, OSError) as e:
+                print(f"连接 ComfyUI WebSocket 失败: {e}，{delay:.0f} 秒后重试。")
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+
+            delay = RECONNECT_MIN_DELAY
+            self.stats["connects"] += 1
+            self.connected.set()
+            print(f"已连接 ComfyUI WebSocket: {url}")
+            self._recover_pending()
+            try:
+                while True:
+                    try:
+                        message = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        continue
+                    if isinstance(message, str):  # 二进制消息是预览图，忽略
+                        self._dispatch(json.loads(message))
+            except (websocket.WebSocketException, OSError, ValueError) as e:
+                print(f"ComfyUI WebSocket 连接断开: {e}，准备重连。")
+            finally:
+                self.connected.clear()
+                ws.close()
+
+    def _dispatch(self, message: dict):
+        self.stats["messages"] += 1
+        event_type = message.get('type')
+        data = message.get('data') or {}
+        prompt_id = data.get('prompt_id')
+        if not prompt_id:
+            return  # status 等全局消息
+
+        for callback in self._callbacks:
+            try:
+                callback(prompt_id, event_type, data)
+            except Exception as e:
+                print(f"ComfyUI 事件回调出错: {e}")
+
+        if (event_type == 'executing' and data.get('node') is None) or event_type == 'execution_success':
+            self._resolve(prompt_id)
+        elif event_type in ('execution_error', 'execution_interrupted'):
+            self._resolve(prompt_id, data)
+        else:
+            waiter = self._waiters.get(prompt_id)
+            if waiter is None:
+                return
+            if event_type == 'progress':
+                waiter.progress = {"node": data.get('node'), "value": data.get('value'), "max": data.get('max')}
+            elif event_type == 'executed':
+                waiter.executed[data.get('node')] = data.get('output')
+
+
+_listeners: dict[str, ComfyUIEventListener] = {}
+_listeners_lock = threading.Lock()
+
+
+def get_listener(server_address: str, client_id: str) -> ComfyUIEventListener:
+    """返回（必要时创建）某个 ComfyUI 服务器共用的监听器"""
+    with _listeners_lock:
+        listener = _listeners.get(server_address)
+        if listener is None:
+            listener = _listeners[server_address] = ComfyUIEventListener(server_address, client_id)
+        return listener
@@ -0,0 +1,344 @@
+"""
+多 ComfyUI 后端调度。
+
+COMFYUI_SERVERS 中配置的每个后端都有自己的 HTTP 客户端和 WebSocket 监听器。后台线程定期轮询各后端的
+/queue 和 /system_stats（首次及恢复后还会读取 /object_info 得到可用的节点类型），
+提交工作流时选择「健康、具备工作流全部节点类型、负载最低」的后端，负载相同时优先空闲显存多的。
+
+后端连续轮询失败或提交时连接不上会被移出轮换，之后轮询成功即自动恢复。
+正在其上等待的 prompt 先确认是否真的丢失（再次查询该后端的 /queue 和 /history，见 BackendPool.wait），
+仍在执行或已经完成的继续等待，确认丢失或一直联系不上时才重新提交到其它后端；
+联系不上而被重新提交的原 prompt 在后端恢复后取消，避免同一个工作流执行两次。
+
+注意：输入 / 输出文件仍通过 COMFYUI_INPUT_PATH / COMFYUI_OUTPUT_PATH 读写，多个后端需要共享这两个目录。
+"""
+import threading
+import time
+
+import requests
+
+import comfyui_client
+import comfyui_events
+
+POLL_INTERVAL = 5.0
+POLL_TIMEOUT = (2.0, 5.0)          # 健康检查的 (连接, 读取) 超时，不重试
+OBJECT_INFO_TIMEOUT = (2.0, 30.0)  # /object_info 响应较大
+FAILURE_THRESHOLD = 2              # 连续轮询失败多少次后移出轮换
+LISTENER_CONNECT_WAIT = 5.0        # 提交前等待 WebSocket 连上的最长时间
+RECOVERY_WAIT = 60.0               # 后端被判定为不可用后，最多等多久确认其上的 prompt 是否还在，再改到其它后端
+
+
+class NoBackendAvailable(RuntimeError):
+    """没有可以执行该工作流的健康后端"""
+
+
+class Backend:
+    def __init__(self, address: str, client: comfyui_client.ComfyUIClient, listener: comfyui_events.ComfyUIEventListener):
+        self.address = address
+        self.client = client
+        self.listener = listener
+        self.healthy = True              # 第一次轮询之前默认可用
+        self.failures = 0
+        self.last_error = None
+        self.last_poll = None
+        self.queue_running = 0
+        self.queue_pending = 0
+        self.queue_order: dict[str, int] = {}  # 上次轮询时队列中的 prompt_id -> 前面还有几个 prompt（执行中的为 0）
+        self.submitted_since_poll = 0    # 上次轮询之后提交的 prompt，避免两次轮询之间都涌向同一个后端
+        self.vram_free = None
+        self.node_types: set[str] | None = None  # None 表示还不知道，视为全部支持
+
+    @property
+    def load(self) -> int:
+        return self.queue_running + self.queue_pending + self.submitted_since_poll
+
+    def supports(self, class_types: set[str]) -> bool:
+        return self.node_types is None or class_types <= self.node_types
+
+    def to_dict(self) -> dict:
+        return {
+            "address": self.address,
+            "healthy": self.healthy,
+            "load": self.load,
+            "queue_running": self.queue_running,
+            "queue_pending": self.queue_pending,
+            "vram_free": self.vram_free,
+            "node_types": len(self.node_types) if self.node_types is not None else None,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_poll": self.last_poll,
+        }
+
+
+class BackendPool:
+    def __init__(self, addresses: list[str], client_id: str, poll_interval: float = POLL_INTERVAL, **client_options):
+        """
+        :param addresses: ComfyUI 地址列表，如 ["10.0.0.1:8188", "10.0.0.2:8188"]
+        :param client_options: 传给 ComfyUIClient 的超时 / 重试配置
+        """
+        if not addresses:
+            raise ValueError("至少需要配置一个 ComfyUI 后端")
+        self.client_id = client_id
+        self.poll_interval = poll_interval
+        self.backends = [
+            Backend(address, comfyui_client.get_client(address, **client_options),
+                    comfyui_events.get_listener(address, client_id))
+            for address in addresses
+        ]
+        self._prompts: dict[str, tuple[Backend, dict]] = {}  # 等待中的 prompt_id -> (后端, 工作流)
+        self._superseded: dict[str, list[str]] = {}  # 后端地址 -> 联系不上时已改到其它后端执行、恢复后要取消的 prompt
+        self._resubmit_listeners = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """启动轮询线程和各后端的 WebSocket 监听（幂等）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='comfyui-pool-poller', daemon=True)
+            self._thread.start()
+        for backend in self.backends:
+            backend.listener.start()
+
+    def add_resubmit_listener(self, callback):
+        """注册回调 callback(旧 prompt_id, 新 prompt_id, 新后端地址)，prompt 被改到其它后端重新执行时调用"""
+        self._resubmit_listeners.append(callback)
+
+    def queue_position(self, prompt_id: str) -> int | None:
+        """prompt 前面还有几个 prompt（0 表示正在执行）；上次轮询之后才提交的 prompt 返回 None"""
+        with self._lock:
+            for backend in self.backends:
+                if prompt_id in backend.queue_order:
+                    return backend.queue_order[prompt_id]
+        return None
+
+    def get_backend(self, address: str) -> Backend | None:
+        return next((backend for backend in self.backends if backend.address == address), None)
+
+    def choose(self, workflow: dict, exclude=()) -> Backend:
+        """选择负载最低的可用后端；没有时抛出 NoBackendAvailable"""
+        class_types = {node['class_type'] for node in workflow.values() if isinstance(node, dict) and node.get('class_type')}
+        with self._lock:
+            candidates = [b for b in self.backends if b.healthy and b not in exclude and b.supports(class_types)]
+            if not candidates:
+                raise NoBackendAvailable("没有可用的 ComfyUI 后端（全部不可用，或缺少工作流需要的节点类型）")
+            backend = min(candidates, key=lambda b: (b.load, -(b.vram_free or 0)))
+            backend.submitted_since_poll += 1
+            return backend
+
+    def submit(self, workflow: dict, exclude=(), front: bool = False) -> dict:
+        """
+        把工作流提交到选中的后端，返回 ComfyUI 的响应并附带 "backend" 地址。
+        后端连接失败或返回 5xx 时将其移出轮换并换下一个后端；4xx（工作流本身有问题）直接抛出。
+        front=True 时插到该后端队列的最前面（预览任务，见 scheduler.py）。
+        """
+        self.start()
+        tried = list(exclude)
+        while True:
+            backend = self.choose(workflow, tried)
+            # ComfyUI 只把事件推送给已连接的 clientId（断线期间完成的任务会通过 /history 补查）
+            backend.listener.connected.wait(LISTENER_CONNECT_WAIT)
+            try:
+                queued = backend.client.queue_prompt(workflow, self.client_id, front=front)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code < 500:
+                    raise
+                self._record_failure(backend, str(e), immediate=True)
+                tried.append(backend)
+                continue
+            except requests.RequestException as e:
+                if isinstance(e, (requests.ConnectionError, requests.Timeout)) and not comfyui_client.request_not_sent(e):
+                    # 读取超时 / 请求发出后连接断开：ComfyUI 可能已经接受了这个 prompt，换后端重新提交可能重复执行
+                    self._record_failure(backend, str(e))
+                    raise
+                self._record_failure(backend, str(e), immediate=True)
+                tried.append(backend)
+                continue
+            with self._lock:
+                self._prompts[queued['prompt_id']] = (backend, workflow)
+            queued['backend'] = backend.address
+            print(f"    - 已提交到 ComfyUI 后端 {backend.address} (prompt_id: {queued['prompt_id']})")
+            return queued
+
+    def wait(self, prompt_id: str, timeout: float) -> tuple[str, Backend]:
+        """
+        等待 prompt 执行结束。所在后端在等待期间被判定为不可用时，先确认 prompt 是否还在该后端上（见 _confirm_lost），
+        确实丢失时才把工作流重新提交到其它后端并继续等待。
+        返回最终完成的 (prompt_id, 后端)；执行出错 / 超时的异常与 ComfyUIEventListener.wait 相同。
+        """
+        deadline = time.monotonic() + timeout
+        failed = []
+        while True:
+            with self._lock:
+                entry = self._prompts.pop(prompt_id, None)
+            if entry is None:  # 等待之前已被 cancel()
+                raise comfyui_events.PromptCancelled(f"ComfyUI 任务 {prompt_id} 已取消")
+            backend, workflow = entry
+            try:
+                backend.listener.wait(prompt_id, max(deadline - time.monotonic(), 0))
+                return prompt_id, backend
+            except comfyui_events.BackendUnavailable as e:
+                if not self._confirm_lost(backend, prompt_id, deadline):
+                    print(f"{e}，但 prompt {prompt_id} 仍在该后端上，继续等待。")
+                    with self._lock:
+                        self._prompts[prompt_id] = (backend, workflow)
+                    continue
+                print(f"{e}，改到其它后端重新执行 prompt {prompt_id}。")
+                failed.append(backend)
+                queued = self.submit(workflow, exclude=failed)
+                for callback in self._resubmit_listeners:
+                    callback(prompt_id, queued['prompt_id'], queued['backend'])
+                prompt_id = queued['prompt_id']
+
+    def adopt(self, prompt_id: str, address: str | None, workflow: dict) -> bool:
+        """
+        接管之前（如进程重启前）提交的 prompt，之后可以像刚提交的一样 wait()。
+        prompt 仍在后端队列中，或已在 /history 中（已结束）时返回 True；后端不存在 / 不可用 / 已丢失该 prompt 时返回 False。
+        """
+        backend = self.get_backend(address) if address else None
+        if backend is None or not backend.healthy:
+            return False
+        self.start()
+        backend.listener.connected.wait(LISTENER_CONNECT_WAIT)
+        if self._locate(backend, prompt_id) not in ('queued', 'finished'):
+            return False
+        with self._lock:
+            self._prompts[prompt_id] = (backend, workflow)
+        return True
+
+    def cancel(self, prompt_id: str, address: str | None, reason: str = '已取消') -> bool:
+        """
+        取消 prompt：正在执行则 /interrupt，还在排队则从 /queue 删除；等待它的 wait() 立即抛出 PromptCancelled。
+        返回 prompt 是否还在后端队列中（False 表示已经结束或后端不可达）。
+        """
+        with self._lock:
+            self._prompts.pop(prompt_id, None)
+        backend = self.get_backend(address) if address else None
+        if backend is None:
+            return False
+        found = False
+        try:
+            queue = backend.client.get_queue()
+            if any(item[1] == prompt_id for item in queue.get('queue_running', [])):
+                backend.client.interrupt(prompt_id)
+                found = True
+            elif any(item[1] == prompt_id for item in queue.get('queue_pending', [])):
+                backend.client.delete_from_queue([prompt_id])
+                found = True
+        except (requests.RequestException, ValueError) as e:
+            print(f"取消 ComfyUI 后端 {backend.address} 上的 prompt {prompt_id} 失败: {e}")
+        backend.listener.cancel(prompt_id, reason)
+        if found:
+            print(f"    - 已取消 ComfyUI 后端 {backend.address} 上的 prompt {prompt_id}")
+        return found
+
+    def _locate(self, backend: Backend, prompt_id: str) -> str | None:
+        """
+        查询 prompt 在后端上的状态：'queued'（排队或执行中）、'finished'（已在 /history 中，同时通知监听器）、
+        'lost'（两处都没有，如 ComfyUI 重启过）；后端不可达时返回 None
+        """
+        try:
+            # 先查队列再查历史：在两次查询之间完成的 prompt 也能在 /history 中找到
+            queue = backend.client.get_queue()
+            if any(item[1] == prompt_id for key in ('queue_running', 'queue_pending') for item in queue.get(key, [])):
+                return 'queued'
+            entry = backend.client.get_history(prompt_id).get(prompt_id)
+        except (requests.RequestException, ValueError) as e:
+            print(f"查询 ComfyUI 后端 {backend.address} 上的 prompt {prompt_id} 失败: {e}")
+            return None
+        if not entry:
+            return 'lost'
+        backend.listener.resolve_from_history(prompt_id, entry)
+        return 'finished'
+
+    def _confirm_lost(self, backend: Backend, prompt_id: str, deadline: float) -> bool:
+        """
+        后端被判定为不可用后（可能只是 GPU 繁忙、/queue 响应慢），在 RECOVERY_WAIT 秒内（不超过截止时间）
+        反复查询 prompt 的状态。仍在排队 / 执行或已经完成时把后端恢复到轮换中并返回 False；
+        后端可达但已经没有该 prompt 时返回 True；一直联系不上时记下原 prompt（后端恢复后取消）并返回 True。
+        """
+        give_up = min(time.monotonic() + RECOVERY_WAIT, deadline)
+        while True:
+            state = self._locate(backend, prompt_id)
+            if state in ('queued', 'finished'):
+                self._mark_recovered(backend)
+                return False
+            if state == 'lost':
+                return True
+            remaining = give_up - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(self.poll_interval, remaining))
+        with self._lock:
+            self._superseded.setdefault(backend.address, []).append(prompt_id)
+        return True
+
+    def _mark_recovered(self, backend: Backend):
+        """后端重新可达：恢复到轮换中，取消联系不上期间已改到其它后端执行的 prompt"""
+        with self._lock:
+            recovered = not backend.healthy
+            backend.healthy = True
+            backend.failures = 0
+            superseded = self._superseded.pop(backend.address, [])
+        if recovered:
+            backend.listener.resume()
+            print(f"ComfyUI 后端 {backend.address} 已恢复，重新加入轮换。")
+        for prompt_id in superseded:
+            self.cancel(prompt_id, backend.address, '已改到其它后端重新执行')
+
+    def poll_once(self):
+        for backend in self.backends:
+            self._poll(backend)
+
+    def get_stats(self) -> list[dict]:
+        with self._lock:
+            backends = [backend.to_dict() for backend in self.backends]
+        for stats, backend in zip(backends, self.backends):
+            stats["http"] = backend.client.get_metrics()
+            stats["websocket"] = backend.listener.get_stats()
+        return backends
+
+    def _run(self):
+        while True:
+            self.poll_once()
+            time.sleep(self.poll_interval)
+
+    def _poll(self, backend: Backend):
+        try:
+            queue = backend.client.request('GET', '/queue', timeout=POLL_TIMEOUT, retries=0).json()
+            system_stats = backend.client.request('GET', '/system_stats', timeout=POLL_TIMEOUT, retries=0).json()
+            node_types = None
+            if backend.node_types is None:
+                node_types = set(backend.client.request('GET', '/object_info', timeout=OBJECT_INFO_TIMEOUT, retries=0).json())
+        except (requests.RequestException, ValueError) as e:
+            self._record_failure(backend, str(e))
+            return
+
+        devices = system_stats.get('devices') or []
+        with self._lock:
+            backend.queue_running = len(queue.get('queue_running', []))
+            backend.queue_pending = len(queue.get('queue_pending', []))
+            # 队列项为 [序号, prompt_id, prompt, extra_data, outputs]，按序号执行
+            running = [item[1] for item in queue.get('queue_running', [])]
+            pending = [item[1] for item in sorted(queue.get('queue_pending', []), key=lambda item: item[0])]
+            backend.queue_order = {prompt_id: 0 for prompt_id in running}
+            backend.queue_order.update((prompt_id, len(running) + i) for i, prompt_id in enumerate(pending))
+            backend.submitted_since_poll = 0
+            backend.vram_free = sum(device.get('vram_free', 0) for device in devices) if devices else None
+            if node_types is not None:
+                backend.node_types = node_types
+            backend.last_poll = time.time()
+        self._mark_recovered(backend)
+
+    def _record_failure(self, backend: Backend, error: str, immediate: bool = False):
+        with self._lock:
+            backend.failures += 1
+            backend.last_error = error
+            went_down = backend.healthy and (immediate or backend.failures >= FAILURE_THRESHOLD)
+            if went_down:
+                backend.healthy = False
+                backend.node_types = None  # 恢复后重新读取，期间可能装了新的自定义节点
+        if went_down:
+            print(f"ComfyUI 后端 {backend.address} 不可用，已移出轮换: {error}")
+            backend.listener.abort_pending(f"ComfyUI 后端 {backend.address} 不可用")
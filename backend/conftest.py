@@ -0,0 +1,51 @@
+"""
+pytest 公共配置：每个测试使用临时目录中的独立数据库。
+
+test_api.py 是对运行中服务器的手动集成测试脚本（python test_api.py），不由 pytest 收集。
+导入 app 之前先把 ComfyUI 目录、默认数据库和后端地址指向临时目录 / 本机端口，端到端测试在该端口上启动 fake_comfyui。
+"""
+import os
+import socket
+import tempfile
+
+import pytest
+
+import database
+
+collect_ignore = ['test_api.py']
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+COMFYUI_ROOT = tempfile.mkdtemp(prefix='video_tree_test_')
+os.makedirs(os.path.join(COMFYUI_ROOT, 'input'), exist_ok=True)
+os.makedirs(os.path.join(COMFYUI_ROOT, 'output'), exist_ok=True)
+os.environ.update(
+    APP_MODE='server',
+    COMFYUI_ROOT=COMFYUI_ROOT,
+    COMFYUI_SERVERS=f"127.0.0.1:{_free_port()}",
+    GENERATION_CACHE='0',
+)
+# 测试结束后仍在运行的后台线程（任务队列、后端轮询）回到默认数据库时，不能碰到仓库里的数据库文件
+database.DATABASE_FILE = os.path.join(COMFYUI_ROOT, 'default.db')
+database.init_db(backup=False)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """初始化一个空数据库并设为默认数据库"""
+    monkeypatch.setattr(database, 'DATABASE_FILE', str(tmp_path / 'test.db'))
+    database.init_db(backup=False)
+    return database
+
+
+@pytest.fixture
+def tree(db):
+    """新建一棵只有根节点的树，返回 (tree_id, 根节点 ID)"""
+    tree_id = db.create_tree('test')
+    db.add_node('root', tree_id, None, 'Init', {}, 'Init')
+    return tree_id, 'root'
@@ -1,95 +1,466 @@
+import base64
+import os
 import sqlite3
 import json
+import threading
+import urllib.parse
 import uuid
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from typing import Optional
 
 # --- 配置 ---
 # 数据库文件的名称，它将与 app.py 存储在同一个 backend/ 目录下
 #DATABASE_FILE = 'video_tree_Camel_figurines.db'
 DATABASE_FILE = 'video_tree.db'
+
+# --- 连接池与 SQLite 调优参数 ---
+POOL_MAX_IDLE = 8                    # 每个数据库文件最多保留的空闲连接数
+SQLITE_BUSY_TIMEOUT = 5.0            # 写锁被占用时的等待秒数
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024 # 内存映射 I/O 大小 (256MB)
+SQLITE_CACHE_SIZE_KB = 64 * 1024     # 每个连接的页缓存大小 (64MB)
+
+# --- 变更日志 ---
+CHANGE_LOG_RETENTION = 1000  # 每棵树保留最近多少个版本的变更记录，更早的 since 只能拿到全量数据
+
+# --- 祖先/后代递归查询 ---
+LINEAGE_MAX_DEPTH = 10000  # 递归查询的最大层数，防止数据异常（环）时无限递归
+
+# --- 子树分页加载 ---
+SUBTREE_DEFAULT_LIMIT = 200
+SUBTREE_MAX_LIMIT = 1000
+# 可投影的字段；node_id 总是返回
+SUBTREE_FIELDS = ('module_id', 'title', 'status', 'created_at', 'depth', 'parent_id',
+                  'child_count', 'thumbnail', 'parameters', 'assets')
+
+_change_listeners = []  # 树发生修改时的回调 callback(tree_id, rev)，例如让响应缓存失效
+
+_pools: dict[str, list[sqlite3.Connection]] = {}
+_pools_lock = threading.Lock()
+_local = threading.local()  # 当前线程正在使用的连接 {数据库路径: _Binding}
+
 # --- 核心函数 ---
 
-def get_db_connection():
-    """获取数据库连接，并设置返回结果为字典形式"""
-    conn = sqlite3.connect(DATABASE_FILE)
+def _configure_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """为连接设置统一的行格式和 PRAGMA（WAL、synchronous=NORMAL、mmap、页缓存）"""
     # 这行代码让查询结果可以通过列名访问，像字典一样，非常方便
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
+    # WAL 模式下读者不会被写者阻塞；journal_mode 会持久化到数据库文件中
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
     return conn
 
-def init_db():
+def get_db_connection():
+    """获取一个新的（非池化）数据库连接，并设置返回结果为字典形式。调用方负责 commit/close。"""
+    conn = sqlite3.connect(DATABASE_FILE, timeout=SQLITE_BUSY_TIMEOUT)
+    return _configure_connection(conn)
+
+
+class _Binding:
+    """记录某个线程当前借用的连接，以及嵌套的 connection()/transaction() 层数"""
+    __slots__ = ('conn', 'refs', 'tx_depth')
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.refs = 0
+        self.tx_depth = 0
+
+
+def _acquire(path: str) -> sqlite3.Connection:
+    """从连接池取出一个空闲连接，没有则新建"""
+    with _pools_lock:
+        idle = _pools.get(path)
+        if idle:
+            return idle.pop()
+    # 池化连接使用 autocommit 模式，事务由 transaction() 显式管理
+    conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+    return _configure_connection(conn)
+
+def _release(path: str, conn: sqlite3.Connection):
+    """把连接归还到连接池；超出空闲上限的连接直接关闭"""
+    if conn.in_transaction:
+        conn.rollback()
+    with _pools_lock:
+        idle = _pools.setdefault(path, [])
+        if len(idle) < POOL_MAX_IDLE:
+            idle.append(conn)
+            return
+    conn.close()
+
+def close_all_connections():
+    """关闭所有空闲的池化连接（例如切换 DATABASE_FILE 或进程退出前调用）"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for idle in pools:
+        for conn in idle:
+            conn.close()
+
+@contextmanager
+def connection(db_file: str | None = None):
+    """
+    借用一个池化连接。同一线程内嵌套调用会复用同一个连接，
+    因此 transaction() 内部调用的其它数据库函数都在同一个事务里执行。
+    :param db_file: 数据库文件路径，默认使用 DATABASE_FILE。
     """
-    初始化数据库。如果数据库文件或表不存在，则创建它们。
+    path = os.path.abspath(db_file or DATABASE_FILE)
+    bindings = getattr(_local, 'bindings', None)
+    if bindings is None:
+        bindings = _local.bindings = {}
+
+    binding = bindings.get(path)
+    if binding is None:
+        binding = bindings[path] = _Binding(_acquire(path))
+    binding.refs += 1
+    try:
+        yield binding.conn
+    finally:
+        binding.refs -= 1
+        if binding.refs == 0:
+            del bindings[path]
+            _release(path, binding.conn)
+
+@contextmanager
+def transaction(db_file: str | None = None, readonly: bool = False):
+    """
+    在池化连接上开启事务，正常退出时提交，出现异常时回滚并继续抛出。
+    可以嵌套：外层是真正的事务，内层使用 SAVEPOINT，内层失败只回滚自己的部分。
+    用法：
+        with database.transaction():
+            database.add_node(...)
+            database.update_node(...)
+    :param readonly: 只读事务使用 BEGIN DEFERRED（获得一致的快照而不占用写锁），
+                     否则使用 BEGIN IMMEDIATE，避免读锁升级为写锁时的 SQLITE_BUSY。
+    """
+    with connection(db_file) as conn:
+        binding = _local.bindings[os.path.abspath(db_file or DATABASE_FILE)]
+        depth = binding.tx_depth
+        savepoint = f"sp_{depth}"
+        if depth == 0:
+            conn.execute("BEGIN" if readonly else "BEGIN IMMEDIATE")
+        else:
+            conn.execute(f"SAVEPOINT {savepoint}")
+        binding.tx_depth += 1
+        try:
+            yield conn
+        except BaseException:
+            binding.tx_depth -= 1
+            if depth == 0:
+                conn.rollback()
+            else:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+            raise
+        binding.tx_depth -= 1
+        if depth == 0:
+            conn.commit()
+        else:
+            conn.execute(f"RELEASE {savepoint}")
+
+def init_db(db_file: str | None = None, backup: bool = True):
+    """
+    初始化数据库。如果数据库文件或表不存在，则创建它们，然后执行未完成的迁移（见 migrations.py）。
     这个函数应该在 app.py 启动时被调用一次。
+    :param db_file: 数据库文件路径，默认使用 DATABASE_FILE。
+    :param backup: 有待执行的迁移时是否先备份数据库。
+    :return: 是否初始化成功
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # 创建 Trees 表，用于存储每一个项目（每一棵树）
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Trees (
-            tree_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        ''')
-
-        # 创建 Nodes 表，用于存储树上的每一个节点
-        # 删去 parent_id TEXT,
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Nodes (
-            node_id TEXT PRIMARY KEY,
+    import migrations  # migrations 依赖本模块，延迟导入避免循环引用
+    try:
+        with transaction(db_file) as conn:
+            _create_schema(conn.cursor())
+        migrations.run_migrations(db_file, backup=backup)
+        print("数据库已成功初始化。检查/创建了trees, nodes, nodes_parents 表")
+        return True
+    except sqlite3.Error as e:
+        print(f"数据库初始化失败: {e}")
+        return False
+
+def _create_schema(cursor: sqlite3.Cursor):
+    """创建所有表和索引（幂等）"""
+    # 创建 Trees 表，用于存储每一个项目（每一棵树）
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Trees (
+        tree_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        rev INTEGER NOT NULL DEFAULT 0  -- 单调递增的版本号，每次修改节点或关系时 +1
+    );
+    ''')
+    # 旧数据库没有 rev 字段，补上
+    _ensure_column(cursor, 'trees', 'rev', 'INTEGER NOT NULL DEFAULT 0')
+
+    # 创建 Nodes 表，用于存储树上的每一个节点
+    # 删去 parent_id TEXT,
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS Nodes (
+        node_id TEXT PRIMARY KEY,
+        tree_id INTEGER NOT NULL,
+        
+        module_id TEXT NOT NULL,
+        parameters TEXT,  -- 将作为JSON字符串存储
+        title TEXT NOT NULL,
+        assets TEXT,      -- 将作为JSON字符串存储
+        media TEXT,       -- 将作为JSON字符串存储
+        status TEXT NOT NULL DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        prompt_id TEXT,              -- 最近一次生成提交到 ComfyUI 的 prompt_id
+        comfyui_backend TEXT,        -- 执行该 prompt 的 ComfyUI 后端地址
+        generation_started_at TIMESTAMP,
+        input_hash TEXT,             -- 最近一次生成时输入（模块、参数、输入文件内容）的哈希，重新执行下游时据此跳过未变化的节点
+        
+        FOREIGN KEY (tree_id) REFERENCES Trees (tree_id)
+    );
+    ''')
+    # 3. 创建 'node_parents' 表 (存储父子关系，支持多父节点)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS node_parents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            child_node_id TEXT NOT NULL,
+            parent_node_id TEXT NOT NULL,
+            FOREIGN KEY (child_node_id) REFERENCES nodes (node_id) ON DELETE CASCADE,
+            FOREIGN KEY (parent_node_id) REFERENCES nodes (node_id) ON DELETE CASCADE,
+            UNIQUE(child_node_id, parent_node_id)
+        )
+    ''')         # 为外键添加索引以提高查询性能         
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_child_node ON node_parents (child_node_id)")         
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_parent_node ON node_parents (parent_node_id)")
+    # 按树加载节点时使用（get_tree_as_json 的 WHERE tree_id = ? ORDER BY created_at）
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_nodes_tree_created ON nodes (tree_id, created_at)")
+
+    # 4. 创建 'tree_changes' 表 (变更日志，供前端按 since 增量拉取)
+    # entity: 'node' | 'edge'；op: 'upsert' | 'delete'；edge 记录使用 node_id=子节点、parent_node_id=父节点
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tree_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
             tree_id INTEGER NOT NULL,
-            
-            module_id TEXT NOT NULL,
-            parameters TEXT,  -- 将作为JSON字符串存储
-            title TEXT NOT NULL,
-            assets TEXT,      -- 将作为JSON字符串存储
-            media TEXT,       -- 将作为JSON字符串存储
-            status TEXT NOT NULL DEFAULT 'pending',
+            rev INTEGER NOT NULL,
+            entity TEXT NOT NULL,
+            op TEXT NOT NULL,
+            node_id TEXT NOT NULL,
+            parent_node_id TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tree_changes_rev ON tree_changes (tree_id, rev)")
+
+    # 5. 创建 'node_assets' 表 (nodes.assets JSON 的规范化索引，随 add_node / update_node 同步)
+    # direction: 'input' | 'output'；kind: images / videos / audio ...；storage_type: URL 中的 type 参数
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS node_assets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            node_id TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            ordinal INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            subfolder TEXT NOT NULL DEFAULT '',
+            storage_type TEXT NOT NULL DEFAULT 'output',
+            FOREIGN KEY (node_id) REFERENCES nodes (node_id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_node_assets_node ON node_assets (node_id, direction, kind, ordinal)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_node_assets_filename ON node_assets (filename)")
+
+    # 6. 创建 'jobs' 表 (生成任务队列，见 jobs.py)
+    # status: 'queued' | 'running' | 'completed' | 'failed' | 'cancelled'
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            node_id TEXT NOT NULL,
+            tree_id INTEGER,
+            kind TEXT NOT NULL DEFAULT 'generate',
+            payload TEXT NOT NULL,   -- 将作为JSON字符串存储
+            status TEXT NOT NULL DEFAULT 'queued',
+            error TEXT,
+            error_code INTEGER,      -- 失败时对应的 HTTP 状态码 (400 参数错误 / 500 内部错误)
+            result TEXT,             -- 处理函数的返回值（JSON），如未使用的参数
+            attempts INTEGER NOT NULL DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            
-            FOREIGN KEY (tree_id) REFERENCES Trees (tree_id)
-        );
-        ''')
-        # 3. 创建 'node_parents' 表 (存储父子关系，支持多父节点)
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS node_parents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                child_node_id TEXT NOT NULL,
-                parent_node_id TEXT NOT NULL,
-                FOREIGN KEY (child_node_id) REFERENCES nodes (node_id) ON DELETE CASCADE,
-                FOREIGN KEY (parent_node_id) REFERENCES nodes (node_id) ON DELETE CASCADE,
-                UNIQUE(child_node_id, parent_node_id)
-            )
-        ''')         # 为外键添加索引以提高查询性能         
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_child_node ON node_parents (child_node_id)")         
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_parent_node ON node_parents (parent_node_id)")
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            deadline_at TIMESTAMP,   -- 超过此时间仍未完成则中断 ComfyUI 上的 prompt 并判定失败
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            priority TEXT NOT NULL DEFAULT 'preview',  -- 'preview' | 'final'，见 scheduler.py
+            cost REAL,               -- 估计的 GPU 秒数
+            virtual_start REAL NOT NULL DEFAULT 0,     -- 加权公平排队的开始 / 结束标签，按 virtual_start 领取
+            virtual_finish REAL NOT NULL DEFAULT 0,
+            sweep_id TEXT,           -- 参数扫描（POST /api/nodes/<id>/sweep）一次创建的一组任务，索引见迁移 7
+            rerun_id TEXT,           -- 重新执行下游（POST /api/nodes/<id>/rerun）一次创建的一组任务，索引见迁移 8
+            worker_id TEXT,          -- 领取任务的 JobQueue（进程）标识
+            heartbeat_at TIMESTAMP   -- 执行中的任务由所属进程定期续期；超过租约时间没有续期视为进程已退出
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_node ON jobs (node_id, created_at)")
 
-        conn.commit()
-        #conn.close()
-        print("数据库已成功初始化。检查/创建了trees, nodes, nodes_parents 表")
-    except sqlite3.Error as e:         
-        print(f"数据库初始化失败: {e}")     
-    finally:         
-        conn.close()
+    # 6.2 创建 'job_dependencies' 表 (任务之间的依赖：depends_on 的任务全部 completed 之前，job_id 不会被领取)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_dependencies (
+            job_id TEXT NOT NULL,
+            depends_on TEXT NOT NULL,
+            PRIMARY KEY (job_id, depends_on),
+            FOREIGN KEY (job_id) REFERENCES jobs (job_id) ON DELETE CASCADE,
+            FOREIGN KEY (depends_on) REFERENCES jobs (job_id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_dependencies_upstream ON job_dependencies (depends_on)")
+
+    # 6.1 创建 'job_prompts' 表 (任务提交到 ComfyUI 的每个 prompt，重启后据此接管而不是重新生成)
+    # variant: 第几个种子变体（从 1 开始）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_prompts (
+            job_id TEXT NOT NULL,
+            variant INTEGER NOT NULL,
+            prompt_id TEXT NOT NULL,
+            backend TEXT,
+            submitted_at TIMESTAMP,
+            PRIMARY KEY (job_id, variant),
+            FOREIGN KEY (job_id) REFERENCES jobs (job_id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_job_prompts_prompt ON job_prompts (prompt_id)")
+
+    # 7. 创建 'generation_cache' 表 (生成结果缓存，见 result_cache.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS generation_cache (
+            cache_key TEXT PRIMARY KEY,   -- 工作流 JSON + 输入文件内容的 sha256
+            module_id TEXT,
+            outputs TEXT NOT NULL,        -- 将作为JSON字符串存储，格式同 assets.output
+            gpu_seconds REAL,             -- 生成时 ComfyUI 实际执行的秒数
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_cache_last_used ON generation_cache (last_used_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_cache_created ON generation_cache (created_at)")
+
+def _ensure_column(cursor: sqlite3.Cursor, table: str, column: str, definition: str):
+    """如果表中缺少某个字段，则通过 ALTER TABLE 补上"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [col[1] for col in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        print(f"已为 {table} 表添加 '{column}' 字段。")
+
+def _record_changes(conn: sqlite3.Connection, tree_id: int, changes: list[tuple]) -> int:
+    """
+    将一次修改写入变更日志，并把树的版本号 +1。必须在写事务中调用。
+    :param changes: [(entity, op, node_id, parent_node_id), ...]
+    :return: 新的版本号
+    """
+    conn.execute("UPDATE trees SET rev = rev + 1 WHERE tree_id = ?", (tree_id,))
+    rev = conn.execute("SELECT rev FROM trees WHERE tree_id = ?", (tree_id,)).fetchone()[0]
+    conn.executemany(
+        "INSERT INTO tree_changes (tree_id, rev, entity, op, node_id, parent_node_id) VALUES (?, ?, ?, ?, ?, ?)",
+        [(tree_id, rev, entity, op, node_id, parent_id) for entity, op, node_id, parent_id in changes]
+    )
+    # 定期清理过旧的日志，避免无限增长
+    if rev % 100 == 0:
+        conn.execute("DELETE FROM tree_changes WHERE tree_id = ? AND rev <= ?", (tree_id, rev - CHANGE_LOG_RETENTION))
+    # 通知监听者（此时事务尚未提交；监听者只应做失效这类幂等操作）
+    for callback in _change_listeners:
+        callback(tree_id, rev)
+    return rev
+
+def _reset_change_log(conn: sqlite3.Connection, tree_id: int) -> int:
+    """
+    批量写入（如导入）后调用：版本号 +1 并清空该树的变更日志，
+    之后任何 since 都会拿到全量数据，避免为每个节点写一条日志。必须在写事务中调用。
+    """
+    conn.execute("UPDATE trees SET rev = rev + 1 WHERE tree_id = ?", (tree_id,))
+    conn.execute("DELETE FROM tree_changes WHERE tree_id = ?", (tree_id,))
+    rev = conn.execute("SELECT rev FROM trees WHERE tree_id = ?", (tree_id,)).fetchone()[0]
+    for callback in _change_listeners:
+        callback(tree_id, rev)
+    return rev
+
+def add_change_listener(callback):
+    """注册树修改的回调 callback(tree_id, rev)，每次 add_node / update_node / 删除节点都会触发"""
+    if callback not in _change_listeners:
+        _change_listeners.append(callback)
+
+_INSERT_NODE_ASSET_SQL = """
+    INSERT INTO node_assets (node_id, direction, kind, ordinal, filename, subfolder, storage_type)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _parse_asset_url(asset_url) -> tuple[str, str, str] | None:
+    """解析 /view?filename=...&subfolder=...&type=... 为 (filename, subfolder, type)"""
+    if not isinstance(asset_url, str):
+        return None
+    query_params = urllib.parse.parse_qs(urllib.parse.urlparse(asset_url).query)
+    filename = query_params.get('filename', [None])[0]
+    if not filename:
+        return None
+    return filename, query_params.get('subfolder', [''])[0], query_params.get('type', ['output'])[0]
+
+def _asset_rows(node_id: str, assets: dict | None) -> list[tuple]:
+    """
+    把 assets 字典展开为 node_assets 的行。
+    新格式: {"input": {"images": [...]}, "output": {"videos": [...]}}
+    旧格式: {"images": [...]}，此时按 URL 中的 type 参数区分 input / output
+    """
+    if not isinstance(assets, dict):
+        return []
+    is_new_format = any(key in ('input', 'output') for key in assets)
+    groups = []  # (direction | None, kind, urls)
+    if is_new_format:
+        for direction in ('input', 'output'):
+            section = assets.get(direction)
+            if isinstance(section, dict):
+                groups.extend((direction, kind, urls) for kind, urls in section.items())
+    else:
+        groups.extend((None, kind, urls) for kind, urls in assets.items())
+
+    rows = []
+    for direction, kind, urls in groups:
+        if not isinstance(urls, list):
+            continue
+        for ordinal, url in enumerate(urls):
+            parsed = _parse_asset_url(url)
+            if not parsed:
+                continue
+            filename, subfolder, storage_type = parsed
+            row_direction = direction or ('input' if storage_type == 'input' else 'output')
+            rows.append((node_id, row_direction, kind, ordinal, filename, subfolder, storage_type))
+    return rows
+
+def _sync_node_assets(conn: sqlite3.Connection, node_id: str, assets: dict | None):
+    """用 assets 字典重建节点的 node_assets 记录。必须在写事务中调用"""
+    conn.execute("DELETE FROM node_assets WHERE node_id = ?", (node_id,))
+    conn.executemany(_INSERT_NODE_ASSET_SQL, _asset_rows(node_id, assets))
+
+def _decode_node_row(node_row: sqlite3.Row) -> dict:
+    """把 nodes 表的一行转换为字典，并解析 parameters / assets 的 JSON"""
+    node_dict = dict(node_row)
+    try:
+        node_dict['parameters'] = json.loads(node_dict['parameters']) if node_dict['parameters'] else {}
+    except json.JSONDecodeError:
+        print(f"警告：解析节点 {node_dict['node_id']} 的 parameters JSON 失败。")
+        node_dict['parameters'] = {}
+
+    try:
+        node_dict['assets'] = json.loads(node_dict['assets']) if node_dict['assets'] else {}
+    except json.JSONDecodeError:
+        print(f"警告：解析节点 {node_dict['node_id']} 的 assets JSON 失败。")
+        node_dict['assets'] = {}
+    return node_dict
 
 
 def create_tree(name: str) -> int:
-    """创建一个新的项目树，并返回其 tree_id"""     
-    conn = get_db_connection()     
-    cursor = conn.cursor()     
-    try:         
-        cursor.execute("INSERT INTO trees (name) VALUES (?)", (name,))         
-        conn.commit()         
-        print(f"创建新项目树: '{name}', ID: {cursor.lastrowid}")         
-        return cursor.lastrowid     
-    except sqlite3.Error as e:         
-        print(f"创建项目树失败: {e}")         
+    """创建一个新的项目树，并返回其 tree_id"""
+    try:
+        with transaction() as conn:
+            cursor = conn.execute("INSERT INTO trees (name) VALUES (?)", (name,))
+        print(f"创建新项目树: '{name}', ID: {cursor.lastrowid}")
+        return cursor.lastrowid
+    except sqlite3.Error as e:
+        print(f"创建项目树失败: {e}")
         return -1 # 或者抛出异常
-    finally:         
-        conn.close()
 
 
 def add_node(node_id: str,tree_id: int, parent_ids: list[str] | None, module_id: str, parameters: dict, title:str, assets: dict = None, status: str = 'completed') -> str | None:
@@ -105,144 +476,373 @@ def add_node(node_id: str,tree_id: int, parent_ids: list[str] | None, module_id:
     :return: 新创建节点的 node_id，如果失败则返回 None。
     """
     #new_node_id = str(uuid.uuid4())
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
         parameters_json = json.dumps(parameters) if parameters else None
         assets_json = json.dumps(assets) if assets else None
         created_at_dt = datetime.now()
 
-        # 1. 插入节点基本信息到 'nodes' 表
-        cursor.execute(
-            """INSERT INTO nodes (node_id, tree_id, module_id, parameters, title, assets, status, created_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-            (node_id, tree_id, module_id, parameters_json, title, assets_json, status, created_at_dt)
-        )
+        # 出错时 transaction() 会自动回滚
+        with transaction() as conn:
+            # 1. 插入节点基本信息到 'nodes' 表
+            conn.execute(
+                """INSERT INTO nodes (node_id, tree_id, module_id, parameters, title, assets, status, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (node_id, tree_id, module_id, parameters_json, title, assets_json, status, created_at_dt)
+            )
 
-        # 2. 如果有父节点，插入关系到 'node_parents' 表
-        if parent_ids:
-            parent_data = [(node_id, parent_id) for parent_id in parent_ids if parent_id] # 确保 parent_id 有效
-            if parent_data:
-                cursor.executemany(
-                    "INSERT INTO node_parents (child_node_id, parent_node_id) VALUES (?, ?)",
-                    parent_data
-                )
+            # 2. 如果有父节点，插入关系到 'node_parents' 表
+            if parent_ids:
+                parent_data = [(node_id, parent_id) for parent_id in parent_ids if parent_id] # 确保 parent_id 有效
+                if parent_data:
+                    conn.executemany(
+                        "INSERT INTO node_parents (child_node_id, parent_node_id) VALUES (?, ?)",
+                        parent_data
+                    )
+
+            # 3. 同步资源索引，写变更日志
+            _sync_node_assets(conn, node_id, assets)
+            _record_changes(
+                conn, tree_id,
+                [('node', 'upsert', node_id, None)]
+                + [('edge', 'upsert', node_id, parent_id) for parent_id in (parent_ids or []) if parent_id]
+            )
 
-        conn.commit()
         print(f"    - 成功添加节点 {node_id} (父节点: {parent_ids}) 到数据库。")
         return node_id
     except sqlite3.Error as e:
-        conn.rollback() # 出错时回滚
         print(f"添加节点失败: {e}")
         return None
-    finally:
-        conn.close()
 
 def get_node(node_id: str) -> dict | None:
     """根据 node_id 获取单个节点的详细信息"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT node_id, tree_id, module_id, parameters, title, assets, status, created_at FROM nodes WHERE node_id = ?", (node_id,))
-        node_row = cursor.fetchone()
-
-        if node_row:
-            node_dict = dict(node_row)
-            try:
-                node_dict['parameters'] = json.loads(node_dict['parameters']) if node_dict['parameters'] else {}
-            except json.JSONDecodeError:
-                print(f"警告：解析节点 {node_id} 的 parameters JSON 失败。")
-                node_dict['parameters'] = {} # 返回空字典
-
-            try:
-                node_dict['assets'] = json.loads(node_dict['assets']) if node_dict['assets'] else {}
-            except json.JSONDecodeError:
-                print(f"警告：解析节点 {node_id} 的 assets JSON 失败。")
-                node_dict['assets'] = {} # 返回空字典
-            
-             # 查询并添加父节点ID列表 (可选，如果前端需要完整信息)
-            cursor.execute("SELECT parent_node_id FROM node_parents WHERE child_node_id = ?", (node_id,))
-            parents = cursor.fetchall()
-            node_dict['parent_ids'] = [p['parent_node_id'] for p in parents]
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT node_id, tree_id, module_id, parameters, title, assets, status, created_at FROM nodes WHERE node_id = ?", (node_id,))
+            node_row = cursor.fetchone()
 
-            return node_dict
-        else:
-            return None
+            if node_row:
+                node_dict = dict(node_row)
+                try:
+                    node_dict['parameters'] = json.loads(node_dict['parameters']) if node_dict['parameters'] else {}
+                except json.JSONDecodeError:
+                    print(f"警告：解析节点 {node_id} 的 parameters JSON 失败。")
+                    node_dict['parameters'] = {} # 返回空字典
+
+                try:
+                    node_dict['assets'] = json.loads(node_dict['assets']) if node_dict['assets'] else {}
+                except json.JSONDecodeError:
+                    print(f"警告：解析节点 {node_id} 的 assets JSON 失败。")
+                    node_dict['assets'] = {} # 返回空字典
+
+                 # 查询并添加父节点ID列表 (可选，如果前端需要完整信息)
+                cursor.execute("SELECT parent_node_id FROM node_parents WHERE child_node_id = ?", (node_id,))
+                parents = cursor.fetchall()
+                node_dict['parent_ids'] = [p['parent_node_id'] for p in parents]
+
+                return node_dict
+            else:
+                return None
     except sqlite3.Error as e:
         print(f"获取节点 {node_id} 失败: {e}")
         return None
-    finally:
-        conn.close()
 
 def get_tree_as_json(tree_id: int) -> dict | None:
     """
     获取指定树的所有节点信息，并构造成前端需要的 JSON 格式。
-    为了兼容 D3 的 stratify，此函数会为每个节点查找父节点，
-    并只返回第一个找到的父节点作为 'parent_id'。
-    注意：这只是为了可视化，数据库中存储了完整的父子关系。
-    """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # 检查树是否存在
-        cursor.execute("SELECT name FROM trees WHERE tree_id = ?", (tree_id,))
-        tree_info = cursor.fetchone()
-        if not tree_info:
-            print(f"未找到 tree_id={tree_id} 的项目树。")
-            return None # 或者可以返回一个空结构
-
-        # 获取该树的所有节点
-        cursor.execute("""
-            SELECT node_id, module_id, parameters, title, assets, status, created_at
-            FROM nodes
-            WHERE tree_id = ?
-            ORDER BY created_at ASC
-        """, (tree_id,))
-        nodes_raw = cursor.fetchall()
-
-        nodes_for_frontend = []
-        for node_row in nodes_raw:
-            node_dict = dict(node_row)
-            try:
-                node_dict['parameters'] = json.loads(node_dict['parameters']) if node_dict['parameters'] else {}
-            except json.JSONDecodeError:
-                print(f"警告：解析节点 {node_dict['node_id']} 的 parameters JSON 失败。")
-                node_dict['parameters'] = {}
-
-            try:
-                node_dict['assets'] = json.loads(node_dict['assets']) if node_dict['assets'] else {}
-            except json.JSONDecodeError:
-                print(f"警告：解析节点 {node_dict['node_id']} 的 assets JSON 失败。")
-                node_dict['assets'] = {}
-            
-            # 查询该节点的父节点
-            cursor.execute("SELECT parent_node_id FROM node_parents WHERE child_node_id = ?", (node_dict['node_id'],))
-            parents = cursor.fetchall()
-            
-            # 2. (关键) 将所有父节点 ID 收集到一个列表中
-            parent_ids_list = [p['parent_node_id'] for p in parents] #
-            # 3. (关键) 如果列表为空，则为 None；否则使用完整列表
-            if parent_ids_list:
-                node_dict['parent_id'] = parent_ids_list
-            else:
-                node_dict['parent_id'] = None # 根节点
-            # (旧的 v72 错误代码 已被替换)
-            nodes_for_frontend.append(node_dict)
+    每个节点的 'parent_id' 是其全部父节点 ID 的列表（根节点为 None）。
+    节点和父子关系各用一条查询取出，父节点列表在内存中组装，
+    查询次数与节点数量无关（避免 N+1 查询）。
+    """
+    try:
+        # 只读事务：三条查询读取同一个快照
+        with transaction(readonly=True) as conn:
+            cursor = conn.cursor()
+            # 检查树是否存在
+            cursor.execute("SELECT name, rev FROM trees WHERE tree_id = ?", (tree_id,))
+            tree_info = cursor.fetchone()
+            if not tree_info:
+                print(f"未找到 tree_id={tree_id} 的项目树。")
+                return None # 或者可以返回一个空结构
 
+            # 获取该树的所有节点
+            cursor.execute("""
+                SELECT node_id, module_id, parameters, title, assets, status, created_at
+                FROM nodes
+                WHERE tree_id = ?
+                ORDER BY created_at ASC
+            """, (tree_id,))
+            nodes_raw = cursor.fetchall()
+
+            # 一次性取出该树的所有父子关系
+            # 按 (child, parent) 排序：直接沿 UNIQUE(child, parent) 覆盖索引扫描，无需额外排序，
+            # 父节点顺序也与逐节点查询时完全一致
+            cursor.execute("""
+                SELECT np.child_node_id, np.parent_node_id
+                FROM nodes n
+                JOIN node_parents np ON np.child_node_id = n.node_id
+                WHERE n.tree_id = ?
+                ORDER BY np.child_node_id, np.parent_node_id
+            """, (tree_id,))
+            parents_by_child = {}
+            for child_id, parent_id in cursor.fetchall():
+                parents_by_child.setdefault(child_id, []).append(parent_id)
+
+            nodes_for_frontend = []
+            for node_row in nodes_raw:
+                node_dict = _decode_node_row(node_row)
+                # 如果没有父节点则为 None（根节点）；否则使用完整的父节点列表
+                node_dict['parent_id'] = parents_by_child.get(node_dict['node_id'])
+                nodes_for_frontend.append(node_dict)
+
+            return {
+                "tree_id": tree_id,
+                "name": tree_info['name'],
+                "rev": tree_info['rev'],
+                "nodes": nodes_for_frontend
+            }
+    except sqlite3.Error as e:
+        print(f"获取树 {tree_id} 失败: {e}")
+        return None
+
+def _encode_cursor(depth: int, created_at, node_id: str) -> str:
+    raw = json.dumps([depth, str(created_at), node_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def _decode_cursor(cursor: str) -> tuple[int, str, str]:
+    try:
+        depth, created_at, node_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return int(depth), str(created_at), str(node_id)
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise ValueError(f"无效的 cursor: {cursor}") from e
+
+def get_subtree(root_node_id: str, max_depth: int | None = None, limit: int = SUBTREE_DEFAULT_LIMIT,
+                cursor: str | None = None, fields: list[str] | None = None) -> dict | None:
+    """
+    分页返回以 root_node_id 为根的子树（含根节点），按 (depth, created_at, node_id) 排序。
+    :param max_depth: 最多向下展开的层数（根节点为 0 层），None 表示不限
+    :param limit: 每页节点数，最大 SUBTREE_MAX_LIMIT
+    :param cursor: 上一页返回的 next_cursor，用于继续加载
+    :param fields: 需要返回的字段（见 SUBTREE_FIELDS），None 表示全部；
+                   thumbnail 为第一张输出图片（没有则取第一张输入图片）的 URL
+    :return: {"tree_id", "root_id", "rev", "nodes", "next_cursor"}；根节点不存在时返回 None。
+             参数不合法时抛出 ValueError。
+    """
+    fields = list(SUBTREE_FIELDS) if fields is None else [f for f in fields if f != 'node_id']
+    unknown = [f for f in fields if f not in SUBTREE_FIELDS]
+    if unknown:
+        raise ValueError(f"未知的字段: {', '.join(unknown)}")
+    limit = max(1, min(int(limit), SUBTREE_MAX_LIMIT))
+    max_depth = LINEAGE_MAX_DEPTH if max_depth is None else max(0, min(int(max_depth), LINEAGE_MAX_DEPTH))
+    after = _decode_cursor(cursor) if cursor else (-1, '', '')
+
+    # 只读取需要的列，parameters / assets 这类大字段在不需要时不会被加载
+    columns = ['n.node_id', "COALESCE(n.created_at, '') AS created_at", 's.depth']
+    columns += [f'n.{f}' for f in ('module_id', 'title', 'status') if f in fields]
+    decode_blobs = 'parameters' in fields or 'assets' in fields
+    if decode_blobs:
+        columns += ['n.parameters', 'n.assets']
+    try:
+        with transaction(readonly=True) as conn:
+            db_cursor = conn.cursor()
+            db_cursor.execute("SELECT tree_id FROM nodes WHERE node_id = ?", (root_node_id,))
+            root_row = db_cursor.fetchone()
+            if not root_row:
+                return None
+            tree_id = root_row['tree_id']
+            rev = conn.execute("SELECT rev FROM trees WHERE tree_id = ?", (tree_id,)).fetchone()
+
+            # 多父节点时同一节点可能从多条路径到达，取最短深度
+            db_cursor.execute(f"""
+                WITH RECURSIVE walk(node_id, depth) AS (
+                    SELECT ?, 0
+                    UNION
+                    SELECT np.child_node_id, w.depth + 1
+                    FROM walk w JOIN node_parents np ON np.parent_node_id = w.node_id
+                    WHERE w.depth < ?
+                ),
+                subtree AS (SELECT node_id, MIN(depth) AS depth FROM walk GROUP BY node_id)
+                SELECT {', '.join(columns)}
+                FROM subtree s JOIN nodes n ON n.node_id = s.node_id
+                WHERE (s.depth, COALESCE(n.created_at, ''), n.node_id) > (?, ?, ?)
+                ORDER BY s.depth, COALESCE(n.created_at, ''), n.node_id
+                LIMIT ?
+            """, (root_node_id, max_depth, *after, limit + 1))
+            rows = db_cursor.fetchall()
+
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            page_ids = json.dumps([row['node_id'] for row in rows])
+
+            parents_by_child = {}
+            if 'parent_id' in fields:
+                db_cursor.execute("""
+                    SELECT child_node_id, parent_node_id FROM node_parents
+                    WHERE child_node_id IN (SELECT value FROM json_each(?))
+                    ORDER BY child_node_id, parent_node_id
+                """, (page_ids,))
+                for child_id, parent_id in db_cursor.fetchall():
+                    parents_by_child.setdefault(child_id, []).append(parent_id)
+
+            child_counts = {}
+            if 'child_count' in fields:
+                db_cursor.execute("""
+                    SELECT parent_node_id, COUNT(*) FROM node_parents
+                    WHERE parent_node_id IN (SELECT value FROM json_each(?))
+                    GROUP BY parent_node_id
+                """, (page_ids,))
+                child_counts = dict(db_cursor.fetchall())
+
+            thumbnails = {}
+            if 'thumbnail' in fields:
+                db_cursor.execute("""
+                    SELECT node_id, filename, subfolder, storage_type FROM node_assets
+                    WHERE node_id IN (SELECT value FROM json_each(?)) AND kind = 'images'
+                    ORDER BY node_id, direction = 'output' DESC, ordinal
+                """, (page_ids,))
+                for asset in db_cursor.fetchall():
+                    thumbnails.setdefault(asset['node_id'], (
+                        f"/view?filename={urllib.parse.quote_plus(asset['filename'])}"
+                        f"&subfolder={urllib.parse.quote_plus(asset['subfolder'])}&type={asset['storage_type']}"
+                    ))
+
+        nodes = []
+        for row in rows:
+            node_dict = _decode_node_row(row) if decode_blobs else dict(row)
+            node = {'node_id': row['node_id']}
+            for field in fields:
+                if field == 'parent_id':
+                    node['parent_id'] = parents_by_child.get(row['node_id'])
+                elif field == 'child_count':
+                    node['child_count'] = child_counts.get(row['node_id'], 0)
+                elif field == 'thumbnail':
+                    node['thumbnail'] = thumbnails.get(row['node_id'])
+                else:
+                    node[field] = node_dict[field]
+            nodes.append(node)
+
+        last = rows[-1] if rows else None
         return {
             "tree_id": tree_id,
-            "name": tree_info['name'],
-            "nodes": nodes_for_frontend
+            "root_id": root_node_id,
+            "rev": rev['rev'] if rev else 0,
+            "nodes": nodes,
+            "next_cursor": _encode_cursor(last['depth'], last['created_at'], last['node_id']) if has_more else None,
         }
     except sqlite3.Error as e:
-        print(f"获取树 {tree_id} 失败: {e}")
+        print(f"获取节点 {root_node_id} 的子树失败: {e}")
+        return None
+
+def get_tree_revision(tree_id: int) -> dict | None:
+    """轻量查询树的当前版本号以及是否有节点，树不存在时返回 None"""
+    try:
+        with connection() as conn:
+            row = conn.execute(
+                "SELECT rev, EXISTS (SELECT 1 FROM nodes WHERE tree_id = ?) AS has_nodes FROM trees WHERE tree_id = ?",
+                (tree_id, tree_id)
+            ).fetchone()
+            return {"rev": row['rev'], "has_nodes": bool(row['has_nodes'])} if row else None
+    except sqlite3.Error as e:
+        print(f"获取树 {tree_id} 的版本号失败: {e}")
+        return None
+
+def get_tree_changes(tree_id: int, since: int) -> dict | None:
+    """
+    返回树在版本 since 之后的增量变化（只包含最终状态）：
+        {"tree_id", "name", "rev", "since", "full": False,
+         "nodes": {"upserted": [节点...], "removed": [node_id...]},
+         "edges": {"added": [{child_node_id, parent_node_id}...], "removed": [...]}}
+    upserted 中的节点与 get_tree_as_json 的节点格式相同。
+    如果 since 早于保留的日志（或大于当前版本），无法计算增量，则返回带 "full": True 的全量数据。
+    树不存在时返回 None。
+    """
+    try:
+        with transaction(readonly=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name, rev FROM trees WHERE tree_id = ?", (tree_id,))
+            tree_info = cursor.fetchone()
+            if not tree_info:
+                print(f"未找到 tree_id={tree_id} 的项目树。")
+                return None
+            rev = tree_info['rev']
+
+            if since < rev:
+                cursor.execute("SELECT MIN(rev) FROM tree_changes WHERE tree_id = ?", (tree_id,))
+                oldest_rev = cursor.fetchone()[0]
+                log_complete = oldest_rev is not None and oldest_rev <= since + 1
+            else:
+                log_complete = since == rev
+            if not log_complete:
+                tree_data = get_tree_as_json(tree_id)
+                if tree_data is not None:
+                    tree_data.update({"since": since, "full": True})
+                return tree_data
+
+            # 同一实体按时间顺序折叠，只保留最后一次操作
+            cursor.execute("""
+                SELECT entity, op, node_id, parent_node_id
+                FROM tree_changes
+                WHERE tree_id = ? AND rev > ?
+                ORDER BY id ASC
+            """, (tree_id, since))
+            node_ops = {}
+            edge_ops = {}
+            for change in cursor.fetchall():
+                if change['entity'] == 'node':
+                    node_ops[change['node_id']] = change['op']
+                else:
+                    edge_ops[(change['node_id'], change['parent_node_id'])] = change['op']
+
+            upserted_ids = [nid for nid, op in node_ops.items() if op == 'upsert']
+            upserted_nodes = []
+            if upserted_ids:
+                placeholders = ', '.join('?' * len(upserted_ids))
+                cursor.execute(f"""
+                    SELECT node_id, module_id, parameters, title, assets, status, created_at
+                    FROM nodes
+                    WHERE node_id IN ({placeholders})
+                    ORDER BY created_at ASC
+                """, upserted_ids)
+                nodes_raw = cursor.fetchall()
+                cursor.execute(f"""
+                    SELECT child_node_id, parent_node_id FROM node_parents
+                    WHERE child_node_id IN ({placeholders})
+                    ORDER BY child_node_id, parent_node_id
+                """, upserted_ids)
+                parents_by_child = {}
+                for child_id, parent_id in cursor.fetchall():
+                    parents_by_child.setdefault(child_id, []).append(parent_id)
+                for node_row in nodes_raw:
+                    node_dict = _decode_node_row(node_row)
+                    node_dict['parent_id'] = parents_by_child.get(node_dict['node_id'])
+                    upserted_nodes.append(node_dict)
+
+            def edge_list(wanted_op):
+                return [
+                    {"child_node_id": child_id, "parent_node_id": parent_id}
+                    for (child_id, parent_id), op in edge_ops.items() if op == wanted_op
+                ]
+
+            return {
+                "tree_id": tree_id,
+                "name": tree_info['name'],
+                "rev": rev,
+                "since": since,
+                "full": False,
+                "nodes": {
+                    "upserted": upserted_nodes,
+                    "removed": [nid for nid, op in node_ops.items() if op == 'delete'],
+                },
+                "edges": {
+                    "added": edge_list('upsert'),
+                    "removed": edge_list('delete'),
+                },
+            }
+    except sqlite3.Error as e:
+        print(f"获取树 {tree_id} 的增量变化失败: {e}")
         return None
-    finally:
-        conn.close()
 
 def update_node(node_id: str, payload: dict):
-    conn = get_db_connection()
-    cursor = conn.cursor()
     try:
         # 提取需要更新的字段
         module_id = payload.get('module_id')
@@ -271,93 +871,791 @@ def update_node(node_id: str, payload: dict):
         sql = f"UPDATE nodes SET {', '.join(update_fields)} WHERE node_id = ?"
         update_values.append(node_id)  # 最后添加WHERE条件的node_id
         
-        # 执行更新
-        cursor.execute(sql, tuple(update_values))
-        conn.commit()
+        # 执行更新，并写变更日志
+        with transaction() as conn:
+            cursor = conn.execute(sql, tuple(update_values))
+            if cursor.rowcount:
+                _sync_node_assets(conn, node_id, payload.get('assets', {}))
+                tree_id = conn.execute("SELECT tree_id FROM nodes WHERE node_id = ?", (node_id,)).fetchone()[0]
+                _record_changes(conn, tree_id, [('node', 'upsert', node_id, None)])
         print(f"节点 {node_id} 已成功更新。")
     except sqlite3.Error as e:
-        conn.rollback()
         print(f"更新节点 {node_id} 失败: {e}")
-    finally:
-        conn.close()
+
+
+def set_node_status(node_id: str, status: str) -> bool:
+    """只修改节点状态（不触碰 parameters / assets），返回节点是否存在"""
+    try:
+        with transaction() as conn:
+            cursor = conn.execute("UPDATE nodes SET status = ? WHERE node_id = ?", (status, node_id))
+            if not cursor.rowcount:
+                return False
+            tree_id = conn.execute("SELECT tree_id FROM nodes WHERE node_id = ?", (node_id,)).fetchone()[0]
+            _record_changes(conn, tree_id, [('node', 'upsert', node_id, None)])
+        return True
+    except sqlite3.Error as e:
+        print(f"更新节点 {node_id} 状态失败: {e}")
+        return False
+
+
+# --- 生成任务队列 ---
+
+def _decode_job_row(job_row: sqlite3.Row) -> dict:
+    job = dict(job_row)
+    job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+    job['result'] = json.loads(job['result']) if job.get('result') else None
+    return job
+
+def create_job(node_id: str, tree_id: int | None, payload: dict, kind: str = 'generate',
+               priority: str = 'preview', cost: float | None = None, weight: float = 1.0,
+               sweep_id: str | None = None, rerun_id: str | None = None) -> dict | None:
+    """
+    新建一个排队中的任务，并把节点标记为 pending。返回任务字典，失败时返回 None。
+
+    同时计算加权公平排队的标签（每棵树的每个优先级是一条流，预览不会排在本树的视频渲染之后）：
+        virtual_start  = max(系统虚拟时间, 同一条流上一个未完成任务的 virtual_finish)
+        virtual_finish = virtual_start + cost / weight
+    系统虚拟时间取已开始执行的任务中最大的 virtual_start。没有 cost 时标签等于系统虚拟时间，即按创建顺序执行。
+    """
+    job_id = str(uuid.uuid4())
+    try:
+        with transaction() as conn:
+            virtual_time = conn.execute(
+                "SELECT COALESCE(MAX(virtual_start), 0) FROM jobs WHERE kind = ? AND status != 'queued'", (kind,)
+            ).fetchone()[0]
+            flow_backlog = conn.execute(
+                "SELECT MAX(virtual_finish) FROM jobs WHERE kind = ? AND tree_id IS ? AND priority = ? "
+                "AND status IN ('queued', 'running')",
+                (kind, tree_id, priority)
+            ).fetchone()[0]
+            virtual_start = max(virtual_time, flow_backlog or 0)
+            virtual_finish = virtual_start + (cost or 0) / (weight or 1.0)
+            conn.execute(
+                """INSERT INTO jobs (job_id, node_id, tree_id, kind, payload, created_at,
+                                     priority, cost, virtual_start, virtual_finish, sweep_id, rerun_id)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (job_id, node_id, tree_id, kind, json.dumps(payload), datetime.now(),
+                 priority, cost, virtual_start, virtual_finish, sweep_id, rerun_id)
+            )
+            set_node_status(node_id, 'pending')
+        return get_job(job_id)
+    except sqlite3.Error as e:
+        print(f"创建任务失败: {e}")
+        return None
+
+def create_sweep(tree_id: int, sweep_id: str, variants: list[dict], kind: str = 'generate') -> list[dict] | None:
+    """
+    在一个事务中新建参数扫描的全部节点（pending）和对应的任务，任意一个失败则全部回滚。
+    variants 的每一项: {"node_id", "parent_ids", "module_id", "parameters", "title", "assets", "payload", "schedule"}，
+    assets 是节点的初始资源（如从基准节点复制的 input，node_assets 一并写入），schedule 是任务的调度参数（见 create_job）。
+    返回按 variants 顺序排列的任务字典，失败时返回 None
+    """
+    try:
+        with transaction():
+            jobs = []
+            for variant in variants:
+                if not add_node(variant['node_id'], tree_id, variant['parent_ids'], variant['module_id'],
+                                variant['parameters'], variant['title'], assets=variant.get('assets'), status='pending'):
+                    raise sqlite3.Error(f"添加节点 {variant['node_id']} 失败")
+                job = create_job(variant['node_id'], tree_id, variant['payload'], kind=kind, sweep_id=sweep_id,
+                                 **variant.get('schedule', {}))
+                if job is None:
+                    raise sqlite3.Error(f"为节点 {variant['node_id']} 创建任务失败")
+                jobs.append(job)
+        return jobs
+    except sqlite3.Error as e:
+        print(f"创建参数扫描 {sweep_id} 失败: {e}")
+        return None
+
+def get_sweep_jobs(sweep_id: str) -> list[dict]:
+    """参数扫描的全部任务，按创建顺序（即变体顺序）"""
+    try:
+        with connection() as conn:
+            cursor = conn.execute("SELECT * FROM jobs WHERE sweep_id = ? ORDER BY created_at, rowid", (sweep_id,))
+            return [_decode_job_row(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"获取参数扫描 {sweep_id} 的任务失败: {e}")
+        return []
+
+def create_rerun(tree_id: int, rerun_id: str, steps: list[dict], kind: str = 'generate') -> list[dict] | None:
+    """
+    在一个事务中为重新执行下游创建全部任务及任务之间的依赖，任意一个失败则全部回滚。
+    steps 按拓扑顺序排列，每一项: {"node_id", "payload", "schedule", "depends_on": [node_id, ...]}，
+    depends_on 中的节点必须出现在前面的 steps 中。依赖的任务全部 completed 之前任务不会被领取（见 claim_next_job）。
+    返回按 steps 顺序排列的任务字典，失败时返回 None
+    """
+    try:
+        with transaction() as conn:
+            jobs, job_ids = [], {}
+            for step in steps:
+                job = create_job(step['node_id'], tree_id, step['payload'], kind=kind, rerun_id=rerun_id,
+                                 **step.get('schedule', {}))
+                if job is None:
+                    raise sqlite3.Error(f"为节点 {step['node_id']} 创建任务失败")
+                conn.executemany(
+                    "INSERT INTO job_dependencies (job_id, depends_on) VALUES (?, ?)",
+                    [(job['job_id'], job_ids[node_id]) for node_id in step.get('depends_on', [])]
+                )
+                job_ids[step['node_id']] = job['job_id']
+                jobs.append(job)
+        return jobs
+    except (sqlite3.Error, KeyError) as e:
+        print(f"创建重新执行 {rerun_id} 失败: {e}")
+        return None
+
+def get_rerun_jobs(rerun_id: str) -> list[dict]:
+    """重新执行下游的全部任务，按创建顺序（即拓扑顺序）"""
+    try:
+        with connection() as conn:
+            cursor = conn.execute("SELECT * FROM jobs WHERE rerun_id = ? ORDER BY created_at, rowid", (rerun_id,))
+            return [_decode_job_row(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"获取重新执行 {rerun_id} 的任务失败: {e}")
+        return []
+
+def get_job(job_id: str) -> dict | None:
+    try:
+        with connection() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return _decode_job_row(row) if row else None
+    except sqlite3.Error as e:
+        print(f"获取任务 {job_id} 失败: {e}")
+        return None
+
+def get_jobs(node_id: str | None = None, status: str | None = None, limit: int = 100) -> list[dict]:
+    """按创建时间倒序列出任务，可按节点或状态过滤"""
+    conditions, values = [], []
+    if node_id:
+        conditions.append("node_id = ?")
+        values.append(node_id)
+    if status:
+        conditions.append("status = ?")
+        values.append(status)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    try:
+        with connection() as conn:
+            cursor = conn.execute(f"SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ?", (*values, limit))
+            return [_decode_job_row(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"获取任务列表失败: {e}")
+        return []
+
+def claim_next_job(kind: str = 'generate', tree_concurrency: int | None = None, tree_preview_extra: int = 0,
+                   final_concurrency: int | None = None, worker_id: str | None = None) -> dict | None:
+    """
+    原子地领取下一个任务：标记为 running 并把节点标记为 running。
+    多个线程 / 进程同时领取时，BEGIN IMMEDIATE 保证同一个任务只会被领取一次。
+
+    按 virtual_start（加权公平排队的开始标签，见 create_job）、再按创建时间选择，跳过：
+      - 依赖的任务（job_dependencies）还没有全部完成的任务；
+      - 所在的树已有 tree_concurrency 个任务（不分优先级）在执行的任务；预览任务可以再多 tree_preview_extra 个，
+        不会被本树正在渲染的视频挡住，一棵树最多同时执行 tree_concurrency + tree_preview_extra 个任务；
+      - 已有 final_concurrency 个 final 任务在执行时的 final 任务（给预览留出工作线程）。
+    """
+    conditions = [
+        "status = 'queued'", "kind = ?",
+        "NOT EXISTS (SELECT 1 FROM job_dependencies d JOIN jobs p ON p.job_id = d.depends_on"
+        " WHERE d.job_id = jobs.job_id AND p.status != 'completed')",
+    ]
+    values = [kind]
+    if tree_concurrency:
+        conditions.append(
+            "(SELECT COUNT(*) FROM jobs r WHERE r.status = 'running' AND r.kind = jobs.kind AND r.tree_id IS jobs.tree_id)"
+            " < ? + (CASE WHEN priority = 'preview' THEN ? ELSE 0 END)"
+        )
+        values.extend([tree_concurrency, tree_preview_extra])
+    if final_concurrency:
+        conditions.append(
+            "(priority != 'final' OR (SELECT COUNT(*) FROM jobs r WHERE r.status = 'running' AND r.kind = jobs.kind"
+            " AND r.priority = 'final') < ?)"
+        )
+        values.append(final_concurrency)
+    try:
+        with transaction() as conn:
+            row = conn.execute(
+                f"SELECT job_id, node_id FROM jobs WHERE {' AND '.join(conditions)} "
+                "ORDER BY virtual_start, created_at LIMIT 1",
+                values
+            ).fetchone()
+            if not row:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, worker_id = ?, heartbeat_at = ? "
+                "WHERE job_id = ?",
+                (datetime.now(), worker_id, datetime.now(), row['job_id'])
+            )
+            set_node_status(row['node_id'], 'running')
+            return get_job(row['job_id'])
+    except sqlite3.Error as e:
+        print(f"领取任务失败: {e}")
+        return None
+
+def get_job_queue_summary(kind: str = 'generate') -> dict:
+    """按优先级统计排队中 / 执行中的任务数和估计的 GPU 秒数"""
+    try:
+        with connection() as conn:
+            rows = conn.execute(
+                "SELECT priority, status, COUNT(*) AS jobs, COALESCE(SUM(cost), 0) AS cost FROM jobs "
+                "WHERE kind = ? AND status IN ('queued', 'running') GROUP BY priority, status",
+                (kind,)
+            ).fetchall()
+            summary = {}
+            for row in rows:
+                summary.setdefault(row['priority'], {})[row['status']] = {"jobs": row['jobs'], "cost": round(row['cost'], 1)}
+            return summary
+    except sqlite3.Error as e:
+        print(f"统计任务队列失败: {e}")
+        return {}
+
+def finish_job(job_id: str, status: str, error: str | None = None, error_code: int | None = None,
+               result: dict | None = None, worker_id: str | None = None):
+    """
+    把任务标记为 completed / failed / cancelled。失败或取消时节点同时标记为 failed / cancelled。
+    给出 worker_id 时只有任务仍由它执行时才更新（租约过期后任务可能已被放回队列、由别的进程重新执行）
+    """
+    owned = " AND status = 'running' AND worker_id = ?" if worker_id else ""
+    try:
+        with transaction() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET status = ?, error = ?, error_code = ?, result = ?, finished_at = ? WHERE job_id = ?{owned}",
+                (status, error, error_code, json.dumps(result) if result is not None else None, datetime.now(), job_id,
+                 *([worker_id] if worker_id else []))
+            )
+            if worker_id and not cursor.rowcount:
+                print(f"任务 {job_id} 已不再由本进程执行（租约过期后被重新排队），忽略本次结果: {status}")
+                return
+            if status in ('failed', 'cancelled'):
+                row = conn.execute("SELECT node_id FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row:
+                    set_node_status(row['node_id'], status)
+                _cancel_dependent_jobs(conn, job_id)
+    except sqlite3.Error as e:
+        print(f"更新任务 {job_id} 状态失败: {e}")
+
+def _cancel_dependent_jobs(conn: sqlite3.Connection, job_id: str) -> int:
+    """
+    上游任务失败或取消后，直接或间接依赖它的排队中任务永远不会满足领取条件，一并取消（error_code 424）。
+    这些节点没有重新生成，原有输出仍然有效，有输出的节点恢复为 completed。返回取消的任务数
+    """
+    rows = conn.execute("""
+        WITH RECURSIVE dependents(job_id) AS (
+            SELECT job_id FROM job_dependencies WHERE depends_on = ?
+            UNION
+            SELECT d.job_id FROM job_dependencies d JOIN dependents ON d.depends_on = dependents.job_id
+        )
+        SELECT j.job_id, j.node_id,
+               EXISTS (SELECT 1 FROM node_assets na WHERE na.node_id = j.node_id AND na.direction = 'output') AS has_output
+        FROM jobs j JOIN dependents ON dependents.job_id = j.job_id
+        WHERE j.status = 'queued'
+    """, (job_id,)).fetchall()
+    for row in rows:
+        conn.execute(
+            "UPDATE jobs SET status = 'cancelled', error = ?, error_code = 424, finished_at = ? WHERE job_id = ?",
+            (f"上游任务 {job_id} 未成功完成", datetime.now(), row['job_id'])
+        )
+        set_node_status(row['node_id'], 'completed' if row['has_output'] else 'cancelled')
+    return len(rows)
+
+def renew_job_leases(worker_id: str) -> int:
+    """续期本进程（worker_id）正在执行的任务，返回续期的任务数"""
+    try:
+        with transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' AND worker_id = ?", (datetime.now(), worker_id)
+            )
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        print(f"续期任务租约失败: {e}")
+        return 0
+
+def requeue_running_jobs(lease_seconds: float) -> int:
+    """
+    把所属进程已经退出（超过 lease_seconds 秒没有续期，见 renew_job_leases）的 running 任务放回队列，返回数量。
+    仍在其它进程（如 debug 模式下 reloader 的另一个进程）中执行、按时续期的任务不受影响。
+    重新执行时会先检查 job_prompts 中记录的 prompt，已完成或仍在 ComfyUI 队列中的直接接管（见 app.run_seed_variants）。
+    之前已经请求取消的任务直接标记为 cancelled。
+    """
+    expired = "status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)"
+    lease_cutoff = datetime.now() - timedelta(seconds=lease_seconds)
+    try:
+        with transaction() as conn:
+            rows = conn.execute(
+                f"SELECT job_id, node_id, cancel_requested FROM jobs WHERE {expired}", (lease_cutoff,)
+            ).fetchall()
+            if not rows:
+                return 0
+            conn.execute(
+                f"UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE {expired} AND cancel_requested = 1",
+                (datetime.now(), lease_cutoff)
+            )
+            conn.execute(
+                f"UPDATE jobs SET status = 'queued', started_at = NULL, worker_id = NULL, heartbeat_at = NULL WHERE {expired}",
+                (lease_cutoff,)
+            )
+            for row in rows:
+                set_node_status(row['node_id'], 'cancelled' if row['cancel_requested'] else 'pending')
+        return sum(1 for row in rows if not row['cancel_requested'])
+    except sqlite3.Error as e:
+        print(f"重新排队任务失败: {e}")
+        return 0
+
+def set_job_deadline(job_id: str, deadline_at: datetime) -> datetime | None:
+    """第一次执行时记录任务的截止时间；重启后重新执行沿用已有的截止时间。返回生效的截止时间"""
+    try:
+        with transaction() as conn:
+            conn.execute("UPDATE jobs SET deadline_at = ? WHERE job_id = ? AND deadline_at IS NULL", (deadline_at, job_id))
+            row = conn.execute("SELECT deadline_at FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if not row or row['deadline_at'] is None:
+                return None
+            value = row['deadline_at']
+            return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    except sqlite3.Error as e:
+        print(f"设置任务 {job_id} 截止时间失败: {e}")
+        return None
+
+def cancel_queued_job(job_id: str) -> bool:
+    """取消还没有开始执行的任务，返回是否取消成功（任务已被领取时返回 False）"""
+    try:
+        with transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished_at = ? WHERE job_id = ? AND status = 'queued'",
+                (datetime.now(), job_id)
+            )
+            if not cursor.rowcount:
+                return False
+            row = conn.execute("SELECT node_id FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            set_node_status(row['node_id'], 'cancelled')
+            _cancel_dependent_jobs(conn, job_id)
+            return True
+    except sqlite3.Error as e:
+        print(f"取消任务 {job_id} 失败: {e}")
+        return False
+
+def request_job_cancel(job_id: str) -> bool:
+    """标记正在执行的任务需要取消，执行中的工作线程会在下一个检查点停止。返回任务是否仍在执行"""
+    try:
+        with transaction() as conn:
+            cursor = conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND status = 'running'", (job_id,))
+            return cursor.rowcount > 0
+    except sqlite3.Error as e:
+        print(f"请求取消任务 {job_id} 失败: {e}")
+        return False
+
+def is_job_cancel_requested(job_id: str) -> bool:
+    try:
+        with connection() as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            return bool(row and row['cancel_requested'])
+    except sqlite3.Error as e:
+        print(f"查询任务 {job_id} 取消状态失败: {e}")
+        return False
+
+def record_job_prompt(job_id: str, node_id: str, variant: int, prompt_id: str, backend: str | None):
+    """记录任务提交到 ComfyUI 的 prompt，同时写到节点上（节点只保留最近一次提交的 prompt）"""
+    now = datetime.now()
+    try:
+        with transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO job_prompts (job_id, variant, prompt_id, backend, submitted_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, variant, prompt_id, backend, now)
+            )
+            conn.execute(
+                "UPDATE nodes SET prompt_id = ?, comfyui_backend = ?, generation_started_at = ? WHERE node_id = ?",
+                (prompt_id, backend, now, node_id)
+            )
+    except sqlite3.Error as e:
+        print(f"记录任务 {job_id} 的 prompt 失败: {e}")
+
+def replace_job_prompt(old_prompt_id: str, new_prompt_id: str, backend: str | None):
+    """prompt 因后端不可用被重新提交到其它后端时，更新任务和节点上的记录"""
+    now = datetime.now()
+    try:
+        with transaction() as conn:
+            conn.execute(
+                "UPDATE job_prompts SET prompt_id = ?, backend = ?, submitted_at = ? WHERE prompt_id = ?",
+                (new_prompt_id, backend, now, old_prompt_id)
+            )
+            conn.execute(
+                "UPDATE nodes SET prompt_id = ?, comfyui_backend = ?, generation_started_at = ? WHERE prompt_id = ?",
+                (new_prompt_id, backend, now, old_prompt_id)
+            )
+    except sqlite3.Error as e:
+        print(f"更新 prompt {old_prompt_id} 的记录失败: {e}")
+
+def get_job_prompts(job_id: str) -> list[dict]:
+    """按变体顺序返回任务提交过的 prompt [{variant, prompt_id, backend, submitted_at}, ...]"""
+    try:
+        with connection() as conn:
+            cursor = conn.execute(
+                "SELECT variant, prompt_id, backend, submitted_at FROM job_prompts WHERE job_id = ? ORDER BY variant",
+                (job_id,)
+            )
+            return [dict(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"获取任务 {job_id} 的 prompt 失败: {e}")
+        return []
+
+
+# --- 生成结果缓存 ---
+
+def get_cached_result(cache_key: str) -> dict | None:
+    """返回缓存记录 {outputs, gpu_seconds, hits, ...}，不存在或查询失败时返回 None"""
+    try:
+        with connection() as conn:
+            row = conn.execute("SELECT * FROM generation_cache WHERE cache_key = ?", (cache_key,)).fetchone()
+            if not row:
+                return None
+            entry = dict(row)
+            entry['outputs'] = json.loads(entry['outputs'])
+            return entry
+    except sqlite3.Error as e:
+        print(f"查询生成结果缓存失败: {e}")
+        return None
+
+def put_cached_result(cache_key: str, module_id: str | None, outputs: dict, gpu_seconds: float | None):
+    """写入一条缓存记录；已存在时（强制重新生成）替换输出，保留累计命中次数"""
+    now = datetime.now()
+    try:
+        with transaction() as conn:
+            conn.execute(
+                "INSERT INTO generation_cache (cache_key, module_id, outputs, gpu_seconds, created_at, last_used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (cache_key) DO UPDATE SET "
+                "outputs = excluded.outputs, gpu_seconds = excluded.gpu_seconds, "
+                "created_at = excluded.created_at, last_used_at = excluded.last_used_at",
+                (cache_key, module_id, json.dumps(outputs), gpu_seconds, now, now)
+            )
+    except sqlite3.Error as e:
+        print(f"写入生成结果缓存失败: {e}")
+
+def touch_cached_result(cache_key: str):
+    """记录一次命中"""
+    try:
+        with transaction() as conn:
+            conn.execute(
+                "UPDATE generation_cache SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?",
+                (datetime.now(), cache_key)
+            )
+    except sqlite3.Error as e:
+        print(f"更新生成结果缓存失败: {e}")
+
+def delete_cached_result(cache_key: str):
+    try:
+        with transaction() as conn:
+            conn.execute("DELETE FROM generation_cache WHERE cache_key = ?", (cache_key,))
+    except sqlite3.Error as e:
+        print(f"删除生成结果缓存失败: {e}")
+
+def evict_cached_results(max_entries: int, max_age_seconds: float) -> int:
+    """删除创建时间超过 max_age_seconds 的记录，再按最近使用时间只保留 max_entries 条。返回删除的数量"""
+    try:
+        with transaction() as conn:
+            removed = conn.execute(
+                "DELETE FROM generation_cache WHERE created_at < ?",
+                (datetime.now() - timedelta(seconds=max_age_seconds),)
+            ).rowcount
+            removed += conn.execute(
+                "DELETE FROM generation_cache WHERE cache_key IN ("
+                "SELECT cache_key FROM generation_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (max_entries,)
+            ).rowcount
+            return removed
+    except sqlite3.Error as e:
+        print(f"淘汰生成结果缓存失败: {e}")
+        return 0
+
+def clear_cached_results() -> int:
+    try:
+        with transaction() as conn:
+            return conn.execute("DELETE FROM generation_cache").rowcount
+    except sqlite3.Error as e:
+        print(f"清空生成结果缓存失败: {e}")
+        return 0
+
+def get_module_gpu_seconds() -> dict[str, float]:
+    """每个模块单个 prompt 的平均 GPU 秒数（来自生成结果缓存的记录），用于估计任务成本"""
+    try:
+        with connection() as conn:
+            rows = conn.execute(
+                "SELECT module_id, AVG(gpu_seconds) AS seconds FROM generation_cache "
+                "WHERE module_id IS NOT NULL AND gpu_seconds > 0 GROUP BY module_id"
+            ).fetchall()
+            return {row['module_id']: row['seconds'] for row in rows}
+    except sqlite3.Error as e:
+        print(f"统计模块平均耗时失败: {e}")
+        return {}
+
+def get_result_cache_summary() -> dict:
+    """缓存记录数、累计命中次数和累计节省的 GPU 秒数"""
+    try:
+        with connection() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS entries, COALESCE(SUM(hits), 0) AS hits, "
+                "COALESCE(SUM(hits * gpu_seconds), 0) AS gpu_seconds_saved FROM generation_cache"
+            ).fetchone()
+            summary = dict(row)
+            summary['gpu_hours_saved'] = round(summary['gpu_seconds_saved'] / 3600, 3)
+            return summary
+    except sqlite3.Error as e:
+        print(f"统计生成结果缓存失败: {e}")
+        return {}
+
+
+def get_lineage(node_id: str, max_depth: int = LINEAGE_MAX_DEPTH) -> list[dict]:
+    """
+    沿"主父节点"链（多父节点时取第一个父节点，与 get_node 的 parent_ids[0] 一致）向上回溯，
+    一次查询返回 [当前节点, 父节点, 祖父节点, ...]，到 Init 节点或没有父节点为止。
+    每个元素是解析过 parameters / assets 的节点字典，并带有 depth（当前节点为 0）。
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                WITH RECURSIVE lineage(node_id, depth) AS (
+                    SELECT ?, 0
+                    UNION ALL
+                    SELECT (SELECT MIN(np.parent_node_id) FROM node_parents np
+                            WHERE np.child_node_id = l.node_id),
+                           l.depth + 1
+                    FROM lineage l JOIN nodes n ON n.node_id = l.node_id
+                    WHERE n.module_id != 'Init' AND l.depth < ?
+                )
+                SELECT n.node_id, n.tree_id, n.module_id, n.parameters, n.title, n.assets,
+                       n.status, n.created_at, l.depth
+                FROM lineage l JOIN nodes n ON n.node_id = l.node_id
+                ORDER BY l.depth
+            """, (node_id, max_depth))
+            return [_decode_node_row(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"获取节点 {node_id} 的祖先链失败: {e}")
+        return []
+
+
+def get_ancestors(node_id: str) -> list[str]:
+    """返回节点的所有祖先节点 ID（沿所有父节点），按距离由近到远排列，不含节点本身"""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                WITH RECURSIVE ancestors(node_id, depth) AS (
+                    SELECT ?, 0
+                    UNION
+                    SELECT np.parent_node_id, a.depth + 1
+                    FROM ancestors a JOIN node_parents np ON np.child_node_id = a.node_id
+                    WHERE a.depth < ?
+                )
+                SELECT node_id FROM ancestors WHERE depth > 0
+                GROUP BY node_id ORDER BY MIN(depth), node_id
+            """, (node_id, LINEAGE_MAX_DEPTH))
+            return [row['node_id'] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"获取节点 {node_id} 的祖先失败: {e}")
+        return []
+
+
+def get_descendants(node_id: str) -> list[str]:
+    """返回节点的所有后代节点 ID，按距离由近到远排列，不含节点本身"""
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                WITH RECURSIVE descendants(node_id, depth) AS (
+                    SELECT ?, 0
+                    UNION
+                    SELECT np.child_node_id, d.depth + 1
+                    FROM descendants d JOIN node_parents np ON np.parent_node_id = d.node_id
+                    WHERE d.depth < ?
+                )
+                SELECT node_id FROM descendants WHERE depth > 0
+                GROUP BY node_id ORDER BY MIN(depth), node_id
+            """, (node_id, LINEAGE_MAX_DEPTH))
+            return [row['node_id'] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"获取节点 {node_id} 的后代失败: {e}")
+        return []
+
+
+def get_descendant_graph(node_id: str) -> list[dict]:
+    """
+    节点的全部后代（不含节点本身），按距离由近到远排列。每个元素是解析过 parameters / assets 的节点字典，
+    带有 depth（到 node_id 的最短距离）和 parent_ids（全部父节点，按连线的创建顺序）。
+    """
+    descendants_sql = """
+        WITH RECURSIVE descendants(node_id, depth) AS (
+            SELECT ?, 0
+            UNION
+            SELECT np.child_node_id, d.depth + 1
+            FROM descendants d JOIN node_parents np ON np.parent_node_id = d.node_id
+            WHERE d.depth < ?
+        )
+    """
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(descendants_sql + """
+                SELECT n.node_id, n.tree_id, n.module_id, n.parameters, n.title, n.assets,
+                       n.status, n.created_at, MIN(d.depth) AS depth
+                FROM descendants d JOIN nodes n ON n.node_id = d.node_id
+                WHERE d.depth > 0
+                GROUP BY n.node_id ORDER BY depth, n.node_id
+            """, (node_id, LINEAGE_MAX_DEPTH))
+            nodes = {row['node_id']: dict(_decode_node_row(row), parent_ids=[]) for row in cursor.fetchall()}
+            cursor.execute(descendants_sql + """
+                SELECT np.child_node_id, np.parent_node_id FROM node_parents np
+                WHERE np.child_node_id IN (SELECT node_id FROM descendants WHERE depth > 0)
+                ORDER BY np.id
+            """, (node_id, LINEAGE_MAX_DEPTH))
+            for row in cursor.fetchall():
+                if row['child_node_id'] in nodes:
+                    nodes[row['child_node_id']]['parent_ids'].append(row['parent_node_id'])
+            return list(nodes.values())
+    except sqlite3.Error as e:
+        print(f"获取节点 {node_id} 的后代失败: {e}")
+        return []
+
+
+def get_node_input_hash(node_id: str) -> str | None:
+    try:
+        with connection() as conn:
+            row = conn.execute("SELECT input_hash FROM nodes WHERE node_id = ?", (node_id,)).fetchone()
+            return row['input_hash'] if row else None
+    except sqlite3.Error as e:
+        print(f"获取节点 {node_id} 的输入哈希失败: {e}")
+        return None
+
+
+def set_node_input_hash(node_id: str, input_hash: str | None):
+    """记录节点最近一次生成时的输入哈希（不改变 tree 的版本，前端不需要这个字段）"""
+    try:
+        with transaction() as conn:
+            conn.execute("UPDATE nodes SET input_hash = ? WHERE node_id = ?", (input_hash, node_id))
+    except sqlite3.Error as e:
+        print(f"记录节点 {node_id} 的输入哈希失败: {e}")
 
 
 def find_global_context(start_node_id):
     """
     从当前节点开始，沿着父节点链一直向上找，
     直到找到包含 'global_context' 字段的节点。
+    (多父节点时取第一个主父节点；整条链通过 get_lineage 一次查询取回)
     """
-    current_id = start_node_id
-
-    while current_id:
-        # 1. 获取当前节点信息
-        node = get_node(current_id) # 假设你有这个函数
-        if not node:
-            break
+    if not start_node_id:
+        return None
 
-        # 2. 检查是否有全局意图
+    for node in get_lineage(start_node_id):
         params = node.get('parameters', {})
         if params and 'global_context' in params:
             return params['global_context']
 
-        # 3. 如果是 ROOT 或 Init 节点还找不到，就返回空
-        if node.get('module_id') == 'Init':
-            return None
-
-        # 4. 继续向上找父节点
-        # (注意：如果有多父节点，通常取第一个主父节点)
-        parent_ids = node.get('parent_ids')
-        if not parent_ids:
-            break
-        current_id = parent_ids[0] # 继续回溯
-
-    return None # 这一枝上没找到
-
-
-
-def delete_node_and_descendants(node_id: str):
-    """递归删除指定节点及其所有后代节点"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # 使用一个集合来跟踪已访问/待删除的节点，避免无限循环（虽然 DAG 不应有循环）
-    nodes_to_delete = {node_id}
-    queue = [node_id]
-
-    # 1. 广度优先搜索 (BFS) 找到所有后代节点
-    visited = {node_id} # 用于BFS
-    while queue:
-        current_node_id = queue.pop(0)
-        # 查找当前节点的所有直接子节点
-        cursor.execute("SELECT child_node_id FROM node_parents WHERE parent_node_id = ?", (current_node_id,))
-        children = cursor.fetchall()
-        for child_row in children:
-            child_id = child_row['child_node_id']
-            if child_id not in visited:
-                nodes_to_delete.add(child_id)
-                queue.append(child_id)
-                visited.add(child_id) # 标记已访问
-
-    # 2. 执行删除
-    try:
-        if nodes_to_delete:
-            # 构建 (?, ?, ...) 占位符字符串
-            placeholders = ', '.join('?' * len(nodes_to_delete))
-            
+    return None # 这一枝上没找到(到 ROOT / Init 节点为止)
+
+
+
+def delete_node_and_descendants(node_id: str) -> list[dict] | None:
+    """
+    递归删除指定节点及其所有后代节点。
+    返回被删除节点引用的资源文件列表 [{filename, subfolder, storage_type}, ...]（供资源回收使用），
+    失败时返回 None。
+    """
+    try:
+        # 查找后代和删除在同一个事务中完成，避免期间插入的新子节点成为孤儿
+        with transaction() as conn:
+            cursor = conn.cursor()
+
+            # 1. 一次递归查询找到整棵子树 (UNION 去重，即使数据中有环也能结束)
+            cursor.execute("""
+                WITH RECURSIVE subtree(node_id) AS (
+                    SELECT ?
+                    UNION
+                    SELECT np.child_node_id
+                    FROM subtree s JOIN node_parents np ON np.parent_node_id = s.node_id
+                )
+                SELECT n.node_id, n.tree_id
+                FROM subtree s JOIN nodes n ON n.node_id = s.node_id
+            """, (node_id,))
+            subtree_rows = cursor.fetchall()
+            if not subtree_rows:
+                print(f"节点 {node_id} 不存在，无需删除。")
+                return []
+
+            node_id_list = [row['node_id'] for row in subtree_rows]
+
+            # 2. 执行删除（用临时表代替 IN (?, ?, ...)，避免大分支超出 SQLite 的参数个数上限）
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS _doomed_nodes (node_id TEXT PRIMARY KEY)")
+            cursor.execute("DELETE FROM _doomed_nodes")
+            cursor.executemany("INSERT INTO _doomed_nodes (node_id) VALUES (?)", ((nid,) for nid in node_id_list))
+
+            # 删除前记下这些节点引用的资源文件
+            cursor.execute("""
+                SELECT DISTINCT filename, subfolder, storage_type FROM node_assets
+                WHERE node_id IN (SELECT node_id FROM _doomed_nodes)
+            """)
+            deleted_assets = [dict(row) for row in cursor.fetchall()]
+
+            # 删除前记下将被级联删除的关系，用于写变更日志
+            cursor.execute("""
+                SELECT child_node_id, parent_node_id FROM node_parents
+                WHERE child_node_id IN (SELECT node_id FROM _doomed_nodes)
+                   OR parent_node_id IN (SELECT node_id FROM _doomed_nodes)
+            """)
+            removed_edges = cursor.fetchall()
+
             # 删除 'nodes' 表中的所有目标节点
             # 'ON DELETE CASCADE' 会自动处理 'node_parents' 表中的相关记录
-            cursor.execute(f"DELETE FROM nodes WHERE node_id IN ({placeholders})", list(nodes_to_delete))
-            
-            conn.commit()
-            print(f"成功删除节点 {node_id} 及其 {len(nodes_to_delete)-1} 个后代节点。")
-        else:
-             print(f"节点 {node_id} 不存在或没有后代可删除。")
+            cursor.execute("DELETE FROM nodes WHERE node_id IN (SELECT node_id FROM _doomed_nodes)")
+            cursor.execute("DELETE FROM _doomed_nodes")
+
+            _record_changes(
+                conn, subtree_rows[0]['tree_id'],
+                [('node', 'delete', nid, None) for nid in node_id_list]
+                + [('edge', 'delete', edge['child_node_id'], edge['parent_node_id']) for edge in removed_edges]
+            )
+
+        print(f"成功删除节点 {node_id} 及其 {len(node_id_list)-1} 个后代节点。")
+        return deleted_assets
 
     except sqlite3.Error as e:
-        conn.rollback()
         print(f"删除节点 {node_id} 及其后代失败: {e}")
-    finally:
-        conn.close()
+        return None
+
+
+def is_asset_referenced(filename: str) -> bool:
+    """检查是否还有节点引用了该文件名。查询失败时按"仍被引用"处理"""
+    try:
+        with connection() as conn:
+            row = conn.execute("SELECT 1 FROM node_assets WHERE filename = ? LIMIT 1", (filename,)).fetchone()
+            return row is not None
+    except sqlite3.Error as e:
+        print(f"检查资源 {filename} 的引用失败: {e}")
+        return True
+
+
+def find_nodes_using_file(filename: str) -> list[str]:
+    """返回引用了该文件名的所有节点 ID"""
+    try:
+        with connection() as conn:
+            cursor = conn.execute(
+                "SELECT DISTINCT node_id FROM node_assets WHERE filename = ? ORDER BY node_id", (filename,)
+            )
+            return [row['node_id'] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"查询引用文件 {filename} 的节点失败: {e}")
+        return []
+
+
+def get_node_asset_filenames(node_id: str, direction: str = 'input', kind: str = 'images') -> list[str]:
+    """按原顺序返回节点某类资源的文件名（如 assets.input.images 中的所有文件名）"""
+    try:
+        with connection() as conn:
+            cursor = conn.execute(
+                """SELECT filename FROM node_assets
+                   WHERE node_id = ? AND direction = ? AND kind = ?
+                   ORDER BY ordinal""",
+                (node_id, direction, kind)
+            )
+            return [row['filename'] for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        print(f"获取节点 {node_id} 的资源文件名失败: {e}")
+        return []
 
 
 # --- (可选) 用于测试的 main 函数 ---
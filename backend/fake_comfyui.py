@@ -0,0 +1,519 @@
+"""
+本地假 ComfyUI 服务器（只依赖标准库），用于在没有 GPU 的机器上测试调度、事件监听和端到端流程。
+
+实现了后端用到的接口：
+    POST /prompt            校验节点类型后入队，返回 {"prompt_id", "number", "node_errors"}
+    GET  /queue             {"queue_running": [...], "queue_pending": [...]}
+    POST /queue             {"delete": [prompt_id, ...]} / {"clear": true}
+    POST /interrupt         中断正在执行的 prompt；body 带 {"prompt_id"} 时只在它正在执行时中断
+    GET  /history/<id>      与 ComfyUI 相同结构的 outputs / status
+    GET  /system_stats      带 vram_total / vram_free 的 devices
+    GET  /object_info       可用的节点类型
+    GET  /view?filename=    返回输出文件
+    GET  /ws?clientId=      WebSocket：status / execution_start / executing / progress / executed /
+                            execution_success / execution_error / execution_interrupted 事件
+
+prompt 按提交顺序逐个「执行」：每个节点发送 executing，采样器节点按步发送 progress，
+SaveImage / SaveVideo / SaveAudio* 等输出节点生成占位文件（指定 --output-dir 时写入磁盘）并发送 executed。
+占位图片是 64x64 的纯色 PNG（可以被 /api/stitch 当作图片片段拼接），视频 / 音频只是占位字节。
+
+执行时间和失败率可以按工作流设置：提交的 prompt 按节点 ID 和 class_type 与 workflows/ 下的模板比对，
+认出是哪个工作流（ImageMerging 拼接进目标工作流时按目标工作流计）。
+
+用法：
+    python fake_comfyui.py --port 8188 --delay 2 --output-dir /tmp/comfy/output
+    python fake_comfyui.py --port 8189 --exclude-nodes "RIFE VFI" --fail-rate 0.1
+    python fake_comfyui.py --latency "TextGenerateImage=2,CameraControl=30" --fail-rates "CameraControl=0.05" --jitter 0.2
+"""
+import argparse
+import base64
+import glob
+import hashlib
+import json
+import os
+import queue
+import random
+import select
+import struct
+import threading
+import time
+import urllib.parse
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WORKFLOW_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workflows')
+SAMPLER_TYPES = {'KSampler', 'KSamplerAdvanced', 'SamplerCustom', 'SamplerCustomAdvanced'}
+PLACEHOLDER_SIZE = 64  # 占位图片的边长（偶数，视频编码器要求宽高为偶数）
+
+
+def _png(width: int, height: int, rgb: tuple[int, int, int]) -> bytes:
+    """生成纯色 RGB PNG"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('!I', len(data)) + kind + data + struct.pack('!I', zlib.crc32(kind + data) & 0xFFFFFFFF)
+    rows = b''.join(b'\x00' + bytes(rgb) * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('!IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+
+# 假的输出图片
+PLACEHOLDER_PNG = _png(PLACEHOLDER_SIZE, PLACEHOLDER_SIZE, (64, 96, 160))
+
+
+def load_templates() -> dict[str, dict[str, str]]:
+    """workflows/ 目录下的模板: 模块ID -> {节点ID: class_type}，用于认出提交的是哪个工作流"""
+    templates = {}
+    for path in glob.glob(os.path.join(WORKFLOW_DIR, '*.json')):
+        with open(path, 'r', encoding='utf-8') as f:
+            templates[os.path.splitext(os.path.basename(path))[0]] = {
+                node_id: node.get('class_type') for node_id, node in json.load(f).items() if isinstance(node, dict)
+            }
+    return templates
+
+
+def identify_workflow(workflow: dict, templates: dict[str, dict[str, str]]) -> str | None:
+    """返回节点 ID / class_type 与 workflow 重合比例最高的模板；重合不到一半时返回 None"""
+    best, best_score = None, 0.5
+    for module_id, nodes in templates.items():
+        if not nodes:
+            continue
+        matched = sum(1 for node_id, class_type in nodes.items()
+                      if (workflow.get(node_id) or {}).get('class_type') == class_type)
+        # 模板节点的命中率为主，提交的工作流中多出的节点（拼接的预处理）只略微降低得分
+        score = matched / len(nodes) - 0.01 * max(len(workflow) - matched, 0) / len(workflow)
+        if score > best_score:
+            best, best_score = module_id, score
+    return best
+
+
+def parse_module_values(text: str) -> dict[str, float]:
+    """解析 "TextGenerateImage=2,CameraControl=30" 形式的按工作流设置"""
+    return {
+        module_id.strip(): float(value)
+        for module_id, value in (item.split('=', 1) for item in (text or '').split(',') if '=' in item)
+    }
+
+
+def default_node_types() -> set[str]:
+    """workflows/ 目录下所有模板用到的节点类型，再加上常用的输出节点"""
+    node_types = {'SaveImage', 'PreviewImage', 'SaveVideo', 'SaveAudio', 'SaveAudioMP3'}
+    for path in glob.glob(os.path.join(WORKFLOW_DIR, '*.json')):
+        with open(path, 'r', encoding='utf-8') as f:
+            for node in json.load(f).values():
+                if isinstance(node, dict) and node.get('class_type'):
+                    node_types.add(node['class_type'])
+    return node_types
+
+
+def _output_kind(class_type: str) -> tuple[str, str] | None:
+    """输出节点 -> (history 中的键, 文件扩展名)；SaveVideo 与真实 ComfyUI 一样放在 images 中"""
+    if class_type in ('SaveImage', 'PreviewImage'):
+        return 'images', 'png'
+    if class_type == 'SaveVideo':
+        return 'images', 'mp4'
+    if class_type.startswith('SaveAudio'):
+        return 'audio', 'mp3'
+    return None
+
+
+def _ws_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < 65536:
+        header += bytes([126]) + struct.pack('!H', length)
+    else:
+        header += bytes([127]) + struct.pack('!Q', length)
+    return header + payload
+
+
+class FakeComfyUI:
+    def __init__(self, host: str = '127.0.0.1', port: int = 8188, delay: float = 1.0, steps: int = 4,
+                 node_types: set[str] | None = None, output_dir: str | None = None,
+                 fail_rate: float = 0.0, vram_gb: float = 24.0, latencies: dict[str, float] | None = None,
+                 fail_rates: dict[str, float] | None = None, jitter: float = 0.0):
+        """
+        :param delay: 每个 prompt 的默认执行时间（秒），latencies 中没有该工作流时使用
+        :param fail_rate: 默认的随机失败概率，fail_rates 中没有该工作流时使用
+        :param latencies / fail_rates: 按工作流（模块ID）设置的执行时间 / 失败概率
+        :param jitter: 执行时间的随机浮动比例，如 0.2 表示 ±20%
+        """
+        self.delay = delay
+        self.steps = steps
+        self.node_types = node_types if node_types is not None else default_node_types()
+        self.output_dir = output_dir
+        self.fail_rate = fail_rate
+        self.latencies = latencies or {}
+        self.fail_rates = fail_rates or {}
+        self.jitter = jitter
+        self.templates = load_templates()
+        self.vram_total = int(vram_gb * 1024 ** 3)
+        self.stats = {"prompts": 0, "completed": 0, "failed": 0, "interrupted": 0, "workflows": {}}
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending: list[dict] = []
+        self._running: dict | None = None
+        self._interrupt = threading.Event()
+        self._history: dict[str, dict] = {}
+        self._clients: dict[str, list[queue.Queue]] = {}  # clientId -> 各 WebSocket 连接的发送队列
+        self._number = 0
+        self._stopped = False
+
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.address = f"{host}:{self.server.server_port}"
+        self._threads = []
+
+    # --- 生命周期 ---
+
+    def start(self) -> 'FakeComfyUI':
+        """在后台线程中运行（测试用）"""
+        for target in (self.server.serve_forever, self._worker):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def serve_forever(self):
+        threading.Thread(target=self._worker, daemon=True).start()
+        print(f"假 ComfyUI 已启动: http://{self.address}  ({len(self.node_types)} 种节点)")
+        self.server.serve_forever()
+
+    def stop(self):
+        """关闭监听端口和所有 WebSocket 连接（模拟后端宕机）"""
+        self._stopped = True
+        self.server.shutdown()
+        self.server.server_close()
+        with self._lock:
+            for queues in self._clients.values():
+                for q in queues:
+                    q.put(None)
+
+    # --- 队列 ---
+
+    def submit(self, data: dict) -> tuple[int, dict]:
+        workflow = data.get('prompt')
+        if not isinstance(workflow, dict) or not workflow:
+            return 400, {"error": {"type": "prompt_no_outputs", "message": "Prompt has no outputs"}, "node_errors": {}}
+        node_errors = {
+            node_id: {"errors": [{"type": "invalid_node", "message": f"Node type not found: {node.get('class_type')}"}],
+                      "class_type": node.get('class_type')}
+            for node_id, node in workflow.items()
+            if not isinstance(node, dict) or node.get('class_type') not in self.node_types
+        }
+        if node_errors:
+            return 400, {"error": {"type": "invalid_prompt", "message": "Cannot execute because a node is missing"},
+                         "node_errors": node_errors}
+
+        prompt_id = data.get('prompt_id') or str(uuid.uuid4())
+        with self._wakeup:
+            self._number += 1
+            # 与 ComfyUI 相同：front 的 prompt 编号取负数，排在所有已排队的 prompt 之前
+            item = {"number": -self._number if data.get('front') else self._number, "prompt_id": prompt_id,
+                    "prompt": workflow, "client_id": data.get('client_id')}
+            if data.get('front'):
+                self._pending.insert(0, item)
+            else:
+                self._pending.append(item)
+            self.stats["prompts"] += 1
+            self._wakeup.notify()
+        self._broadcast_status()
+        return 200, {"prompt_id": prompt_id, "number": item["number"], "node_errors": {}}
+
+    def queue_state(self) -> dict:
+        def entry(item):
+            return [item["number"], item["prompt_id"], item["prompt"], {"client_id": item["client_id"]}, []]
+        with self._lock:
+            return {
+                "queue_running": [entry(self._running)] if self._running else [],
+                "queue_pending": [entry(item) for item in self._pending],
+            }
+
+    def delete(self, prompt_ids: list[str] | None = None, clear: bool = False):
+        with self._lock:
+            if clear:
+                self._pending.clear()
+            else:
+                self._pending = [item for item in self._pending if item["prompt_id"] not in set(prompt_ids or [])]
+
+    def interrupt(self, prompt_id: str | None = None):
+        with self._lock:
+            if prompt_id and (self._running is None or self._running["prompt_id"] != prompt_id):
+                return
+        self._interrupt.set()
+
+    def _worker(self):
+        while True:
+            with self._wakeup:
+                while not self._pending:
+                    self._wakeup.wait()
+                self._running = self._pending.pop(0)
+                self._interrupt.clear()
+            try:
+                self._execute(self._running)
+            finally:
+                with self._lock:
+                    self._running = None
+                self._broadcast_status()
+
+    def _execute(self, item: dict):
+        prompt_id, client_id, workflow = item["prompt_id"], item["client_id"], item["prompt"]
+        messages = []
+
+        def send(event_type, data):
+            data = dict(data, prompt_id=prompt_id)
+            if event_type.startswith('execution_'):
+                messages.append([event_type, dict(data, timestamp=int(time.time() * 1000))])
+            self._send(client_id, event_type, data)
+
+        module_id = identify_workflow(workflow, self.templates) or 'unknown'
+        with self._lock:
+            self.stats["workflows"][module_id] = self.stats["workflows"].get(module_id, 0) + 1
+        delay = self.latencies.get(module_id, self.delay)
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        fail_rate = self.fail_rates.get(module_id, self.fail_rate)
+
+        send('execution_start', {})
+        send('execution_cached', {"nodes": []})
+        fail_at = random.choice(list(workflow)) if random.random() < fail_rate else None
+        samplers = [node_id for node_id, node in workflow.items() if node.get('class_type') in SAMPLER_TYPES]
+        step_delay = delay / (len(samplers) * self.steps) if samplers else 0
+
+        outputs = {}
+        status = "success"
+        for node_id, node in workflow.items():
+            if self._interrupt.is_set():
+                send('execution_interrupted', {"node_id": node_id, "node_type": node['class_type'], "executed": list(outputs)})
+                status = "error"
+                self.stats["interrupted"] += 1
+                break
+            send('executing', {"node": node_id, "display_node": node_id})
+            if node_id == fail_at:
+                send('execution_error', {
+                    "node_id": node_id, "node_type": node['class_type'], "executed": list(outputs),
+                    "exception_message": "fake_comfyui: 模拟的执行错误", "exception_type": "RuntimeError",
+                    "traceback": [], "current_inputs": {}, "current_outputs": {},
+                })
+                status = "error"
+                self.stats["failed"] += 1
+                break
+            if node_id in samplers:
+                for step in range(1, self.steps + 1):
+                    if self._interrupt.wait(step_delay):
+                        break
+                    send('progress', {"value": step, "max": self.steps, "node": node_id})
+            kind = _output_kind(node['class_type'])
+            if kind:
+                key, ext = kind
+                filename = f"fake_{prompt_id[:8]}_{node_id}.{ext}"
+                self._write_output(filename)
+                output = {key: [{"filename": filename, "subfolder": "", "type": "output"}]}
+                outputs[node_id] = output
+                send('executed', {"node": node_id, "display_node": node_id, "output": output})
+        else:
+            if not samplers and delay:
+                self._interrupt.wait(delay)
+            self.stats["completed"] += 1
+
+        send('executing', {"node": None})
+        if status == "success":
+            send('execution_success', {})
+        with self._lock:
+            self._history[prompt_id] = {
+                "prompt": [item["number"], prompt_id, workflow, {"client_id": client_id}, list(outputs)],
+                "outputs": outputs,
+                "status": {"status_str": status, "completed": status == "success", "messages": messages},
+            }
+
+    def _write_output(self, filename: str):
+        if self.output_dir:
+            with open(os.path.join(self.output_dir, filename), 'wb') as f:
+                f.write(PLACEHOLDER_PNG)
+
+    # --- WebSocket 事件 ---
+
+    def _send(self, client_id: str | None, event_type: str, data: dict):
+        message = json.dumps({"type": event_type, "data": data})
+        with self._lock:
+            targets = list(self._clients.get(client_id, [])) if client_id else \
+                [q for queues in self._clients.values() for q in queues]
+        for q in targets:
+            q.put(message)
+
+    def _broadcast_status(self):
+        with self._lock:
+            remaining = len(self._pending) + (1 if self._running else 0)
+            targets = [(client_id, q) for client_id, queues in self._clients.items() for q in queues]
+        for client_id, q in targets:
+            q.put(json.dumps({"type": "status", "data": {
+                "status": {"exec_info": {"queue_remaining": remaining}}, "sid": client_id}}))
+
+    # --- HTTP ---
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _json(self, status: int, body):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _body(self) -> dict:
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    return json.loads(self.rfile.read(length) or b'{}')
+                except json.JSONDecodeError:
+                    return {}
+
+            def handle_one_request(self):
+                # stop() 之后，已建立的 keep-alive 连接也直接断开
+                if fake._stopped:
+                    self.close_connection = True
+                    return
+                super().handle_one_request()
+
+            def do_GET(self):
+                url = urllib.parse.urlparse(self.path)
+                query = urllib.parse.parse_qs(url.query)
+                if url.path == '/ws':
+                    return self._websocket(query.get('clientId', [str(uuid.uuid4())])[0])
+                if url.path == '/queue':
+                    return self._json(200, fake.queue_state())
+                if url.path.startswith('/history'):
+                    prompt_id = url.path[len('/history/'):]
+                    with fake._lock:
+                        if prompt_id:
+                            body = {prompt_id: fake._history[prompt_id]} if prompt_id in fake._history else {}
+                        else:
+                            body = dict(fake._history)
+                    return self._json(200, body)
+                if url.path == '/system_stats':
+                    with fake._lock:
+                        busy = 1 if fake._running else 0
+                    return self._json(200, {
+                        "system": {"os": "fake", "comfyui_version": "fake", "python_version": "fake"},
+                        "devices": [{"name": "fake-gpu", "type": "cuda", "index": 0,
+                                     "vram_total": fake.vram_total,
+                                     "vram_free": fake.vram_total // (2 if busy else 1)}],
+                    })
+                if url.path == '/object_info':
+                    return self._json(200, {
+                        node_type: {"name": node_type, "display_name": node_type, "category": "fake",
+                                    "input": {}, "output": []}
+                        for node_type in sorted(fake.node_types)
+                    })
+                if url.path == '/view':
+                    filename = os.path.basename(query.get('filename', [''])[0])
+                    path = os.path.join(fake.output_dir, filename) if fake.output_dir and filename else None
+                    if path and os.path.exists(path):
+                        with open(path, 'rb') as f:
+                            payload = f.read()
+                    elif filename.startswith('fake_'):
+                        payload = PLACEHOLDER_PNG
+                    else:
+                        return self._json(404, {"error": "not found"})
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                self._json(404, {"error": "not found"})
+
+            def do_POST(self):
+                url = urllib.parse.urlparse(self.path)
+                body = self._body()
+                if url.path == '/prompt':
+                    return self._json(*fake.submit(body))
+                if url.path == '/queue':
+                    fake.delete(body.get('delete'), clear=bool(body.get('clear')))
+                    return self._json(200, {})
+                if url.path == '/interrupt':
+                    fake.interrupt((body or {}).get('prompt_id'))
+                    return self._json(200, {})
+                self._json(404, {"error": "not found"})
+
+            def _websocket(self, client_id: str):
+                key = self.headers.get('Sec-WebSocket-Key')
+                if not key:
+                    return self._json(400, {"error": "expected websocket"})
+                accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+                self.send_response(101)
+                self.send_header('Upgrade', 'websocket')
+                self.send_header('Connection', 'Upgrade')
+                self.send_header('Sec-WebSocket-Accept', accept)
+                self.end_headers()
+                self.wfile.flush()
+                self.close_connection = True
+
+                outbox = queue.Queue()
+                with fake._lock:
+                    fake._clients.setdefault(client_id, []).append(outbox)
+                    remaining = len(fake._pending) + (1 if fake._running else 0)
+                outbox.put(json.dumps({"type": "status", "data": {
+                    "status": {"exec_info": {"queue_remaining": remaining}}, "sid": client_id}}))
+                try:
+                    while True:
+                        # 客户端关闭连接（或发来 close 帧）时退出
+                        readable, _, _ = select.select([self.connection], [], [], 0)
+                        if readable:
+                            data = self.connection.recv(2)
+                            if not data or data[0] & 0x0F == 0x8:
+                                break
+                        try:
+                            message = outbox.get(timeout=0.5)
+                        except queue.Empty:
+                            continue
+                        if message is None:
+                            break
+                        self.connection.sendall(_ws_frame(message.encode('utf-8')))
+                except OSError:
+                    pass
+                finally:
+                    with fake._lock:
+                        fake._clients[client_id].remove(outbox)
+                        if not fake._clients[client_id]:
+                            del fake._clients[client_id]
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地假 ComfyUI 服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--delay", type=float, default=1.0, help="每个 prompt 的模拟执行时间（秒）")
+    parser.add_argument("--steps", type=int, default=4, help="采样器发送的 progress 步数")
+    parser.add_argument("--output-dir", help="写入占位输出文件的目录（通常与 COMFYUI_OUTPUT_PATH 相同）")
+    parser.add_argument("--exclude-nodes", default="", help="逗号分隔，模拟缺少这些自定义节点")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="随机执行失败的概率")
+    parser.add_argument("--latency", default="", help='按工作流设置执行时间（秒），如 "TextGenerateImage=2,CameraControl=30"')
+    parser.add_argument("--fail-rates", default="", help='按工作流设置失败概率，如 "CameraControl=0.05"')
+    parser.add_argument("--jitter", type=float, default=0.0, help="执行时间的随机浮动比例，如 0.2 表示 ±20%%")
+    parser.add_argument("--vram-gb", type=float, default=24.0)
+    args = parser.parse_args()
+
+    node_types = default_node_types() - {name.strip() for name in args.exclude_nodes.split(',') if name.strip()}
+    FakeComfyUI(args.host, args.port, delay=args.delay, steps=args.steps, node_types=node_types,
+                output_dir=args.output_dir, fail_rate=args.fail_rate, vram_gb=args.vram_gb,
+                latencies=parse_module_values(args.latency), fail_rates=parse_module_values(args.fail_rates),
+                jitter=args.jitter).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
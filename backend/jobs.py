@@ -0,0 +1,159 @@
+"""
+生成任务队列：POST /api/nodes 只负责写入 jobs 表并立即返回，真正的 ComfyUI 生成由后台工作线程完成。
+
+任务持久化在 SQLite 中（见 database.create_job / claim_next_job / finish_job）。
+执行中的任务记录领取它的进程（worker_id），由该进程每 LEASE_RENEW_INTERVAL 秒续期一次；
+超过 LEASE_SECONDS 没有续期的任务（进程已退出）会被重新排队，仍在其它进程中执行的任务不会被重复执行。
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+
+import database
+
+
+class JobError(Exception):
+    """任务处理函数抛出此异常时，message 和 code 会原样记录到 jobs 表（code 对应 HTTP 状态码）"""
+
+    def __init__(self, message: str, code: int = 500):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+class JobCancelled(JobError):
+    """任务被取消（见 POST /api/jobs/<id>/cancel），记录为 cancelled 而不是 failed"""
+
+    def __init__(self, message: str = '任务已取消'):
+        super().__init__(message, 409)
+
+
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+LEASE_SECONDS = 60.0          # 执行中的任务超过这么久没有续期，视为所属进程已退出
+LEASE_RENEW_INTERVAL = 15.0
+
+
+class JobQueue:
+    def __init__(self, handler, workers: int = 2, kind: str = 'generate', poll_interval: float = 2.0,
+                 claim_limits: dict | None = None):
+        """
+        :param handler: handler(job) 执行一个任务；正常返回即视为成功（返回的 dict 记录为任务的 result），抛出异常则任务失败
+        :param workers: 工作线程数，即同时执行的生成任务数
+        :param poll_interval: 没有新任务通知时，工作线程轮询数据库的间隔（秒）
+        :param claim_limits: 传给 database.claim_next_job 的并发上限（见 scheduler.GenerationScheduler.claim_limits）
+        """
+        self.handler = handler
+        self.workers = workers
+        self.kind = kind
+        self.poll_interval = poll_interval
+        self.claim_limits = claim_limits or {}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._finished = threading.Condition()  # 有任务结束时通知 wait()
+        self._finish_listeners = []
+
+    def start(self):
+        """启动工作线程和租约续期线程（幂等）。启动时把已退出的进程遗留的 running 任务放回队列"""
+        with self._lock:
+            if self._threads:
+                return
+            self._requeue_orphans()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'{self.kind}-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._keep_leases, name=f'{self.kind}-lease', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, node_id: str, tree_id: int | None, payload: dict, **schedule) -> dict | None:
+        """
+        写入一个新任务并唤醒工作线程，返回任务字典（失败时为 None）。
+        schedule 是任务的调度参数 priority / cost / weight（见 scheduler.GenerationScheduler.plan）
+        """
+        job = database.create_job(node_id, tree_id, payload, kind=self.kind, **schedule)
+        if job:
+            self.wake()
+        return job
+
+    def wake(self):
+        """唤醒工作线程。任务由其它途径写入数据库（如 database.create_sweep）后调用"""
+        self.start()
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def wait_for_any(self, timeout: float):
+        """阻塞直到本进程有任务结束或超时（其它进程中结束的任务不会通知，调用方需自行查询数据库）"""
+        with self._finished:
+            self._finished.wait(timeout)
+
+    def add_finish_listener(self, callback):
+        """注册回调 callback(job)，本进程的任务结束（completed / failed / cancelled）后在工作线程中调用"""
+        self._finish_listeners.append(callback)
+
+    def wait(self, job_id: str, timeout: float | None = None) -> dict | None:
+        """阻塞直到任务结束（completed / failed / cancelled）或超时，返回最新的任务字典"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = database.get_job(job_id)
+            if job is None or job['status'] in FINISHED_STATUSES:
+                return job
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return job
+            # 其它进程中的工作线程完成任务时不会通知本进程，因此仍需定期查询
+            with self._finished:
+                self._finished.wait(self.poll_interval if remaining is None else min(remaining, self.poll_interval))
+
+    def _requeue_orphans(self) -> int:
+        requeued = database.requeue_running_jobs(LEASE_SECONDS)
+        if requeued:
+            print(f"已将 {requeued} 个所属进程已退出的生成任务重新排队。")
+        return requeued
+
+    def _keep_leases(self):
+        """定期续期本进程执行中的任务，并接管租约已过期（进程崩溃 / 被杀掉）的任务"""
+        while True:
+            time.sleep(LEASE_RENEW_INTERVAL)
+            database.renew_job_leases(self.worker_id)
+            if self._requeue_orphans():
+                with self._wakeup:
+                    self._wakeup.notify_all()
+
+    def _run(self):
+        while True:
+            job = database.claim_next_job(self.kind, worker_id=self.worker_id, **self.claim_limits)
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+
+            print(f">>> 开始执行任务 {job['job_id']} (节点 {job['node_id']})")
+            try:
+                result = self.handler(job)
+                database.finish_job(job['job_id'], 'completed', result=result, worker_id=self.worker_id)
+                print(f"<<< 任务 {job['job_id']} 已完成。")
+            except JobCancelled as e:
+                database.finish_job(job['job_id'], 'cancelled', e.message, e.code, worker_id=self.worker_id)
+                print(f"<<< 任务 {job['job_id']} 已取消。")
+            except JobError as e:
+                database.finish_job(job['job_id'], 'failed', e.message, e.code, worker_id=self.worker_id)
+                print(f"<<< 任务 {job['job_id']} 失败: {e.message}")
+            except Exception as e:
+                database.finish_job(job['job_id'], 'failed', str(e), 500, worker_id=self.worker_id)
+                print(f"<<< 任务 {job['job_id']} 失败: {e}")
+            with self._finished:
+                self._finished.notify_all()
+            # 因并发上限而跳过的任务现在可能可以执行了
+            with self._wakeup:
+                self._wakeup.notify_all()
+            finished = database.get_job(job['job_id'])
+            for callback in self._finish_listeners if finished else ():
+                try:
+                    callback(finished)
+                except Exception as e:
+                    print(f"任务结束回调出错: {e}")
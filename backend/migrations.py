@@ -0,0 +1,311 @@
+"""
+版本化的数据库迁移。
+
+已执行的迁移记录在 schema_migrations 表中。数据迁移按主键分批（keyset 分页）处理，
+每批一个事务，并把最后处理的主键写入 checkpoint；中断后再次运行会从 checkpoint 继续，
+内存占用只与批大小有关。有待执行的迁移时，先用 SQLite 在线备份 API 备份数据库。
+
+init_db() 会自动调用 run_migrations()，也可以手动执行：
+    python migrations.py                      # 迁移 database.DATABASE_FILE
+    python migrations.py --db video_tree_camel.db --no-backup
+    python migrations.py --status
+"""
+import argparse
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import database
+
+BATCH_SIZE = 500
+BACKUP_PAGES_PER_STEP = 1024  # 在线备份每一步复制的页数，避免长时间占用源库
+
+
+class Migration:
+    """
+    一个迁移步骤。二选一：
+      apply(cursor)：一次性执行（如 DDL），在单个事务中完成；
+      select_sql + process_batch(conn, rows)：分批数据迁移。select_sql 接收 (checkpoint, limit) 两个参数，
+      必须按 key 列升序返回，rows 的第一列作为 checkpoint。
+    """
+
+    def __init__(self, version: int, name: str, apply=None, select_sql: str | None = None, process_batch=None):
+        self.version = version
+        self.name = name
+        self.apply = apply
+        self.select_sql = select_sql
+        self.process_batch = process_batch
+
+
+# --- 迁移 1：nodes.title ---
+
+def _add_node_title(cursor: sqlite3.Cursor):
+    database._ensure_column(cursor, 'nodes', 'title', 'TEXT')
+    # 只填充缺失的标题，不覆盖用户改过的标题
+    cursor.execute("UPDATE nodes SET title = module_id WHERE title IS NULL")
+
+
+# --- 迁移 2：assets 重构为 {"input": {...}, "output": {...}} ---
+
+def restructure_assets(assets) -> dict | None:
+    """
+    把旧格式的 assets 转换为新格式，已经是新格式（或无法识别）时返回 None。
+    旧格式: {"images": ["url1?type=input", "url2?type=output"]}
+    新格式: {"input": {"images": ["url1?type=input"]}, "output": {"images": ["url2?type=output"]}}
+    """
+    if not isinstance(assets, dict) or not assets:
+        return None
+    if any(key in ('input', 'output') for key in assets):
+        return None  # 已经是新格式，跳过
+
+    new_assets = {"input": {}, "output": {}}
+    for media_type, urls in assets.items():
+        if not isinstance(urls, list):
+            continue
+        for url in urls:
+            if not isinstance(url, str):
+                continue
+            parsed = database._parse_asset_url(url)
+            # 无法识别类型的URL默认归入 output
+            direction = 'input' if parsed and parsed[2].lower() == 'input' else 'output'
+            new_assets[direction].setdefault(media_type, []).append(url)
+    return new_assets
+
+
+def _restructure_assets_batch(conn: sqlite3.Connection, rows: list[sqlite3.Row]) -> int:
+    updates = []
+    for row in rows:
+        try:
+            new_assets = restructure_assets(json.loads(row['assets']))
+        except json.JSONDecodeError:
+            print(f"⚠️  解析节点 {row['node_id']} 的 assets JSON 失败，跳过。")
+            continue
+        if new_assets is not None:
+            updates.append((row['node_id'], new_assets))
+    conn.executemany(
+        "UPDATE nodes SET assets = ? WHERE node_id = ?",
+        [(json.dumps(new_assets), node_id) for node_id, new_assets in updates]
+    )
+    for node_id, new_assets in updates:
+        database._sync_node_assets(conn, node_id, new_assets)
+    return len(updates)
+
+
+# --- 迁移 3：从 assets JSON 回填 node_assets ---
+
+def _backfill_node_assets_batch(conn: sqlite3.Connection, rows: list[sqlite3.Row]) -> int:
+    asset_rows = []
+    for row in rows:
+        if not row['assets'] or row['has_assets']:
+            continue
+        try:
+            asset_rows.extend(database._asset_rows(row['node_id'], json.loads(row['assets'])))
+        except json.JSONDecodeError:
+            print(f"⚠️  解析节点 {row['node_id']} 的 assets JSON 失败，跳过。")
+    conn.executemany(database._INSERT_NODE_ASSET_SQL, asset_rows)
+    return len(asset_rows)
+
+
+# --- 迁移 4：jobs.result ---
+
+def _add_job_result(cursor: sqlite3.Cursor):
+    database._ensure_column(cursor, 'jobs', 'result', 'TEXT')
+
+
+# --- 迁移 5：记录任务在 ComfyUI 上的 prompt，支持取消 / 截止时间 / 重启后接管 ---
+
+def _add_prompt_tracking(cursor: sqlite3.Cursor):
+    database._ensure_column(cursor, 'nodes', 'prompt_id', 'TEXT')
+    database._ensure_column(cursor, 'nodes', 'comfyui_backend', 'TEXT')
+    database._ensure_column(cursor, 'nodes', 'generation_started_at', 'TIMESTAMP')
+    database._ensure_column(cursor, 'jobs', 'deadline_at', 'TIMESTAMP')
+    database._ensure_column(cursor, 'jobs', 'cancel_requested', 'INTEGER NOT NULL DEFAULT 0')
+
+
+
+# --- 迁移 6：任务的优先级、成本估计和加权公平排队标签（见 scheduler.py） ---
+
+def _add_job_scheduling(cursor: sqlite3.Cursor):
+    database._ensure_column(cursor, 'jobs', 'priority', "TEXT NOT NULL DEFAULT 'preview'")
+    database._ensure_column(cursor, 'jobs', 'cost', 'REAL')
+    database._ensure_column(cursor, 'jobs', 'virtual_start', 'REAL NOT NULL DEFAULT 0')
+    database._ensure_column(cursor, 'jobs', 'virtual_finish', 'REAL NOT NULL DEFAULT 0')
+
+
+
+# --- 迁移 7：参数扫描（jobs.sweep_id） ---
+
+def _add_job_sweep(cursor: sqlite3.Cursor):
+    database._ensure_column(cursor, 'jobs', 'sweep_id', 'TEXT')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_sweep ON jobs (sweep_id)")
+
+
+# --- 迁移 8：重新执行下游（jobs.rerun_id、nodes.input_hash；任务依赖表 job_dependencies 由 _create_schema 创建） ---
+
+def _add_job_rerun(cursor: sqlite3.Cursor):
+    database._ensure_column(cursor, 'jobs', 'rerun_id', 'TEXT')
+    database._ensure_column(cursor, 'nodes', 'input_hash', 'TEXT')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_rerun ON jobs (rerun_id)")
+
+
+# --- 迁移 9：执行中任务的租约（jobs.worker_id / heartbeat_at，见 jobs.py） ---
+
+def _add_job_lease(cursor: sqlite3.Cursor):
+    database._ensure_column(cursor, 'jobs', 'worker_id', 'TEXT')
+    database._ensure_column(cursor, 'jobs', 'heartbeat_at', 'TIMESTAMP')
+
+
+MIGRATIONS = [
+    Migration(1, 'nodes_title', apply=_add_node_title),
+    Migration(
+        2, 'assets_input_output',
+        select_sql="""
+            SELECT node_id, assets FROM nodes
+            WHERE node_id > ? AND assets IS NOT NULL AND assets NOT IN ('', '{}')
+            ORDER BY node_id LIMIT ?
+        """,
+        process_batch=_restructure_assets_batch,
+    ),
+    Migration(
+        3, 'node_assets_backfill',
+        select_sql="""
+            SELECT node_id, assets,
+                   EXISTS (SELECT 1 FROM node_assets na WHERE na.node_id = nodes.node_id) AS has_assets
+            FROM nodes
+            WHERE node_id > ?
+            ORDER BY node_id LIMIT ?
+        """,
+        process_batch=_backfill_node_assets_batch,
+    ),
+    Migration(4, 'jobs_result', apply=_add_job_result),
+    Migration(5, 'prompt_tracking', apply=_add_prompt_tracking),
+    Migration(6, 'job_scheduling', apply=_add_job_scheduling),
+    Migration(7, 'job_sweep', apply=_add_job_sweep),
+    Migration(8, 'job_rerun', apply=_add_job_rerun),
+    Migration(9, 'job_lease', apply=_add_job_lease),
+]
+
+
+def _ensure_migrations_table(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',  -- 'running' | 'done'
+            checkpoint TEXT,                         -- 分批迁移最后处理的主键
+            rows_done INTEGER NOT NULL DEFAULT 0,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            applied_at TIMESTAMP
+        )
+    ''')
+
+
+def get_migration_status(db_file: str | None = None) -> list[dict]:
+    """返回每个迁移的执行状态"""
+    with database.transaction(db_file) as conn:
+        _ensure_migrations_table(conn.cursor())
+        recorded = {row['version']: dict(row) for row in conn.execute("SELECT * FROM schema_migrations")}
+    return [
+        recorded.get(m.version, {"version": m.version, "name": m.name, "status": "pending"})
+        for m in MIGRATIONS
+    ]
+
+
+def backup_database(db_file: str | None = None, backup_dir: str | None = None) -> str:
+    """使用 SQLite 在线备份 API 备份数据库（不需要把整个文件读入内存，也不阻塞其它连接），返回备份路径"""
+    src_path = os.path.abspath(db_file or database.DATABASE_FILE)
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    backup_path = os.path.join(
+        backup_dir or os.path.dirname(src_path),
+        f"{stem}_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
+    )
+    src = sqlite3.connect(src_path, timeout=database.SQLITE_BUSY_TIMEOUT)
+    dst = sqlite3.connect(backup_path)
+    try:
+        src.backup(dst, pages=BACKUP_PAGES_PER_STEP)
+    finally:
+        dst.close()
+        src.close()
+    print(f"✅ 数据库已备份到: {backup_path}")
+    return backup_path
+
+
+def run_migrations(db_file: str | None = None, backup: bool = True, batch_size: int = BATCH_SIZE) -> list[int]:
+    """执行所有未完成的迁移（包括上次中断的），返回本次完成的版本号"""
+    pending = [m for m in get_migration_status(db_file) if m['status'] != 'done']
+    if not pending:
+        return []
+
+    if backup:
+        with database.connection(db_file) as conn:
+            has_data = conn.execute("SELECT EXISTS (SELECT 1 FROM nodes)").fetchone()[0]
+        if has_data:
+            backup_database(db_file)
+
+    by_version = {m.version: m for m in MIGRATIONS}
+    applied = []
+    for status in pending:
+        migration = by_version[status['version']]
+        print(f"ℹ️  执行迁移 {migration.version}: {migration.name}")
+        _run_migration(migration, db_file, batch_size)
+        applied.append(migration.version)
+    return applied
+
+
+def _run_migration(migration: Migration, db_file: str | None, batch_size: int):
+    with database.transaction(db_file) as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO schema_migrations (version, name) VALUES (?, ?)",
+            (migration.version, migration.name)
+        )
+        if migration.apply:
+            migration.apply(conn.cursor())
+            _mark_done(conn, migration)
+            return
+
+    while True:
+        # 每批一个事务：数据改动和 checkpoint 一起提交，中断后从 checkpoint 继续
+        with database.transaction(db_file) as conn:
+            state = conn.execute(
+                "SELECT checkpoint, rows_done FROM schema_migrations WHERE version = ?", (migration.version,)
+            ).fetchone()
+            rows = conn.execute(migration.select_sql, (state['checkpoint'] or '', batch_size)).fetchall()
+            if not rows:
+                _mark_done(conn, migration)
+                print(f"✅ 迁移 {migration.version} 完成，共处理 {state['rows_done']} 行。")
+                return
+            changed = migration.process_batch(conn, rows)
+            conn.execute(
+                "UPDATE schema_migrations SET checkpoint = ?, rows_done = rows_done + ? WHERE version = ?",
+                (rows[-1][0], len(rows), migration.version)
+            )
+        if changed:
+            print(f"    - 迁移 {migration.version}: 本批 {len(rows)} 行，修改 {changed} 处")
+
+
+def _mark_done(conn: sqlite3.Connection, migration: Migration):
+    conn.execute(
+        "UPDATE schema_migrations SET status = 'done', applied_at = ? WHERE version = ?",
+        (datetime.now(), migration.version)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="执行数据库迁移")
+    parser.add_argument("--db", default=database.DATABASE_FILE, help="数据库文件")
+    parser.add_argument("--no-backup", action="store_true", help="迁移前不备份")
+    parser.add_argument("--status", action="store_true", help="只显示迁移状态")
+    args = parser.parse_args()
+
+    if args.status:
+        for status in get_migration_status(args.db):
+            print(f"{status['version']:>4}  {status['name']:<24} {status['status']}")
+        return
+
+    # init_db 会建表并执行迁移
+    database.init_db(args.db, backup=not args.no_backup)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+生成进度跟踪：把 ComfyUI WebSocket 的 execution_start / executing / progress 等事件按任务汇总，
+供 GET /api/jobs/<id>/events（Server-Sent Events）实时推送给前端。
+
+每个任务的进度快照包含：
+    status          queued / running / completed / failed
+    stage           submitting（构建并提交工作流）/ queued（在 ComfyUI 队列中）/ executing / done
+    queue_position  前面还有多少个 prompt（0 表示正在执行或下一个执行），来自后端轮询的 /queue，可能滞后几秒
+    node / node_title   正在执行的工作流节点
+    progress        当前节点的步数 {"value", "max"}；eta_seconds 按当前节点的平均步速估算剩余时间
+    variant / variants  batch_size > 1 的视频任务当前等待的是第几个变体
+
+进度只保存在内存中：其它进程里执行的任务只能通过数据库看到 queued / running / 完成状态。
+"""
+import queue
+import threading
+import time
+
+SUBSCRIBER_QUEUE_SIZE = 256  # 订阅者来不及读取时丢弃最旧的事件，只保证最新状态
+
+
+class ProgressTracker:
+    def __init__(self, pool):
+        """:param pool: comfyui_pool.BackendPool，用来注册事件回调和查询队列位置"""
+        self.pool = pool
+        self._jobs: dict[str, dict] = {}                         # job_id -> 进度快照
+        self._prompts: dict[str, tuple[str, dict]] = {}          # prompt_id -> (job_id, 节点ID -> 标题)
+        self._subscribers: dict[str, list[queue.Queue]] = {}
+        self._lock = threading.Lock()
+        for backend in pool.backends:
+            backend.listener.add_event_listener(self._on_event)
+        pool.add_resubmit_listener(self._on_resubmit)
+
+    # --- 任务生命周期（由生成任务调用） ---
+
+    def job_started(self, job: dict):
+        with self._lock:
+            self._jobs[job['job_id']] = {
+                "job_id": job['job_id'], "node_id": job['node_id'], "status": "running", "stage": "submitting",
+                "prompt_id": None, "backend": None, "queue_position": None, "node": None, "node_title": None,
+                "progress": None, "eta_seconds": None, "variant": None, "variants": None, "updated_at": time.time(),
+            }
+        self._publish(job['job_id'])
+
+    def prompt_submitted(self, job_id: str, prompt_id: str, workflow: dict):
+        """任务的一个 prompt 已提交到 ComfyUI"""
+        titles = {
+            node_id: (node_info.get('_meta') or {}).get('title') or node_info.get('class_type')
+            for node_id, node_info in workflow.items() if isinstance(node_info, dict)
+        }
+        with self._lock:
+            self._prompts[prompt_id] = (job_id, titles)
+
+    def waiting_for(self, job_id: str, prompt_id: str, backend: str | None, variant: int, variants: int):
+        """任务开始等待某个 prompt（变体按提交顺序依次等待）"""
+        self._update(job_id, prompt_id=prompt_id, backend=backend, stage="queued", variant=variant,
+                     variants=variants, node=None, node_title=None, progress=None, eta_seconds=None)
+
+    def job_finished(self, job: dict):
+        """任务结束（JobQueue 的结束回调），推送最终状态后清理"""
+        with self._lock:
+            state = self._jobs.pop(job['job_id'], None)
+            for prompt_id in [p for p, (job_id, _) in self._prompts.items() if job_id == job['job_id']]:
+                del self._prompts[prompt_id]
+        final = dict(state or {"job_id": job['job_id'], "node_id": job['node_id']})
+        final.update(status=job['status'], stage="done", error=job.get('error'),
+                     queue_position=None, eta_seconds=0 if job['status'] == 'completed' else None,
+                     updated_at=time.time())
+        self._publish(job['job_id'], final)
+
+    # --- 订阅 ---
+
+    def subscribe(self, job_id: str) -> queue.Queue:
+        subscriber = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(job_id, []).append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, job_id: str, subscriber: queue.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    def snapshot(self, job_id: str) -> dict | None:
+        """任务当前的进度快照（刷新排队位置）；本进程没有在执行该任务时返回 None"""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None:
+                return None
+            state = dict(state)
+        if state['stage'] == 'queued' and state['prompt_id']:
+            state['queue_position'] = self.pool.queue_position(state['prompt_id'])
+        return state
+
+    # --- ComfyUI 事件 ---
+
+    def _on_event(self, prompt_id: str, event_type: str, data: dict):
+        """在 WebSocket 监听线程中执行，只更新内存状态"""
+        with self._lock:
+            owner = self._prompts.get(prompt_id)
+        if owner is None:
+            return
+        job_id, titles = owner
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None or state['prompt_id'] != prompt_id:
+                return  # 不是任务当前正在等待的变体
+            now = time.time()
+            if event_type == 'execution_start':
+                state.update(stage="executing", queue_position=0)
+            elif event_type == 'executing' and data.get('node') is not None:
+                node_id = data.get('display_node') or data['node']
+                state.update(stage="executing", queue_position=0, node=node_id, node_title=titles.get(node_id),
+                             progress=None, eta_seconds=None, node_started_at=now)
+            elif event_type == 'progress':
+                value, maximum = data.get('value') or 0, data.get('max') or 0
+                started = state.get('node_started_at') or now
+                if value <= 1:
+                    state['node_started_at'] = started = now  # 同一个节点的新一轮采样，从第 1 步结束开始计时
+                state['progress'] = {"value": value, "max": maximum}
+                # 计时区间覆盖的是第 2 ~ value 步，共 value - 1 步
+                state['eta_seconds'] = round((now - started) / (value - 1) * (maximum - value), 1) if value > 1 else None
+            else:
+                return
+            state['updated_at'] = now
+        self._publish(job_id)
+
+    def _on_resubmit(self, old_prompt_id: str, new_prompt_id: str, backend: str):
+        """后端不可用、prompt 被重新提交到其它后端"""
+        with self._lock:
+            owner = self._prompts.pop(old_prompt_id, None)
+            if owner is None:
+                return
+            self._prompts[new_prompt_id] = owner
+            state = self._jobs.get(owner[0])
+            if state is not None and state['prompt_id'] == old_prompt_id:
+                state.update(prompt_id=new_prompt_id, backend=backend, stage="queued", node=None,
+                             node_title=None, progress=None, eta_seconds=None, updated_at=time.time())
+        self._publish(owner[0])
+
+    # --- 内部 ---
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None:
+                return
+            state.update(fields, updated_at=time.time())
+        self._publish(job_id)
+
+    def _publish(self, job_id: str, state: dict | None = None):
+        state = state or self.snapshot(job_id)
+        if state is None:
+            return
+        state.pop('node_started_at', None)
+        with self._lock:
+            subscribers = list(self._subscribers.get(job_id, []))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(state)
+            except queue.Full:
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait(state)
+                except (queue.Empty, queue.Full):
+                    pass
@@ -0,0 +1,164 @@
+"""
+生成结果缓存：参数、种子和输入文件都相同的工作流不再重复占用 GPU。
+
+缓存键 = sha256(注入参数后的完整工作流 JSON（键排序）+ 工作流引用的每个 input 文件的内容哈希)。
+命中时直接复用上一次生成的输出文件（assets 中的 /view URL），不再访问 ComfyUI；
+输出文件已被资源回收删除时视为未命中，并删除这条缓存。
+
+缓存记录保存在数据库的 generation_cache 表中，重启后仍然有效：
+超过 max_age_days 天的记录会被淘汰；记录数超过 max_entries 时按最近使用时间淘汰最旧的。
+每条记录保存生成时 ComfyUI 实际执行的秒数，用来统计命中节省的 GPU 时间。
+"""
+import hashlib
+import json
+import os
+import threading
+import urllib.parse
+
+import database
+
+CACHE_KEY_VERSION = 1          # 键的计算方式变化时 +1，旧记录自然失效
+MAX_ENTRIES = 10000
+MAX_AGE_DAYS = 30
+EVICT_EVERY = 50               # 每写入多少条记录执行一次淘汰
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ResultCache:
+    def __init__(self, input_path: str, output_path: str, max_entries: int = MAX_ENTRIES,
+                 max_age_days: float = MAX_AGE_DAYS, enabled: bool = True):
+        self.input_path = os.path.abspath(input_path)
+        self.output_path = os.path.abspath(output_path)
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.enabled = enabled
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "invalidated": 0,
+                      "evicted": 0, "gpu_seconds_saved": 0.0}
+        # 输入文件路径 -> (mtime_ns, size, sha256)，文件没变时不必重新读取整个视频
+        self._file_hashes: dict[str, tuple[int, int, str]] = {}
+        self._puts_since_evict = 0
+        self._lock = threading.Lock()
+
+    def compute_key(self, workflow: dict) -> str:
+        """计算工作流的缓存键；会读取（并记住）工作流引用的 input 文件的内容哈希"""
+        digest = hashlib.sha256(f"v{CACHE_KEY_VERSION}\n".encode())
+        digest.update(json.dumps(workflow, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+        for filename in sorted(self._referenced_input_files(workflow)):
+            digest.update(f"\n{filename}\n{self.hash_file(os.path.join(self.input_path, filename))}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def lookup(self, cache_key: str) -> dict | None:
+        """返回缓存的输出 {"images": [...], ...}；未命中或输出文件已不存在时返回 None"""
+        entry = database.get_cached_result(cache_key)
+        if entry is not None and not all(self.resolve_path(url) for urls in entry['outputs'].values() for url in urls):
+            print(f"生成结果缓存 {cache_key[:12]} 的输出文件已被删除，作废该记录。")
+            database.delete_cached_result(cache_key)
+            with self._lock:
+                self.stats["invalidated"] += 1
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self.stats["gpu_seconds_saved"] += entry['gpu_seconds'] or 0.0
+        database.touch_cached_result(cache_key)
+        return entry['outputs']
+
+    def record_bypass(self):
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def store(self, cache_key: str, module_id: str | None, outputs: dict, gpu_seconds: float | None):
+        """记录一次生成的输出（空输出不缓存），定期淘汰过期 / 超量的记录"""
+        if not outputs:
+            return
+        database.put_cached_result(cache_key, module_id, outputs, gpu_seconds)
+        with self._lock:
+            self.stats["stored"] += 1
+            self._puts_since_evict += 1
+            evict = self._puts_since_evict >= EVICT_EVERY
+            if evict:
+                self._puts_since_evict = 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> int:
+        removed = database.evict_cached_results(self.max_entries, self.max_age_days * 86400)
+        if removed:
+            print(f"生成结果缓存: 淘汰了 {removed} 条记录")
+            with self._lock:
+                self.stats["evicted"] += removed
+        return removed
+
+    def clear(self) -> int:
+        with self._lock:
+            self._file_hashes.clear()
+        return database.clear_cached_results()
+
+    def get_stats(self) -> dict:
+        """本进程的命中统计，以及数据库中全部记录的累计统计（含重启之前）"""
+        with self._lock:
+            stats = dict(self.stats, enabled=self.enabled, hashed_files=len(self._file_hashes))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["gpu_seconds_saved"] = round(stats["gpu_seconds_saved"], 2)
+        stats["total"] = database.get_result_cache_summary()
+        return stats
+
+    def _referenced_input_files(self, workflow: dict) -> set[str]:
+        """工作流中指向 input 目录下已存在文件的字符串输入（LoadImage.image、LoadVideo.file 等）"""
+        filenames = set()
+        for node in workflow.values():
+            if not isinstance(node, dict):
+                continue
+            for value in (node.get('inputs') or {}).values():
+                if isinstance(value, str) and value and '\n' not in value and len(value) < 512:
+                    path = os.path.abspath(os.path.join(self.input_path, value))
+                    if os.path.commonpath([path, self.input_path]) == self.input_path and os.path.isfile(path):
+                        filenames.add(value)
+        return filenames
+
+    def hash_file(self, path: str) -> str:
+        """文件内容的 sha256；按 (mtime, size) 记住结果，文件没变时不重新读取"""
+        stat = os.stat(path)
+        with self._lock:
+            known = self._file_hashes.get(path)
+        if known and known[0] == stat.st_mtime_ns and known[1] == stat.st_size:
+            return known[2]
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        with self._lock:
+            self._file_hashes[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+        return digest.hexdigest()
+
+    def resolve_path(self, url: str) -> str | None:
+        """/view URL 指向的磁盘文件路径，路径规则与 /view 接口一致；文件不存在时返回 None"""
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        filename = query.get('filename', [''])[0]
+        subfolder = query.get('subfolder', [''])[0]
+        if not filename:
+            return None
+        if query.get('type', ['output'])[0] == 'input':
+            candidates = [os.path.join(self.input_path, filename)]
+        else:
+            candidates = [os.path.join(self.output_path, subfolder, filename),
+                          os.path.join(self.output_path, 'video', filename)]
+        return next((candidate for candidate in candidates if os.path.isfile(candidate)), None)
+
+
+def execution_seconds(history_entry: dict) -> float | None:
+    """从 /history 记录的 execution_start / execution_success 时间戳计算 ComfyUI 实际执行的秒数"""
+    timestamps = {
+        kind: data.get('timestamp')
+        for kind, data in (history_entry.get('status') or {}).get('messages', [])
+        if isinstance(data, dict)
+    }
+    start, end = timestamps.get('execution_start'), timestamps.get('execution_success')
+    if start is None or end is None:
+        return None
+    return max(end - start, 0) / 1000
@@ -0,0 +1,140 @@
+"""
+生成任务调度：优先级分类、成本估算和按树的加权公平排队。
+
+ComfyUI 按提交顺序执行 prompt，而 prompt 只由生成任务的工作线程提交，所以调度放在「工作线程领取任务」这一步：
+  - 优先级分类：preview（图片等快速预览）/ final（视频等最终渲染）。请求可以用 "priority" 显式指定，
+    否则按模块判断。final 任务最多同时占用 workers - PREVIEW_RESERVED_WORKERS 个工作线程，
+    始终给预览留出线程；预览的 prompt 以 front=true 提交，插到 ComfyUI 队列中已排队的渲染之前。
+  - 每棵树（项目）同时执行的任务数不超过 tree_concurrency，一个项目排满视频也不会占满所有工作线程；
+    为了不让预览被本树正在渲染的视频挡住，预览任务另有 tree_preview_extra 个额外名额，
+    所以一棵树最多同时占用 tree_concurrency + tree_preview_extra 个工作线程（其中额外的只能是预览）。
+  - 加权公平排队（start-time fair queuing）：每棵树的每个优先级是一条流，任务入队时按
+        start = max(系统虚拟时间, 该树上一个任务的 finish)，finish = start + 成本 / 权重
+    计算标签（见 database.create_job），领取时选 start 最小的任务。成本小、权重高（预览）的任务排得更靠前，
+    同时每棵树按权重分到 GPU 时间，不会被别的树饿死。
+  - 成本估算：该模块历史上的平均 GPU 秒数（来自生成结果缓存的记录，见 result_cache），没有记录时用分类默认值；
+    再按请求参数相对模板默认值的比例缩放（steps、视频时长 time、分辨率 width × height、视频 batch_size）。
+"""
+import threading
+import time
+
+import database
+
+PRIORITY_PREVIEW = 'preview'
+PRIORITY_FINAL = 'final'
+CLASS_WEIGHTS = {PRIORITY_PREVIEW: 4.0, PRIORITY_FINAL: 1.0}
+DEFAULT_COST = {PRIORITY_PREVIEW: 15.0, PRIORITY_FINAL: 180.0}  # 没有历史记录时的估计 GPU 秒数
+FINAL_RENDER_MODULES = {'TextGenerateVideo', 'ImageGenerateVideo', 'FLFrameToVideo', 'CameraControl', 'FrameInterpolation'}
+VIDEO_FPS = 8                   # 与 workflow_bindings.json 中 time -> length 的换算一致: length = time * 8 + 1
+PREVIEW_RESERVED_WORKERS = 1
+TREE_PREVIEW_EXTRA = 1
+LEARNED_COST_TTL = 60.0         # 历史平均耗时的缓存时间（秒）
+
+
+class GenerationScheduler:
+    def __init__(self, registry, workers: int, tree_concurrency: int | None = None,
+                 tree_preview_extra: int = TREE_PREVIEW_EXTRA, preview_reserved: int = PREVIEW_RESERVED_WORKERS):
+        """
+        :param registry: WorkflowRegistry，用来读取模板中的默认 steps / 尺寸 / 时长
+        :param workers: 生成任务的工作线程数
+        :param tree_concurrency: 每棵树同时执行的任务数上限（所有优先级合计），默认 workers - 1（至少 1）
+        :param tree_preview_extra: 树已达上限时仍可额外执行的预览任务数
+        """
+        self.registry = registry
+        self.workers = workers
+        self.tree_concurrency = tree_concurrency or max(1, workers - 1)
+        self.tree_preview_extra = tree_preview_extra
+        self.final_concurrency = max(1, workers - preview_reserved)
+        self._learned: dict[str, float] = {}
+        self._learned_at = 0.0
+        self._lock = threading.Lock()
+
+    def claim_limits(self) -> dict:
+        """传给 database.claim_next_job 的并发上限"""
+        return {"tree_concurrency": self.tree_concurrency, "tree_preview_extra": self.tree_preview_extra,
+                "final_concurrency": self.final_concurrency}
+
+    def classify(self, module_id: str, requested: str | None = None) -> str:
+        if requested in CLASS_WEIGHTS:
+            return requested
+        return PRIORITY_FINAL if module_id in FINAL_RENDER_MODULES else PRIORITY_PREVIEW
+
+    def plan(self, module_id: str, parameters: dict, requested: str | None = None) -> dict:
+        """返回任务的 {"priority", "cost", "weight"}，作为 JobQueue.submit 的调度参数"""
+        priority = self.classify(module_id, requested)
+        return {
+            "priority": priority,
+            "cost": round(self.estimate_cost(module_id, parameters, priority), 2),
+            "weight": CLASS_WEIGHTS[priority],
+        }
+
+    def estimate_cost(self, module_id: str, parameters: dict, priority: str | None = None) -> float:
+        """估计任务占用的 GPU 秒数"""
+        priority = priority or self.classify(module_id)
+        cost = self._learned_cost(module_id) or DEFAULT_COST[priority]
+        defaults = self._template_defaults(module_id)
+
+        steps = _number(parameters.get('steps'))
+        if steps and defaults.get('steps'):
+            cost *= steps / defaults['steps']
+        width, height = _number(parameters.get('width')), _number(parameters.get('height'))
+        if width and height and defaults.get('width') and defaults.get('height'):
+            cost *= (width * height) / (defaults['width'] * defaults['height'])
+        seconds = _number(parameters.get('time'))
+        if seconds and defaults.get('length'):
+            cost *= (seconds * VIDEO_FPS + 1) / defaults['length']
+        batch_size = _number(parameters.get('batch_size'))
+        if priority == PRIORITY_FINAL and batch_size and batch_size > 1:
+            cost *= batch_size  # 视频的 batch_size 是多个独立提交的变体（见 app.run_seed_variants）
+        return max(cost, 0.1)
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "tree_concurrency": self.tree_concurrency,
+            "tree_preview_extra": self.tree_preview_extra,
+            "final_concurrency": self.final_concurrency,
+            "weights": CLASS_WEIGHTS,
+            "learned_cost": dict(self._learned),
+            "queue": database.get_job_queue_summary(),
+        }
+
+    def _learned_cost(self, module_id: str) -> float | None:
+        with self._lock:
+            if time.monotonic() - self._learned_at > LEARNED_COST_TTL:
+                self._learned = database.get_module_gpu_seconds()
+                self._learned_at = time.monotonic()
+            return self._learned.get(module_id)
+
+    def _template_defaults(self, module_id: str) -> dict:
+        """模板中的默认 steps（取最大的采样步数）、Size_Setting 的宽高和帧数"""
+        template = self.registry.get(module_id) if self.registry else None
+        if template is None:
+            return {}
+        defaults = {}
+        for node_info in template.values():
+            inputs = node_info.get('inputs', {}) if isinstance(node_info, dict) else {}
+            steps = _number(inputs.get('steps'))
+            if steps and steps > defaults.get('steps', 0):
+                defaults['steps'] = steps
+        size_node_id = template.title_index.get('Size_Setting')
+        if size_node_id:
+            inputs = template[size_node_id]['inputs']
+            for key in ('width', 'height', 'length'):
+                if _number(inputs.get(key)):
+                    defaults[key] = _number(inputs[key])
+        return defaults
+
+
+def _number(value) -> float | None:
+    """参数可能是数字或数字字符串，连线（列表）和其它值返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return None
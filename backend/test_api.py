@@ -7,9 +7,14 @@ from PIL import Image # 用于创建测试图片
 import urllib.request
 import random
 # --- 配置 ---
-BASE_URL = "http://223.193.6.178:5005" # !!! 修改为您的 Flask 服务器地址 !!!
-TEST_TREE_ID = 1
+# Flask 服务器地址，可用环境变量 API_BASE_URL 覆盖。离线测试：先启动 python fake_comfyui.py --output-dir <COMFYUI_ROOT>/output，
+# 再以 APP_MODE=server COMFYUI_SERVERS=127.0.0.1:8188 COMFYUI_ROOT=<COMFYUI_ROOT> 启动 app.py，然后 API_BASE_URL=http://127.0.0.1:5005 python test_api.py
+BASE_URL = os.getenv('API_BASE_URL', "http://223.193.6.178:5005").rstrip('/')
+TEST_TREE_ID = int(os.getenv('TEST_TREE_ID', '1'))
+# 生成类模块的 POST /api/nodes 默认立即返回 202 和任务信息；带 ?wait=true 时等生成结束后再返回整棵树（201）
+CREATE_NODE_URL = f"{BASE_URL}/api/nodes?wait=true"
 TEST_IMAGE_FILENAME = "cat.jfif"
+TEST_IMAGE2_FILENAME = "test_image2.png"
 TEST_MASK_FILENAME = "test_mask.png"
 
 # --- 辅助函数 ---
@@ -35,6 +40,34 @@ def create_dummy_image(filename, size=(100, 50), color="blue"):
         print(f"警告：创建测试图片 {filename} 失败: {e}")
         print("请确保手动放置一个同名图片文件在此脚本旁边。")
 
+def create_placeholder_node(parent_ids, title):
+    """和前端一样，先创建一个空的 AddWorkflow 节点；生成请求带上它的 node_id，由后端写入结果"""
+    node_id = str(uuid.uuid4())
+    payload = {
+        "tree_id": TEST_TREE_ID,
+        "node_id": node_id,
+        "parent_ids": parent_ids,
+        "module_id": "AddWorkflow",
+        "title": title,
+        "parameters": {}
+    }
+    response = requests.post(f"{BASE_URL}/api/nodes", json=payload)
+    assert response.status_code == 201, f"创建节点失败: {response.text}"
+    return node_id
+
+def upload_inputs(node_id, filenames):
+    """把图片上传为节点的输入（assets.input.images），返回更新后的树"""
+    for filename in filenames:
+        create_dummy_image(filename)
+        with open(filename, 'rb') as f:
+            response = requests.post(f"{BASE_URL}/api/assets/upload?tree_id={TEST_TREE_ID}&target_node_id={node_id}",
+                                     files={'file': (filename, f)})
+        assert response.status_code == 200, f"上传 {filename} 失败: {response.text}"
+    return response.json()
+
+def find_node(tree_data, node_id):
+    return next((n for n in tree_data.get("nodes", []) if n["node_id"] == node_id), None)
+
 # --- 测试用例 ---
 
 def test_get_tree():
@@ -51,52 +84,39 @@ def test_get_tree():
         return None
 
 def test_upload_and_create_node(filename, parent_id=None):
-    """测试上传文件，并验证后端创建了 'Upload' 节点"""
-    print(f"--- 测试: POST /api/assets/upload (上传 {filename} 并创建节点) ---")
+    """测试上传文件：新建一个节点，把文件上传为它的输入"""
+    print(f"--- 测试: POST /api/assets/upload (上传 {filename} 到新节点) ---")
     create_dummy_image(filename)
     if not os.path.exists(filename):
         print(f"测试跳过：缺少测试文件 {filename}")
         return None, None # 返回 NodeID 和 Filename 都为 None
 
-    # 构建带查询参数的 URL
-    api_url = f"{BASE_URL}/api/assets/upload?tree_id={TEST_TREE_ID}"
     if parent_id:
-        api_url += f"&parent_id={parent_id}"
         print(f"  (将作为节点 {parent_id[:8]} 的子节点上传)")
     else:
-        print("  (将作为新的根节点上传，或成为 Init 的子节点)")
+        print("  (将作为新的根节点上传)")
 
     try:
-        with open(filename, 'rb') as f:
-            files = {'file': (filename, f)}
-            response = requests.post(api_url, files=files) # 发送到修改后的上传接口
-        print_response(response)
-        assert response.status_code == 201 # 期望创建成功
-        data = response.json()
+        # 上传接口只更新已有节点（target_node_id），先创建节点
+        node_id = create_placeholder_node([parent_id] if parent_id else [], "Upload")
+        data = upload_inputs(node_id, [filename])
         assert "nodes" in data
 
-        # 在返回的树中查找新创建的 Upload 节点
-        # 假设它是最后一个被添加的，并且 module_id 是 "Upload"
-        new_upload_node = None
-        if data["nodes"]:
-             potential_nodes = [n for n in data["nodes"] if n.get("module_id") == "Upload"]
-             if potential_nodes:
-                  # 按创建时间排序找最新的
-                  new_upload_node = max(potential_nodes, key=lambda n: n.get("created_at", ""))
-
-        assert new_upload_node is not None, "响应中未找到新创建的 'Upload' 节点"
+        # 在返回的树中查找上传的节点
+        new_upload_node = find_node(data, node_id)
+        assert new_upload_node is not None, "响应中未找到上传的节点"
         
-        # 从 assets 中提取保存的文件名 (可能带有 UUID 前缀)
+        # 从 assets.input 中提取保存的文件名 (后端重新生成的 UUID 文件名)
         saved_filename = None
-        if new_upload_node.get('assets', {}).get('images'):
-            asset_url = new_upload_node['assets']['images'][0]
+        if new_upload_node.get('assets', {}).get('input', {}).get('images'):
+            asset_url = new_upload_node['assets']['input']['images'][0]
             parsed_url = urllib.parse.urlparse(asset_url)
             query_params = urllib.parse.parse_qs(parsed_url.query)
             saved_filename = query_params.get('filename', [None])[0]
 
         assert saved_filename is not None, "'Upload' 节点的 assets 中未找到文件名"
 
-        print(f"  成功创建 Upload 节点，ID: {new_upload_node['node_id']}, 文件名: {saved_filename}")
+        print(f"  成功上传到节点，ID: {new_upload_node['node_id']}, 文件名: {saved_filename}")
         return new_upload_node['node_id'], saved_filename # 返回 NodeID 和 后端保存的文件名
 
     except Exception as e:
@@ -146,21 +166,21 @@ def test_create_first_content_node(parent_id, is_image_based=True):
     # 注意：不再需要 image_input 参数了！后端会从 parent_id 获取
 
     try:
+        payload["node_id"] = create_placeholder_node(payload["parent_ids"], module_id)
+        if is_image_based:
+            # 输入图片是节点自己的 assets.input（前端同样先上传到目标节点）
+            upload_inputs(payload["node_id"], [TEST_IMAGE_FILENAME])
         print(f"  正在提交生成请求 (模块: {module_id})...")
-        response = requests.post(f"{BASE_URL}/api/nodes", json=payload)
+        response = requests.post(CREATE_NODE_URL, json=payload)
         print_response(response)
         assert response.status_code == 201
         data = response.json()
         assert "nodes" in data
 
         # 查找新节点
-        new_node = None
-        if data["nodes"]:
-             potential_nodes = [n for n in data["nodes"] if n.get("parameters", {}).get("positive_prompt") == prompt]
-             if potential_nodes: new_node = max(potential_nodes, key=lambda n: n.get("created_at", ""))
-             else: new_node = data["nodes"][-1] # 备选
-
+        new_node = find_node(data, payload["node_id"])
         assert new_node is not None, "响应中未找到符合条件的新节点"
+        assert new_node["status"] == "completed", f"节点状态为 {new_node['status']}"
         print(f"  成功创建第一个内容节点，ID: {new_node['node_id']}")
         return new_node['node_id']
     except Exception as e:
@@ -185,12 +205,14 @@ def test_create_single_parent_node1(parent_id):
         }
     }
     try:
+        payload["node_id"] = create_placeholder_node(payload["parent_ids"], payload["module_id"])
         print("  正在提交生成请求...")
-        response = requests.post(f"{BASE_URL}/api/nodes", json=payload)
+        response = requests.post(CREATE_NODE_URL, json=payload)
         print_response(response)
         assert response.status_code == 201
         data = response.json()
-        new_node = data["nodes"][-1] if data["nodes"] else None
+        new_node = find_node(data, payload["node_id"])
+        assert new_node is None or new_node["status"] == "completed", f"节点状态为 {new_node['status']}"
         if new_node:
             print(f"  成功创建单父节点，ID: {new_node['node_id']}")
             # 可以在这里加更严格的检查，比如 new_node['parent_id'] == parent_id (如果后端get_tree返回了这个简化字段)
@@ -220,12 +242,14 @@ def test_create_single_parent_node2(parent_id):
         }
     }
     try:
+        payload["node_id"] = create_placeholder_node(payload["parent_ids"], payload["module_id"])
         print("  正在提交生成请求...")
-        response = requests.post(f"{BASE_URL}/api/nodes", json=payload)
+        response = requests.post(CREATE_NODE_URL, json=payload)
         print_response(response)
         assert response.status_code == 201
         data = response.json()
-        new_node = data["nodes"][-1] if data["nodes"] else None
+        new_node = find_node(data, payload["node_id"])
+        assert new_node is None or new_node["status"] == "completed", f"节点状态为 {new_node['status']}"
         if new_node:
             print(f"  成功创建单父节点，ID: {new_node['node_id']}")
             # 可以在这里加更严格的检查，比如 new_node['parent_id'] == parent_id (如果后端get_tree返回了这个简化字段)
@@ -251,12 +275,16 @@ def test_create_merge_node(parent1_id, parent2_id):
         "parameters": {}
     }
     try:
+        payload["node_id"] = create_placeholder_node(payload["parent_ids"], payload["module_id"])
+        # 两张待合并的图片是节点自己的 assets.input
+        upload_inputs(payload["node_id"], [TEST_IMAGE_FILENAME, TEST_IMAGE2_FILENAME])
         print("  正在提交生成请求...")
-        response = requests.post(f"{BASE_URL}/api/nodes", json=payload)
+        response = requests.post(CREATE_NODE_URL, json=payload)
         print_response(response)
         assert response.status_code == 201
         data = response.json()
-        new_node = data["nodes"][-1] if data["nodes"] else None
+        new_node = find_node(data, payload["node_id"])
+        assert new_node is None or new_node["status"] == "completed", f"节点状态为 {new_node['status']}"
         if new_node:
              print(f"  成功创建合并节点，ID: {new_node['node_id']}")
              # 验证多父关系需要查询数据库或修改API以返回parent_ids列表
@@ -286,12 +314,14 @@ def test_create_mask_node(parent_id, mask_filename):
         }
     }
     try:
+        payload["node_id"] = create_placeholder_node(payload["parent_ids"], payload["module_id"])
         print("  正在提交生成请求...")
-        response = requests.post(f"{BASE_URL}/api/nodes", json=payload)
+        response = requests.post(CREATE_NODE_URL, json=payload)
         print_response(response)
         assert response.status_code == 201
         data = response.json()
-        new_node = data["nodes"][-1] if data["nodes"] else None
+        new_node = find_node(data, payload["node_id"])
+        assert new_node is None or new_node["status"] == "completed", f"节点状态为 {new_node['status']}"
         if new_node:
              print(f"  成功创建 Mask 节点，ID: {new_node['node_id']}")
              return new_node['node_id']
@@ -416,4 +446,15 @@ if __name__ == "__main__":
     #             else:
     #                 print(f"  !!! 验证失败：节点 {node_to_delete} 仍然存在。")
 
-    print("\n--- 测试完成 ---")
\ No newline at end of file
+    print("\n--- 测试完成 ---")
+    results = {
+        "上传": image_upload_node_id,
+        "单父节点1": child1_id,
+        "单父节点2": child2_id,
+        "合并": merge_node_id,
+        "第一个内容节点": first_content_node_id,
+    }
+    failed = [name for name, result in results.items() if not result]
+    if failed:
+        print(f"!!! 以下测试失败: {', '.join(failed)} !!!")
+        raise SystemExit(1)
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""ComfyUIClient.request 的重试规则：幂等请求遇到 5xx / 超时重试，非幂等请求只在确定没有被处理时重试"""
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import comfyui_client
+from comfyui_client import ComfyUIClient
+
+
+class ScriptedServer:
+    """按路径依次返回预设的响应：状态码，或 ('sleep', 秒数) 表示先等待再返回 200；用完后一直返回 200"""
+
+    def __init__(self):
+        self.script: dict[str, list] = {}
+        self.hits: dict[str, int] = {}
+        server = self
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.rfile.read(length)
+                with lock:
+                    server.hits[self.path] = server.hits.get(self.path, 0) + 1
+                    steps = server.script.get(self.path) or []
+                    step = steps.pop(0) if steps else 200
+                if isinstance(step, tuple):
+                    time.sleep(step[1])
+                    step = 200
+                body = b'{"ok": true}'
+                try:
+                    self.send_response(step)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass  # 客户端已超时断开
+
+            do_GET = do_POST = _reply
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.address = f"127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(comfyui_client, 'RETRY_BACKOFF', 0)
+    server = ScriptedServer()
+    yield server
+    server.stop()
+
+
+def client_for(address):
+    return ComfyUIClient(address, connect_timeout=1, read_timeout=0.3, max_retries=2)
+
+
+def test_idempotent_request_retries_server_errors(server):
+    server.script['/queue'] = [503, 500]
+    client = client_for(server.address)
+    assert client.get_queue() == {"ok": True}
+    assert server.hits['/queue'] == 3
+    assert client.get_metrics()['GET /queue']['retries'] == 2
+
+
+def test_idempotent_request_retries_read_timeout(server):
+    server.script['/queue'] = [('sleep', 1)]
+    assert client_for(server.address).get_queue() == {"ok": True}
+    assert server.hits['/queue'] == 2
+
+
+def test_retries_are_limited(server):
+    server.script['/queue'] = [503, 503, 503, 503]
+    client = client_for(server.address)
+    with pytest.raises(requests.HTTPError):
+        client.get_queue()
+    assert server.hits['/queue'] == 3
+    assert client.get_metrics()['GET /queue']['errors'] == 1
+
+
+def test_post_is_not_retried_after_read_timeout(server):
+    # 请求已经发到 ComfyUI，可能已经入队，重试会重复提交同一个 prompt
+    server.script['/prompt'] = [('sleep', 1)]
+    with pytest.raises(requests.ReadTimeout):
+        client_for(server.address).queue_prompt({}, 'client')
+    assert server.hits['/prompt'] == 1
+
+
+def test_post_is_not_retried_after_internal_error(server):
+    server.script['/prompt'] = [500]
+    with pytest.raises(requests.HTTPError):
+        client_for(server.address).queue_prompt({}, 'client')
+    assert server.hits['/prompt'] == 1
+
+
+def test_post_is_retried_when_proxy_reports_unavailable(server):
+    server.script['/prompt'] = [502, 503]
+    assert client_for(server.address).queue_prompt({}, 'client') == {"ok": True}
+    assert server.hits['/prompt'] == 3
+
+
+def test_post_is_retried_when_connection_is_refused(monkeypatch):
+    monkeypatch.setattr(comfyui_client, 'RETRY_BACKOFF', 0)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    client = client_for(f"127.0.0.1:{port}")
+    with pytest.raises(requests.ConnectionError) as error:
+        client.queue_prompt({}, 'client')
+    assert comfyui_client.request_not_sent(error.value)
+    assert client.get_metrics()['POST /prompt']['retries'] == 2
@@ -0,0 +1,141 @@
+"""BackendPool：后端被判定为不可用后先确认 prompt 是否真的丢失，丢失时才改到其它后端重新提交"""
+import time
+
+import pytest
+
+import comfyui_pool
+import fake_comfyui
+from comfyui_pool import BackendPool
+
+WORKFLOW = {
+    "1": {"class_type": 'KSampler', "inputs": {"seed": 1}, "_meta": {"title": 'KSampler'}},
+    "2": {"class_type": 'SaveImage', "inputs": {"images": ["1", 0]}, "_meta": {"title": 'Save'}},
+}
+
+
+@pytest.fixture
+def fakes():
+    """按需启动 fake_comfyui（随机端口），测试结束后全部关闭"""
+    started = []
+
+    def start(delay=0.1):
+        fake = fake_comfyui.FakeComfyUI(port=0, delay=delay, steps=1).start()
+        started.append(fake)
+        return fake
+
+    yield start
+    for fake in started:
+        if not fake._stopped:
+            fake.stop()
+
+
+def make_pool(*fakes):
+    """不重试的连接池；等第一次轮询结束，之后不会再有轮询把被标记为不可用的后端恢复"""
+    pool = BackendPool([fake.address for fake in fakes], 'test-pool', poll_interval=60, max_retries=0)
+    pool.start()
+    deadline = time.monotonic() + 5
+    while any(backend.last_poll is None for backend in pool.backends) and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return pool
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.02)
+
+
+def test_queued_prompt_is_not_lost(fakes):
+    fake = fakes(delay=2.0)
+    pool = make_pool(fake)
+    backend = pool.backends[0]
+    prompt_id = pool.submit(WORKFLOW)['prompt_id']
+    pool._record_failure(backend, 'slow /queue', immediate=True)
+    assert not backend.healthy
+
+    assert pool._confirm_lost(backend, prompt_id, time.monotonic() + 5) is False
+    # 能查到 prompt 说明后端可达，恢复到轮换中
+    assert backend.healthy
+
+
+def test_finished_prompt_is_not_lost(fakes):
+    fake = fakes()
+    pool = make_pool(fake)
+    backend = pool.backends[0]
+    prompt_id = pool.submit(WORKFLOW)['prompt_id']
+    wait_until(lambda: fake.stats["completed"] == 1)
+    pool._record_failure(backend, 'slow /queue', immediate=True)
+
+    assert pool._confirm_lost(backend, prompt_id, time.monotonic() + 5) is False
+    assert backend.healthy
+
+
+def test_prompt_missing_from_queue_and_history_is_lost(fakes):
+    fake = fakes()
+    pool = make_pool(fake)
+    backend = pool.backends[0]
+    assert pool._confirm_lost(backend, 'unknown-prompt', time.monotonic() + 5) is True
+    # 后端可达，只是没有这个 prompt：不需要在恢复后取消
+    assert pool._superseded == {}
+
+
+def test_unreachable_backend_gives_up_and_remembers_prompt(fakes, monkeypatch):
+    fake = fakes()
+    pool = make_pool(fake)
+    backend = pool.backends[0]
+    fake.stop()
+    monkeypatch.setattr(comfyui_pool, 'RECOVERY_WAIT', 0.3)
+    pool.poll_interval = 0.1
+
+    started = time.monotonic()
+    assert pool._confirm_lost(backend, 'p1', started + 30) is True
+    assert time.monotonic() - started < 5
+    # 后端恢复后要取消的原 prompt
+    assert pool._superseded == {backend.address: ['p1']}
+
+
+def test_confirm_lost_stops_at_deadline(fakes, monkeypatch):
+    fake = fakes()
+    pool = make_pool(fake)
+    fake.stop()
+    pool.poll_interval = 0.1
+
+    started = time.monotonic()
+    assert pool._confirm_lost(pool.backends[0], 'p1', started + 0.3) is True
+    assert time.monotonic() - started < comfyui_pool.RECOVERY_WAIT
+
+
+def test_wait_keeps_prompt_that_is_still_queued(fakes):
+    fake = fakes(delay=0.5)
+    pool = make_pool(fake)
+    backend = pool.backends[0]
+    resubmitted = []
+    pool.add_resubmit_listener(lambda *args: resubmitted.append(args))
+    prompt_id = pool.submit(WORKFLOW)['prompt_id']
+    pool._record_failure(backend, 'slow /queue', immediate=True)
+
+    assert pool.wait(prompt_id, timeout=10) == (prompt_id, backend)
+    assert resubmitted == []
+    assert fake.stats["prompts"] == 1
+
+
+def test_wait_resubmits_lost_prompt_to_another_backend(fakes):
+    first, second = fakes(delay=1.0), fakes()
+    pool = make_pool(first, second)
+    backend_a, backend_b = pool.backends
+    resubmitted = []
+    pool.add_resubmit_listener(lambda *args: resubmitted.append(args))
+
+    pool.submit(WORKFLOW, exclude=[backend_b])
+    prompt_id = pool.submit(WORKFLOW, exclude=[backend_b])['prompt_id']
+    # 模拟后端重启：排队中的 prompt 丢失，随后后端被判定为不可用
+    first.delete([prompt_id])
+    pool._record_failure(backend_a, 'restarted', immediate=True)
+
+    new_prompt_id, backend = pool.wait(prompt_id, timeout=10)
+    assert backend is backend_b and new_prompt_id != prompt_id
+    assert resubmitted == [(prompt_id, new_prompt_id, backend_b.address)]
+    assert second.stats["completed"] == 1
+    # 确认丢失（而不是联系不上）的 prompt 不需要在后端恢复后取消
+    assert pool._superseded == {}
@@ -0,0 +1,255 @@
+"""生成任务队列：领取顺序与并发上限、依赖、任务的结束与租约过期后的重新排队、工作线程执行任务，以及经 fake_comfyui 的端到端执行"""
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from jobs import JobError, JobQueue
+
+
+def add_job(tree_id, priority='final', cost=None, weight=1.0, module_id='TextGenerateImage'):
+    node_id = str(uuid.uuid4())
+    database.add_node(node_id, tree_id, ['root'] if tree_id else None, module_id, {}, node_id, status='pending')
+    return database.create_job(node_id, tree_id, {"node_id": node_id}, priority=priority, cost=cost, weight=weight)
+
+
+def claim(**limits):
+    job = database.claim_next_job(worker_id='w1', **limits)
+    return job and job['job_id']
+
+
+def test_claim_marks_job_and_node_running(tree):
+    tree_id, _ = tree
+    first, second = add_job(tree_id), add_job(tree_id)
+    job = database.claim_next_job()
+    assert job['job_id'] == first['job_id'] and job['status'] == 'running'
+    assert database.get_node(first['node_id'])['status'] == 'running'
+    assert database.claim_next_job()['job_id'] == second['job_id']
+    assert database.claim_next_job() is None
+
+
+def test_failed_job_records_error_and_fails_node(tree):
+    tree_id, _ = tree
+    job = add_job(tree_id)
+    database.claim_next_job()
+    database.finish_job(job['job_id'], 'failed', 'boom', 502)
+    finished = database.get_job(job['job_id'])
+    assert (finished['status'], finished['error'], finished['error_code']) == ('failed', 'boom', 502)
+    assert database.get_node(job['node_id'])['status'] == 'failed'
+
+
+def test_claim_follows_virtual_start_across_trees(tree):
+    tree_a, _ = tree
+    tree_b = database.create_tree('b')
+    database.add_node('root-b', tree_b, None, 'Init', {}, 'Init')
+    a_jobs = [add_job(tree_a, cost=10) for _ in range(3)]
+    b_job = add_job(tree_b, cost=10)
+    # A 的任务按成本依次排开（0、10、20），后提交的 B 从当前虚拟时间 0 开始，不会排在 A 的全部任务之后
+    assert [a_jobs[0]['virtual_start'], a_jobs[1]['virtual_start'], b_job['virtual_start']] == [0, 10, 0]
+    assert [claim() for _ in range(4)] == [a_jobs[0]['job_id'], b_job['job_id'], a_jobs[1]['job_id'], a_jobs[2]['job_id']]
+    assert claim() is None
+
+
+def test_tree_cap_counts_all_priorities(tree):
+    tree_id, _ = tree
+    finals = [add_job(tree_id, priority='final') for _ in range(2)]
+    previews = [add_job(tree_id, priority='preview') for _ in range(2)]
+    limits = {"tree_concurrency": 1, "tree_preview_extra": 1}
+    assert claim(**limits) == finals[0]['job_id']
+    # 树已达上限：渲染任务不能再领取，预览可以使用额外的名额
+    assert claim(**limits) == previews[0]['job_id']
+    assert claim(**limits) is None
+    # 正在执行的预览同样占用树的名额，第二个渲染任务仍要等待
+    database.finish_job(finals[0]['job_id'], 'completed', worker_id='w1')
+    assert claim(**limits) == previews[1]['job_id']
+    assert claim(**limits) is None
+    database.finish_job(previews[0]['job_id'], 'completed', worker_id='w1')
+    database.finish_job(previews[1]['job_id'], 'completed', worker_id='w1')
+    assert claim(**limits) == finals[1]['job_id']
+
+
+def test_final_concurrency_leaves_room_for_previews(tree):
+    tree_id, _ = tree
+    finals = [add_job(tree_id, priority='final') for _ in range(2)]
+    preview = add_job(tree_id, priority='preview')
+    assert claim(final_concurrency=1) == finals[0]['job_id']
+    assert claim(final_concurrency=1) == preview['job_id']
+    assert claim(final_concurrency=1) is None
+
+
+def test_claim_waits_for_dependencies(tree):
+    tree_id, _ = tree
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    database.add_node(first, tree_id, ['root'], 'TextGenerateImage', {}, 'first')
+    database.add_node(second, tree_id, [first], 'ImageCanny', {}, 'second')
+    jobs = database.create_rerun(tree_id, 'rerun', [
+        {"node_id": first, "payload": {}},
+        {"node_id": second, "payload": {}, "depends_on": [first]},
+    ])
+    assert claim() == jobs[0]['job_id']
+    assert claim() is None
+    database.finish_job(jobs[0]['job_id'], 'completed', worker_id='w1')
+    assert claim() == jobs[1]['job_id']
+
+
+def test_failed_dependency_cancels_downstream(tree):
+    tree_id, _ = tree
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    database.add_node(first, tree_id, ['root'], 'TextGenerateImage', {}, 'first')
+    database.add_node(second, tree_id, [first], 'ImageCanny', {}, 'second')
+    jobs = database.create_rerun(tree_id, 'rerun', [
+        {"node_id": first, "payload": {}},
+        {"node_id": second, "payload": {}, "depends_on": [first]},
+    ])
+    claim()
+    database.finish_job(jobs[0]['job_id'], 'failed', error='boom', worker_id='w1')
+    assert database.get_job(jobs[1]['job_id'])['status'] == 'cancelled'
+    assert database.get_node(second)['status'] == 'cancelled'
+
+
+def expire_lease(job_id):
+    with database.transaction() as conn:
+        conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE job_id = ?", (datetime.now() - timedelta(minutes=5), job_id))
+
+
+def test_requeue_running_jobs_only_takes_expired_leases(tree):
+    tree_id, _ = tree
+    live, orphan, cancelled = (add_job(tree_id) for _ in range(3))
+    for _ in range(3):
+        claim()
+    database.request_job_cancel(cancelled['job_id'])
+    expire_lease(orphan['job_id'])
+    expire_lease(cancelled['job_id'])
+
+    assert database.requeue_running_jobs(60) == 1
+    assert database.get_job(live['job_id'])['status'] == 'running'
+    requeued = database.get_job(orphan['job_id'])
+    assert requeued['status'] == 'queued' and requeued['worker_id'] is None
+    assert database.get_node(orphan['node_id'])['status'] == 'pending'
+    # 已请求取消的任务不再执行
+    assert database.get_job(cancelled['job_id'])['status'] == 'cancelled'
+
+
+def test_renewed_lease_is_not_requeued(tree):
+    tree_id, _ = tree
+    job = add_job(tree_id)
+    claim()
+    expire_lease(job['job_id'])
+    assert database.renew_job_leases('w1') == 1
+    assert database.requeue_running_jobs(60) == 0
+
+
+def test_finish_job_ignores_requeued_job(tree):
+    tree_id, _ = tree
+    job = add_job(tree_id)
+    claim()
+    expire_lease(job['job_id'])
+    database.requeue_running_jobs(60)
+    database.claim_next_job(worker_id='w2')
+    # 原来的进程（w1）迟到的结束不能覆盖 w2 的执行
+    database.finish_job(job['job_id'], 'failed', error='late', worker_id='w1')
+    assert database.get_job(job['job_id'])['status'] == 'running'
+    database.finish_job(job['job_id'], 'completed', worker_id='w2')
+    assert database.get_job(job['job_id'])['status'] == 'completed'
+
+
+def test_job_queue_runs_handler_and_records_job_errors(tree):
+    tree_id, _ = tree
+
+    def handler(job):
+        if job['payload']['fail']:
+            raise JobError('bad input', 400)
+
+    # 单独的任务类型，避免工作线程领取其它测试写入的 generate 任务
+    queue = JobQueue(handler, workers=1, kind='unit', poll_interval=0.1)
+    jobs = []
+    for fail in (False, True):
+        node_id = str(uuid.uuid4())
+        database.add_node(node_id, tree_id, ['root'], 'TextGenerateImage', {}, node_id, status='pending')
+        jobs.append(queue.submit(node_id, tree_id, {"fail": fail}))
+    ok, bad = (queue.wait(job['job_id'], timeout=10) for job in jobs)
+    assert ok['status'] == 'completed'
+    assert (bad['status'], bad['error'], bad['error_code']) == ('failed', 'bad input', 400)
+
+
+@pytest.fixture(scope='module')
+def comfyui():
+    """在 conftest 预留的端口上启动 fake_comfyui，app 的 comfyui_pool 即指向它"""
+    import app
+    import fake_comfyui
+    host, port = os.environ['COMFYUI_SERVERS'].split(':')
+    fake = fake_comfyui.FakeComfyUI(host=host, port=int(port), delay=0.2, steps=2,
+                                    output_dir=app.COMFYUI_OUTPUT_PATH).start()
+    app.comfyui_pool.poll_interval = 0.5
+    app.comfyui_pool.start()
+    yield fake
+    fake.stop()
+
+
+def test_generation_job_end_to_end(tree, comfyui):
+    import app
+    tree_id, _ = tree
+    node_id = str(uuid.uuid4())
+    database.add_node(node_id, tree_id, ['root'], 'TextGenerateImage', {}, 'cat', status='pending')
+    # 单独的任务类型，避免工作线程领取其它测试写入的 generate 任务
+    queue = JobQueue(app.run_generation_job, workers=1, kind='e2e', poll_interval=0.2)
+    job = queue.submit(node_id, tree_id, {
+        "tree_id": tree_id, "node_id": node_id, "title": "cat", "parent_ids": ['root'],
+        "module_id": 'TextGenerateImage', "parameters": {"positive_prompt": "cat", "seed": 1},
+    })
+    finished = queue.wait(job['job_id'], timeout=30)
+    assert finished['status'] == 'completed', finished['error']
+    node = database.get_node(node_id)
+    assert node['status'] == 'completed'
+    assert node['assets']['output']['images']
+    assert comfyui.stats['completed'] == 1
+
+
+def record_prompts(monkeypatch):
+    """记录提交给 ComfyUI 的工作流（提交时的快照）"""
+    import app
+    prompts = []
+    queue_prompt = app.queue_comfyui_prompt
+
+    def recording_queue_prompt(workflow, *args, **kwargs):
+        prompts.append(json.loads(json.dumps(workflow)))
+        return queue_prompt(workflow, *args, **kwargs)
+
+    monkeypatch.setattr(app, 'queue_comfyui_prompt', recording_queue_prompt)
+    return prompts
+
+
+@pytest.mark.parametrize("module_id, expected", [
+    # 目标有 LoadImage：ImageMerging 拼接在它前面，两张图片注入到拼接进来的两个输入节点
+    ('ImageGenerateImage_Basic', {'LoadImage': ('merge:1', 'a.png'), 'LoadImage(Move)': ('merge:3', 'b.png')}),
+    # 目标就是 ImageMerging：不拼接，两张图片直接作为它的输入
+    ('ImageMerging', {'LoadImage': ('1', 'a.png'), 'LoadImage(Move)': ('3', 'b.png')}),
+    # 目标没有 LoadImage：跳过合并，照常生成
+    ('TextGenerateImage', {}),
+])
+def test_two_input_images(tree, comfyui, monkeypatch, module_id, expected):
+    import app
+    import fake_comfyui
+    prompts = record_prompts(monkeypatch)
+    tree_id, _ = tree
+    inputs = []
+    for filename, rgb in (('a.png', (255, 0, 0)), ('b.png', (0, 0, 255))):
+        with open(os.path.join(app.COMFYUI_INPUT_PATH, filename), 'wb') as f:
+            f.write(fake_comfyui._png(8, 8, rgb))
+        inputs.append(f"/view?filename={filename}&subfolder=&type=input")
+    node_id = str(uuid.uuid4())
+    database.add_node(node_id, tree_id, ['root'], module_id, {}, 'two', assets={"input": {"images": inputs}}, status='pending')
+    queue = JobQueue(app.run_generation_job, workers=1, kind='e2e', poll_interval=0.2)
+    job = queue.submit(node_id, tree_id, {
+        "tree_id": tree_id, "node_id": node_id, "title": "two", "parent_ids": ['root'],
+        "module_id": module_id, "parameters": {"seed": 1},
+    })
+    finished = queue.wait(job['job_id'], timeout=30)
+    assert finished['status'] == 'completed', finished['error']
+    assert len(prompts) == 1
+    loads = {node['_meta']['title']: (prompt_node_id, node['inputs']['image'])
+             for prompt_node_id, node in prompts[0].items() if node['class_type'] == 'LoadImage'}
+    assert loads == expected
@@ -0,0 +1,146 @@
+"""迁移：在基线版本（没有迁移记录）的数据库上执行迁移 1 ~ 9"""
+import json
+import sqlite3
+
+import pytest
+
+import database
+import migrations
+
+# 基线版本 init_db() 创建的表结构
+BASELINE_SCHEMA = """
+    CREATE TABLE Trees (
+        tree_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE Nodes (
+        node_id TEXT PRIMARY KEY,
+        tree_id INTEGER NOT NULL,
+        module_id TEXT NOT NULL,
+        parameters TEXT,
+        title TEXT NOT NULL,
+        assets TEXT,
+        media TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (tree_id) REFERENCES Trees (tree_id)
+    );
+    CREATE TABLE node_parents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        child_node_id TEXT NOT NULL,
+        parent_node_id TEXT NOT NULL,
+        FOREIGN KEY (child_node_id) REFERENCES nodes (node_id) ON DELETE CASCADE,
+        FOREIGN KEY (parent_node_id) REFERENCES nodes (node_id) ON DELETE CASCADE,
+        UNIQUE(child_node_id, parent_node_id)
+    );
+    CREATE INDEX idx_child_node ON node_parents (child_node_id);
+    CREATE INDEX idx_parent_node ON node_parents (parent_node_id);
+"""
+
+OLD_ASSETS = {"images": ["/view?filename=in.png&subfolder=&type=input", "/view?filename=out.png&subfolder=&type=output"]}
+
+
+@pytest.fixture
+def baseline_db(tmp_path, monkeypatch):
+    """基线表结构的数据库（设为默认数据库）：一棵树、一个根节点和三个旧格式 assets 的子节点"""
+    path = str(tmp_path / 'baseline.db')
+    monkeypatch.setattr(database, 'DATABASE_FILE', path)
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute("INSERT INTO Trees (name) VALUES ('old')")
+    conn.execute("INSERT INTO Nodes (node_id, tree_id, module_id, parameters, title, assets, status) "
+                 "VALUES ('root', 1, 'Init', '{}', 'Init', '{}', 'completed')")
+    for i in range(3):
+        conn.execute("INSERT INTO Nodes (node_id, tree_id, module_id, parameters, title, assets, status) "
+                     "VALUES (?, 1, 'TextGenerateImage', '{}', ?, ?, 'completed')",
+                     (f'n{i}', f'node {i}', json.dumps(OLD_ASSETS)))
+        conn.execute("INSERT INTO node_parents (child_node_id, parent_node_id) VALUES (?, 'root')", (f'n{i}',))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def columns(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    finally:
+        conn.close()
+
+
+def test_init_db_migrates_baseline_database(baseline_db, tmp_path):
+    assert database.init_db(baseline_db, backup=False)
+
+    assert [m['status'] for m in migrations.get_migration_status(baseline_db)] == ['done'] * len(migrations.MIGRATIONS)
+    assert {'title', 'prompt_id', 'comfyui_backend', 'generation_started_at', 'input_hash'} <= columns(baseline_db, 'nodes')
+    assert {'result', 'deadline_at', 'cancel_requested', 'priority', 'cost', 'virtual_start', 'virtual_finish',
+            'sweep_id', 'rerun_id', 'worker_id', 'heartbeat_at'} <= columns(baseline_db, 'jobs')
+
+    # 迁移 2：assets 按 input / output 拆分；迁移 3：回填 node_assets
+    node = database.get_node('n1')
+    assert node['assets'] == {
+        "input": {"images": [OLD_ASSETS["images"][0]]},
+        "output": {"images": [OLD_ASSETS["images"][1]]},
+    }
+    conn = sqlite3.connect(baseline_db)
+    try:
+        rows = conn.execute("SELECT direction, filename FROM node_assets WHERE node_id = 'n1' ORDER BY direction").fetchall()
+    finally:
+        conn.close()
+    assert rows == [('input', 'in.png'), ('output', 'out.png')]
+    assert database.get_node('root')['title'] == 'Init'
+
+
+def test_migrated_database_accepts_new_data(baseline_db):
+    database.init_db(baseline_db, backup=False)
+    tree_id = database.create_tree('new')
+    assert database.add_node('new-node', tree_id, None, 'Init', {}, 'Init') == 'new-node'
+    job = database.create_job('n1', 1, {"node_id": 'n1'})
+    assert job['priority'] == 'preview' and job['status'] == 'queued'
+    # 领取任务用到迁移 6、9 新增的排队和租约字段
+    assert database.claim_next_job(worker_id='w1')['job_id'] == job['job_id']
+
+
+def create_schema(path):
+    """init_db() 中执行迁移之前的部分：补建基线版本没有的表"""
+    with database.transaction(path) as conn:
+        database._create_schema(conn.cursor())
+
+
+def test_migrations_run_once(baseline_db):
+    create_schema(baseline_db)
+    assert migrations.run_migrations(baseline_db, backup=False) == list(range(1, len(migrations.MIGRATIONS) + 1))
+    assert migrations.run_migrations(baseline_db, backup=False) == []
+
+
+def test_batched_migration_resumes_from_checkpoint(baseline_db):
+    # 迁移 2 处理完 n0 后中断：checkpoint 停在 n0，之前的行不会再处理
+    create_schema(baseline_db)
+    migrations.get_migration_status(baseline_db)
+    migrations._run_migration(migrations.MIGRATIONS[0], baseline_db, batch_size=1)
+    conn = sqlite3.connect(baseline_db)
+    conn.execute("INSERT INTO schema_migrations (version, name, checkpoint, rows_done) VALUES (2, 'assets_input_output', 'n0', 1)")
+    conn.commit()
+    conn.close()
+
+    assert migrations.run_migrations(baseline_db, backup=False, batch_size=1)[0] == 2
+    status = {m['version']: m for m in migrations.get_migration_status(baseline_db)}
+    assert status[2]['status'] == 'done'
+    # 从 checkpoint 之后继续：n1、n2 两行
+    assert status[2]['rows_done'] == 3
+    conn = sqlite3.connect(baseline_db)
+    try:
+        assets = dict(conn.execute("SELECT node_id, assets FROM nodes"))
+    finally:
+        conn.close()
+    assert json.loads(assets['n0']) == OLD_ASSETS
+    assert 'input' in json.loads(assets['n1']) and 'input' in json.loads(assets['n2'])
+
+
+def test_backup_is_taken_before_migrating_data(baseline_db, tmp_path):
+    assert database.init_db(baseline_db, backup=True)
+    backups = list(tmp_path.glob('baseline_backup_*.db'))
+    assert len(backups) == 1
+    # 备份是迁移之前的数据库
+    assert 'prompt_id' not in columns(str(backups[0]), 'nodes')
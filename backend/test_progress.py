@@ -0,0 +1,107 @@
+"""ProgressTracker：ComfyUI 事件汇总成任务进度，以及按已计时的步数估算剩余时间"""
+import pytest
+
+import progress
+from comfyui_pool import BackendPool
+from progress import ProgressTracker
+
+WORKFLOW = {
+    "1": {"class_type": 'CheckpointLoaderSimple', "inputs": {}, "_meta": {"title": 'Load Checkpoint'}},
+    "2": {"class_type": 'KSampler', "inputs": {"model": ["1", 0]}},
+}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(progress, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def tracker(clock):
+    """只注册事件回调，不连接后端"""
+    pool = BackendPool(['127.0.0.1:9'], 'test-progress')
+    tracker = ProgressTracker(pool)
+    tracker.job_started({"job_id": 'j1', "node_id": 'n1'})
+    tracker.prompt_submitted('j1', 'p1', WORKFLOW)
+    tracker.waiting_for('j1', 'p1', '127.0.0.1:9', variant=1, variants=1)
+    return tracker
+
+
+def event(tracker, clock, at, event_type, **data):
+    clock.now = at
+    tracker._on_event('p1', event_type, data)
+    return tracker.snapshot('j1')
+
+
+def test_executing_node_uses_title_or_class_type(tracker, clock):
+    state = event(tracker, clock, 100, 'executing', node='1')
+    assert (state['stage'], state['queue_position'], state['node_title']) == ('executing', 0, 'Load Checkpoint')
+    assert event(tracker, clock, 101, 'executing', node='2')['node_title'] == 'KSampler'
+
+
+def test_eta_uses_steps_actually_timed(tracker, clock):
+    event(tracker, clock, 100, 'executing', node='2')
+    # 第 1 步包含模型加载等准备时间，不计入步速
+    state = event(tracker, clock, 110, 'progress', value=1, max=10)
+    assert state['progress'] == {"value": 1, "max": 10} and state['eta_seconds'] is None
+    # 计时从第 1 步结束开始：2 秒完成了 1 步，还剩 8 步
+    assert event(tracker, clock, 112, 'progress', value=2, max=10)['eta_seconds'] == 16.0
+    # 6 秒完成了 3 步（第 2 ~ 4 步），还剩 6 步
+    assert event(tracker, clock, 116, 'progress', value=4, max=10)['eta_seconds'] == 12.0
+    assert event(tracker, clock, 126, 'progress', value=10, max=10)['eta_seconds'] == 0.0
+
+
+def test_new_sampling_round_restarts_timing(tracker, clock):
+    event(tracker, clock, 100, 'executing', node='2')
+    event(tracker, clock, 101, 'progress', value=1, max=4)
+    event(tracker, clock, 111, 'progress', value=4, max=4)
+    # 同一个节点开始新一轮采样（如第二个变体），之前的步速不再适用
+    assert event(tracker, clock, 120, 'progress', value=1, max=4)['eta_seconds'] is None
+    assert event(tracker, clock, 121, 'progress', value=2, max=4)['eta_seconds'] == 2.0
+
+
+def test_new_node_clears_progress(tracker, clock):
+    event(tracker, clock, 100, 'executing', node='2')
+    event(tracker, clock, 101, 'progress', value=1, max=4)
+    event(tracker, clock, 102, 'progress', value=2, max=4)
+    state = event(tracker, clock, 103, 'executing', node='1')
+    assert state['progress'] is None and state['eta_seconds'] is None
+
+
+def test_events_of_other_prompts_are_ignored(tracker, clock):
+    tracker.prompt_submitted('j1', 'p2', WORKFLOW)
+    clock.now = 100
+    tracker._on_event('p2', 'executing', {"node": '2'})
+    tracker._on_event('unknown', 'executing', {"node": '2'})
+    assert tracker.snapshot('j1')['stage'] == 'queued'
+
+
+def test_resubmitted_prompt_keeps_reporting(tracker, clock):
+    event(tracker, clock, 100, 'executing', node='2')
+    tracker._on_resubmit('p1', 'p3', '127.0.0.1:10')
+    state = tracker.snapshot('j1')
+    assert (state['prompt_id'], state['backend'], state['stage'], state['node']) == ('p3', '127.0.0.1:10', 'queued', None)
+    tracker._on_event('p3', 'executing', {"node": '1'})
+    assert tracker.snapshot('j1')['node'] == '1'
+
+
+def test_subscribers_receive_states_without_internal_fields(tracker, clock):
+    subscriber = tracker.subscribe('j1')
+    event(tracker, clock, 100, 'executing', node='2')
+    state = subscriber.get_nowait()
+    assert state['node'] == '2' and 'node_started_at' not in state
+
+    tracker.job_finished({"job_id": 'j1', "node_id": 'n1', "status": 'completed'})
+    final = subscriber.get_nowait()
+    assert (final['status'], final['stage'], final['eta_seconds']) == ('completed', 'done', 0)
+    assert tracker.snapshot('j1') is None
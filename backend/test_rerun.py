@@ -0,0 +1,36 @@
+"""重新执行下游的执行计划（plan_rerun）"""
+import pytest
+
+import app
+
+
+def node(node_id, parents, module_id='ImageCanny', depth=1):
+    return {"node_id": node_id, "parent_ids": parents, "module_id": module_id, "depth": depth}
+
+
+def test_plan_rerun_orders_topologically_and_skips_passthrough():
+    # start -> a -> text(AddText) -> c；a, b -> d（b 也是 start 的子节点）
+    descendants = [
+        node('a', ['start']),
+        node('b', ['start']),
+        node('text', ['a'], 'AddText', depth=2),
+        node('d', ['a', 'b'], 'FLFrameToVideo', depth=2),
+        node('c', ['text'], 'TextGenerateImage', depth=3),
+    ]
+    steps, passthrough = app.plan_rerun(descendants)
+    order = [step['node_id'] for step, _ in steps]
+    assert order == ['a', 'b', 'd', 'c']
+    dependencies = {step['node_id']: depends_on for step, depends_on in steps}
+    assert dependencies == {'a': [], 'b': [], 'd': ['a', 'b'], 'c': ['a']}
+    # 非生成类节点不创建任务，它的下游直接依赖它的上游
+    assert passthrough == ['text']
+
+
+def test_plan_rerun_dependencies_only_include_rerun_nodes():
+    steps, _ = app.plan_rerun([node('a', ['start', 'outside'])])
+    assert steps[0][1] == []
+
+
+def test_plan_rerun_detects_cycles():
+    with pytest.raises(ValueError):
+        app.plan_rerun([node('a', ['start', 'b']), node('b', ['a'])])
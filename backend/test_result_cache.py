@@ -0,0 +1,115 @@
+"""生成结果缓存：缓存键的计算、命中与作废、淘汰"""
+import pytest
+
+import database
+from result_cache import ResultCache, execution_seconds
+
+
+@pytest.fixture
+def cache(db, tmp_path):
+    (tmp_path / 'input').mkdir()
+    (tmp_path / 'output').mkdir()
+    return ResultCache(str(tmp_path / 'input'), str(tmp_path / 'output'))
+
+
+def workflow(image='a.png', seed=1):
+    return {
+        "1": {"class_type": 'LoadImage', "inputs": {"image": image}},
+        "2": {"class_type": 'KSampler', "inputs": {"seed": seed, "model": ["1", 0]}},
+    }
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return path
+
+
+def outputs(*filenames):
+    return {"images": [f"/view?filename={name}&subfolder=&type=output" for name in filenames]}
+
+
+def test_key_is_stable_and_ignores_dict_order(cache, tmp_path):
+    write(tmp_path / 'input' / 'a.png', b'image a')
+    reordered = dict(reversed(list(workflow().items())))
+    assert cache.compute_key(workflow()) == cache.compute_key(reordered)
+
+
+def test_key_changes_with_parameters(cache):
+    assert cache.compute_key(workflow(seed=1)) != cache.compute_key(workflow(seed=2))
+
+
+def test_key_changes_when_input_file_content_changes(cache, tmp_path):
+    path = write(tmp_path / 'input' / 'a.png', b'image a')
+    before = cache.compute_key(workflow())
+    write(path, b'image b, longer')
+    assert cache.compute_key(workflow()) != before
+
+
+def test_key_survives_rewriting_file_with_same_content(cache, tmp_path):
+    path = write(tmp_path / 'input' / 'a.png', b'same')
+    key = cache.compute_key(workflow())
+    write(path, b'same')
+    assert cache.compute_key(workflow()) == key
+
+
+def test_files_outside_input_directory_are_not_hashed(cache, tmp_path):
+    write(tmp_path / 'secret.txt', b'secret')
+    cache.compute_key(workflow('../secret.txt'))
+    assert cache.get_stats()["hashed_files"] == 0
+
+
+def test_store_and_lookup(cache, tmp_path):
+    write(tmp_path / 'output' / 'out.png', b'result')
+    key = cache.compute_key(workflow())
+    assert cache.lookup(key) is None
+    cache.store(key, 'TextGenerateImage', outputs('out.png'), gpu_seconds=12.5)
+
+    assert cache.lookup(key) == outputs('out.png')
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["stored"]) == (1, 1, 1)
+    assert stats["gpu_seconds_saved"] == 12.5
+
+
+def test_empty_outputs_are_not_stored(cache):
+    cache.store('key', None, {}, None)
+    assert database.get_cached_result('key') is None
+
+
+def test_deleted_output_invalidates_entry(cache, tmp_path):
+    path = write(tmp_path / 'output' / 'out.png', b'result')
+    cache.store('key', None, outputs('out.png'), None)
+    path.unlink()
+
+    assert cache.lookup('key') is None
+    assert database.get_cached_result('key') is None
+    assert cache.get_stats()["invalidated"] == 1
+
+
+def test_evict_keeps_most_recently_used(cache, tmp_path):
+    for name in ('a', 'b', 'c'):
+        write(tmp_path / 'output' / f'{name}.png', b'result')
+        cache.store(name, None, outputs(f'{name}.png'), None)
+    assert cache.lookup('a') is not None  # a 最近被使用过
+
+    cache.max_entries = 2
+    assert cache.evict() == 1
+    assert database.get_cached_result('b') is None
+    assert database.get_cached_result('a') is not None and database.get_cached_result('c') is not None
+
+
+def test_evict_removes_expired_entries(cache, tmp_path):
+    write(tmp_path / 'output' / 'out.png', b'result')
+    cache.store('key', None, outputs('out.png'), None)
+    cache.max_age_days = 0
+    assert cache.evict() == 1
+    assert cache.lookup('key') is None
+
+
+def test_execution_seconds_from_history():
+    entry = {"status": {"messages": [
+        ["execution_start", {"timestamp": 1000}],
+        ["execution_cached", {"nodes": []}],
+        ["execution_success", {"timestamp": 4500}],
+    ]}}
+    assert execution_seconds(entry) == 3.5
+    assert execution_seconds({"status": {"messages": []}}) is None
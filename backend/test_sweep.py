@@ -0,0 +1,44 @@
+"""参数扫描的变体展开（expand_sweep）"""
+import pytest
+
+import app
+
+
+def test_expand_sweep_grid_is_cartesian_product():
+    variants = app.expand_sweep({"cfg": 1, "prompt": "cat"}, {"cfg": [5, 7], "steps": [10, 20, 30]}, None, None)
+    assert len(variants) == 6
+    assert variants[0] == ({"cfg": 5, "prompt": "cat", "steps": 10}, {"cfg": 5, "steps": 10})
+    assert {(p['cfg'], p['steps']) for p, _ in variants} == {(c, s) for c in (5, 7) for s in (10, 20, 30)}
+
+
+def test_expand_sweep_seed_count_gives_distinct_new_seeds():
+    variants = app.expand_sweep({"seed": 42}, {"cfg": [5, 7]}, 3, 'seed')
+    assert len(variants) == 6
+    seeds = {parameters['seed'] for parameters, _ in variants}
+    assert len(seeds) == 3 and 42 not in seeds
+    assert all(varied.keys() == {"cfg", "seed"} for _, varied in variants)
+
+
+def test_expand_sweep_seed_list():
+    variants = app.expand_sweep({}, {}, [1, 2], 'audio_seed')
+    assert [varied for _, varied in variants] == [{"audio_seed": 1}, {"audio_seed": 2}]
+
+
+@pytest.mark.parametrize("grid, seeds, seed_param", [
+    ({}, None, None),                       # 没有任何维度
+    ({"cfg": []}, None, None),              # 空的取值列表
+    ({"cfg": 5}, None, None),               # 取值不是列表
+    ([5, 7], None, None),                   # grid 不是对象
+    ({}, 3, None),                          # 工作流没有种子参数
+    ({}, True, 'seed'),                     # seeds 类型不对
+    ({}, -1, 'seed'),
+])
+def test_expand_sweep_rejects_invalid_requests(grid, seeds, seed_param):
+    with pytest.raises(ValueError):
+        app.expand_sweep({}, grid, seeds, seed_param)
+
+
+def test_expand_sweep_enforces_variant_limit(monkeypatch):
+    monkeypatch.setattr(app, 'SWEEP_MAX_VARIANTS', 4)
+    with pytest.raises(ValueError):
+        app.expand_sweep({}, {"cfg": [1, 2, 3], "steps": [1, 2]}, None, None)
@@ -0,0 +1,37 @@
+"""get_tree_changes：版本号之后的增量变化，以及日志不完整时回退到全量数据"""
+import database
+
+
+def current_rev(tree_id):
+    return database.get_tree_as_json(tree_id)['rev']
+
+
+def test_tree_changes_are_incremental_within_the_log(tree):
+    tree_id, _ = tree
+    since = current_rev(tree_id)
+    database.add_node('child', tree_id, ['root'], 'TextGenerateImage', {}, 'child')
+
+    changes = database.get_tree_changes(tree_id, since)
+    assert changes['full'] is False
+    assert [node['node_id'] for node in changes['nodes']['upserted']] == ['child']
+    assert changes['edges']['added'] == [{"child_node_id": 'child', "parent_node_id": 'root'}]
+    assert database.get_tree_changes(tree_id, changes['rev'])['nodes']['upserted'] == []
+
+
+def test_tree_changes_fall_back_to_full_data(tree, monkeypatch):
+    tree_id, _ = tree
+    monkeypatch.setattr(database, 'CHANGE_LOG_RETENTION', 2)
+    # 日志每 100 个版本清理一次
+    rev = current_rev(tree_id)
+    while rev < 100:
+        database.add_node(f'n{rev}', tree_id, ['root'], 'TextGenerateImage', {}, f'n{rev}')
+        rev = current_rev(tree_id)
+
+    # since 早于保留的日志
+    stale = database.get_tree_changes(tree_id, 50)
+    assert stale['full'] is True and stale['since'] == 50
+    assert len(stale['nodes']) == rev
+    assert database.get_tree_changes(tree_id, rev - 1)['full'] is False
+    # since 大于当前版本（如数据库被替换过）
+    assert database.get_tree_changes(tree_id, rev + 10)['full'] is True
+    assert database.get_tree_changes(tree_id + 1, 0) is None
@@ -0,0 +1,89 @@
+"""项目树的 NDJSON 导出 / 导入往返，以及导入导出接口对项目数据库的初始化"""
+import database
+import tree_transfer
+
+
+def build_tree(tree_id):
+    """root -> a, root -> b, (a, b) -> merged"""
+    database.add_node('a', tree_id, ['root'], 'TextGenerateImage', {"seed": 1}, 'a',
+                      assets={"output": {"images": ["/view?filename=a.png&subfolder=&type=output"]}})
+    database.add_node('b', tree_id, ['root'], 'AddWorkflow', {}, 'b',
+                      assets={"input": {"images": ["/view?filename=b.png&subfolder=&type=input"]}})
+    database.add_node('merged', tree_id, ['a', 'b'], 'FLFrameToVideo', {"seed": 2}, 'merged')
+
+
+def shape(tree_data):
+    """按标题描述树的结构，与 node_id 无关"""
+    titles = {node['node_id']: node['title'] for node in tree_data['nodes']}
+    return {
+        node['title']: (node['module_id'], node['parameters'], node['assets'],
+                        sorted(titles[parent_id] for parent_id in node['parent_id'] or []))
+        for node in tree_data['nodes']
+    }
+
+
+def test_round_trip_into_same_database_remaps_ids(tree):
+    tree_id, _ = tree
+    build_tree(tree_id)
+    lines = list(tree_transfer.export_tree(tree_id))
+
+    stats = tree_transfer.import_tree(lines, name='copy')
+    assert stats['tree_id'] != tree_id
+    assert (stats['nodes'], stats['edges'], stats['remapped']) == (4, 4, 4)
+
+    original, copy = database.get_tree_as_json(tree_id), database.get_tree_as_json(stats['tree_id'])
+    assert copy['name'] == 'copy'
+    assert shape(copy) == shape(original)
+    assert not {node['node_id'] for node in copy['nodes']} & {node['node_id'] for node in original['nodes']}
+    # 资源索引随新 ID 一起写入
+    uploaded = next(node for node in copy['nodes'] if node['title'] == 'b')
+    assert database.get_node_asset_filenames(uploaded['node_id'], 'input', 'images') == ['b.png']
+
+
+def test_round_trip_into_other_database_keeps_ids(tree, tmp_path):
+    tree_id, _ = tree
+    build_tree(tree_id)
+    lines = list(tree_transfer.export_tree(tree_id))
+    other = str(tmp_path / 'other.db')
+    database.init_db(other, backup=False)
+
+    stats = tree_transfer.import_tree(lines, other)
+    assert stats['remapped'] == 0
+    original = database.get_tree_as_json(tree_id)
+    database.DATABASE_FILE, previous = other, database.DATABASE_FILE
+    try:
+        imported = database.get_tree_as_json(stats['tree_id'])
+    finally:
+        database.DATABASE_FILE = previous
+    assert {node['node_id'] for node in imported['nodes']} == {node['node_id'] for node in original['nodes']}
+    assert shape(imported) == shape(original)
+
+
+def test_import_into_existing_tree_resets_change_log(tree):
+    tree_id, _ = tree
+    build_tree(tree_id)
+    rev = database.get_tree_revision(tree_id)['rev']
+    assert database.get_tree_changes(tree_id, rev - 1)['full'] is False
+    # 导入不写变更日志，之前的版本都只能拿到全量数据
+    tree_transfer.import_tree(list(tree_transfer.export_tree(tree_id)), into_tree_id=tree_id)
+    assert database.get_tree_changes(tree_id, rev)['full'] is True
+
+
+def test_project_database_is_initialized_once(tree, tmp_path, monkeypatch):
+    import app
+    tree_id, _ = tree
+    build_tree(tree_id)
+    body = ''.join(tree_transfer.export_tree(tree_id))
+    (tmp_path / 'project.db').touch()
+    monkeypatch.setattr(app, 'BASE_DIR', str(tmp_path))
+    calls = []
+    init_db = database.init_db
+    monkeypatch.setattr(database, 'init_db', lambda *args, **kwargs: calls.append(args) or init_db(*args, **kwargs))
+
+    client = app.app.test_client()
+    for _ in range(2):
+        response = client.post('/api/trees/import?db=project.db', data=body, content_type='application/x-ndjson')
+        assert response.status_code == 201, response.get_json()
+    assert client.get(f"/api/trees/{response.get_json()['tree_id']}/export?db=project.db").status_code == 200
+    # 空文件在第一次打开时建表、迁移，之后的请求不再执行 init_db
+    assert calls == [(str(tmp_path / 'project.db'),)]
@@ -0,0 +1,106 @@
+"""参数绑定：声明编译成执行计划，注入参数并报告模板用不到的参数"""
+import json
+import os
+
+from workflow_bindings import NON_WORKFLOW_PARAMETERS, compile_plan, load_declarations
+from workflow_registry import WorkflowRegistry
+
+BINDINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workflow_bindings.json')
+
+DECLARATIONS = [
+    {"param": ["optimized_positive_prompt", "positive_prompt"], "node": 'Prompt', "input": 'text', "default": ''},
+    {"param": 'time', "node": 'Size_Setting', "input": 'length', "scale": 8, "offset": 1},
+    {"param": 'seed', "node": 'KSampler', "input": 'seed'},
+    {"param": 'fps', "node": 'CreateVideo', "input": 'fps'},
+]
+
+
+def workflow():
+    return {
+        "1": {"class_type": 'CLIPTextEncode', "inputs": {"text": 'template'}, "_meta": {"title": 'Prompt'}},
+        "2": {"class_type": 'Size', "inputs": {"length": 49}, "_meta": {"title": 'Size_Setting'}},
+        "3": {"class_type": 'KSampler', "inputs": {"seed": 0}, "_meta": {"title": 'KSampler'}},
+    }
+
+
+def plan():
+    return compile_plan(DECLARATIONS, {"Prompt": '1', "Size_Setting": '2', "KSampler": '3'})
+
+
+def test_bindings_to_missing_nodes_are_not_compiled():
+    compiled = plan()
+    # 模板中没有 CreateVideo 节点，fps 不进入执行计划
+    assert [op[1] for op in compiled.ops] == ['1', '2', '3']
+    assert 'fps' not in compiled.param_names
+    assert compiled.param_names == {'optimized_positive_prompt', 'positive_prompt', 'time', 'seed'}
+
+
+def test_apply_injects_parameters_with_transform():
+    graph = workflow()
+    unknown = plan().apply(graph, {"positive_prompt": 'a cat', "time": 5, "seed": 42})
+    assert unknown == []
+    assert graph["1"]["inputs"]["text"] == 'a cat'
+    assert graph["2"]["inputs"]["length"] == 41
+    assert graph["3"]["inputs"]["seed"] == 42
+
+
+def test_apply_uses_first_present_parameter_and_default():
+    graph = workflow()
+    plan().apply(graph, {"optimized_positive_prompt": 'optimized', "positive_prompt": 'raw'})
+    assert graph["1"]["inputs"]["text"] == 'optimized'
+    # 没有 default 的绑定保持模板原值
+    assert graph["2"]["inputs"]["length"] == 49
+
+    graph = workflow()
+    plan().apply(graph, {})
+    assert graph["1"]["inputs"]["text"] == ''
+
+
+def test_apply_reports_unused_parameters():
+    graph = workflow()
+    unknown = plan().apply(graph, {"seed": 1, "fps": 24, "strength": 0.5, "cfg": 7})
+    assert unknown == ['cfg', 'fps', 'strength']
+
+
+def test_frontend_only_parameters_are_not_reported():
+    parameters = {name: 'x' for name in NON_WORKFLOW_PARAMETERS}
+    assert plan().apply(workflow(), parameters) == []
+
+
+def test_handled_parameters_are_neither_injected_nor_reported():
+    graph = workflow()
+    unknown = plan().apply(graph, {"seed": 1, "image": 'a.png'}, handled={'seed', 'image'})
+    assert unknown == []
+    assert graph["3"]["inputs"]["seed"] == 0
+
+
+def test_load_declarations_skips_malformed_entries(tmp_path):
+    path = tmp_path / 'bindings.json'
+    path.write_text(json.dumps({
+        "*": [{"param": 'seed', "node": 'KSampler', "input": 'seed'}, {"param": 'cfg', "node": 'KSampler'}, 'seed'],
+        "broken": {"param": 'seed'},
+    }), encoding='utf-8')
+    assert load_declarations(str(path)) == {"*": [{"param": 'seed', "node": 'KSampler', "input": 'seed'}], "broken": []}
+
+
+def test_registry_recompiles_plan_when_bindings_change(tmp_path):
+    workflows_dir = tmp_path / 'workflows'
+    workflows_dir.mkdir()
+    (workflows_dir / 'Test.json').write_text(json.dumps(workflow()), encoding='utf-8')
+    bindings = tmp_path / 'bindings.json'
+    bindings.write_text(json.dumps({"*": DECLARATIONS[2:]}), encoding='utf-8')
+    registry = WorkflowRegistry(str(workflows_dir), str(bindings))
+    assert registry.get('Test').plan.param_names == {'seed'}
+
+    bindings.write_text(json.dumps({"*": DECLARATIONS[2:], "Test": DECLARATIONS[1:2]}), encoding='utf-8')
+    os.utime(bindings, (1, 1))
+    assert registry.get('Test').plan.param_names == {'seed', 'time'}
+
+
+def test_shipped_bindings_are_well_formed():
+    with open(BINDINGS_FILE, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    declarations = load_declarations(BINDINGS_FILE)
+    # 没有条目因为格式不对被跳过
+    assert {module_id: len(entries) for module_id, entries in declarations.items()} == \
+        {module_id: len(entries) for module_id, entries in raw.items()}
@@ -0,0 +1,92 @@
+"""WorkflowGraph.splice：把前置工作流拼接进目标工作流，作为一个 prompt 提交"""
+import os
+
+import pytest
+
+from workflow_registry import WorkflowGraph, WorkflowRegistry
+
+WORKFLOWS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workflows')
+
+
+def graph(nodes):
+    workflow = WorkflowGraph(nodes)
+    workflow.reindex()
+    return workflow
+
+
+def load(title, node_id='1'):
+    return {node_id: {"class_type": 'LoadImage', "inputs": {"image": 'placeholder.png'}, "_meta": {"title": title}}}
+
+
+def target():
+    """LoadImage -> Blur -> SaveImage"""
+    return graph({
+        **load('LoadImage'),
+        "2": {"class_type": 'Blur', "inputs": {"image": ["1", 0]}, "_meta": {"title": 'Blur'}},
+        "3": {"class_type": 'SaveImage', "inputs": {"images": ["2", 0]}, "_meta": {"title": 'Save'}},
+    })
+
+
+def merge():
+    """(LoadImage, LoadImage(Move)) -> Stitch -> SaveImage"""
+    return graph({
+        **load('LoadImage'), **load('LoadImage(Move)', '3'),
+        "4": {"class_type": 'Image Stitch', "inputs": {"image1": ["1", 0], "image2": ["3", 0]}, "_meta": {"title": 'Stitch'}},
+        "5": {"class_type": 'SaveImage', "inputs": {"images": ["4", 0]}, "_meta": {"title": 'Save'}},
+    })
+
+
+def test_splice_replaces_node_with_source_output():
+    workflow = target()
+    merged_ids = workflow.splice(merge(), ["4", 0], "1", prefix='merge')
+
+    # 只加入合并结果依赖的节点，SaveImage 不加入
+    assert merged_ids == {"1": 'merge:1', "3": 'merge:3', "4": 'merge:4'}
+    assert "1" not in workflow and 'merge:5' not in workflow
+    assert workflow["2"]["inputs"]["image"] == ['merge:4', 0]
+    assert workflow['merge:4']["inputs"] == {"image1": ['merge:1', 0], "image2": ['merge:3', 0]}
+    # 标题索引已更新：LoadImage 现在是拼接进来的节点
+    assert workflow.title_index['LoadImage'] == 'merge:1'
+    assert workflow.title_index['LoadImage(Move)'] == 'merge:3'
+
+
+def test_splice_does_not_touch_the_source():
+    source = merge()
+    workflow = target()
+    merged_ids = workflow.splice(source, ["4", 0], "1", prefix='merge')
+    workflow[merged_ids["1"]]["inputs"]["image"] = 'a.png'
+    assert source["1"]["inputs"]["image"] == 'placeholder.png'
+
+
+def test_splice_rejects_other_outputs_of_replaced_node():
+    workflow = target()
+    workflow["2"]["inputs"]["mask"] = ["1", 1]
+    with pytest.raises(ValueError):
+        workflow.splice(merge(), ["4", 0], "1", prefix='merge')
+
+
+def test_splice_rejects_existing_prefix():
+    workflow = target()
+    workflow['merge:1'] = load('Other')["1"]
+    with pytest.raises(ValueError):
+        workflow.splice(merge(), ["4", 0], "1", prefix='merge')
+
+
+def test_splice_rejects_missing_source_node():
+    with pytest.raises(ValueError):
+        target().splice(merge(), ["9", 0], "1", prefix='merge')
+
+
+def test_splice_registry_templates():
+    registry = WorkflowRegistry(WORKFLOWS_DIR)
+    workflow = registry.get('ImageGenerateImage_Basic')
+    merge_workflow = registry.get('ImageMerging')
+    load_image_id = workflow.title_index['LoadImage']
+    save_id = next(nid for nid, node in merge_workflow.items() if node['class_type'] == 'SaveImage')
+
+    merged_ids = workflow.splice(merge_workflow, merge_workflow[save_id]["inputs"]["images"], load_image_id, prefix='merge')
+    assert load_image_id not in workflow
+    assert all(op[1] in workflow for op in workflow.plan.ops)
+    assert {merged_ids[merge_workflow.title_index[title]] for title in ('LoadImage', 'LoadImage(Move)')} <= workflow.keys()
+    # 注册表中的模板不受影响
+    assert load_image_id in registry.get('ImageGenerateImage_Basic')
@@ -0,0 +1,62 @@
+"""
+树响应缓存：缓存 GET /api/trees/<id> 已编码好的 JSON 响应体。
+
+缓存以 (tree_id, rev) 为键。树的任何修改都会让 rev +1，所以旧版本的缓存永远不会被命中；
+database 写入时还会通过 add_change_listener 主动失效，及时释放内存。
+总大小超过上限时按 LRU 淘汰。
+"""
+import threading
+from collections import OrderedDict
+
+TREE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 缓存的响应体总大小上限 (64MB)
+
+
+class TreeCache:
+    def __init__(self, max_bytes: int = TREE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[int, int], bytes] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, tree_id: int, rev: int) -> bytes | None:
+        key = (tree_id, rev)
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return body
+
+    def put(self, tree_id: int, rev: int, body: bytes):
+        if len(body) > self.max_bytes:
+            return  # 单个响应超过上限，不缓存
+        with self._lock:
+            # 同一棵树只保留最新版本
+            self._drop_tree(tree_id)
+            self._entries[(tree_id, rev)] = body
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, tree_id: int, rev: int | None = None):
+        """让某棵树的缓存失效（可直接注册为 database.add_change_listener 的回调）"""
+        with self._lock:
+            self._drop_tree(tree_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._size, max_bytes=self.max_bytes)
+
+    def _drop_tree(self, tree_id: int):
+        for key in [key for key in self._entries if key[0] == tree_id]:
+            self._size -= len(self._entries.pop(key))
@@ -0,0 +1,210 @@
+"""
+项目树的 NDJSON 流式导出 / 导入，用于在多个项目数据库之间迁移或合并树。
+
+文件格式（每行一个 JSON 对象）：
+    {"type": "tree", "format": 1, "tree_id": ..., "name": ..., "created_at": ...}   # 第一行
+    {"type": "node", "node_id": ..., "module_id": ..., "title": ..., "status": ...,
+     "created_at": ..., "parameters": "<原始 JSON 文本>", "assets": "<原始 JSON 文本>", "media": ...}
+    {"type": "edge", "child": ..., "parent": ...}                                    # 所有节点之后
+
+导出按批读取游标，导入按批 executemany 写入，整个导入在一个事务中完成，内存占用与树的大小无关。
+目标库中已存在的 node_id 会被重新分配新的 UUID，父子关系随之改写。
+
+用法：
+    python tree_transfer.py export --db video_tree_camel.db --tree 1 -o camel.ndjson
+    python tree_transfer.py import --db video_tree.db -i camel.ndjson [--into-tree 3] [--name 新名字]
+    python tree_transfer.py export --db a.db --tree 1 | python tree_transfer.py import --db b.db
+"""
+import argparse
+import json
+import sqlite3
+import sys
+import uuid
+
+import database
+
+FORMAT_VERSION = 1
+BATCH_SIZE = 1000
+
+
+def export_tree(tree_id: int, db_file: str | None = None, batch_size: int = BATCH_SIZE):
+    """逐行产出树的 NDJSON（每行以换行结尾的 str）。树不存在时抛出 LookupError"""
+    with database.transaction(db_file, readonly=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT tree_id, name, created_at FROM trees WHERE tree_id = ?", (tree_id,))
+        tree_row = cursor.fetchone()
+        if not tree_row:
+            raise LookupError(f"未找到 tree_id={tree_id} 的项目树。")
+        yield json.dumps({"type": "tree", "format": FORMAT_VERSION, **dict(tree_row)}, ensure_ascii=False) + "\n"
+
+        cursor.execute("""
+            SELECT node_id, module_id, title, status, created_at, parameters, assets, media
+            FROM nodes WHERE tree_id = ?
+            ORDER BY created_at ASC
+        """, (tree_id,))
+        while rows := cursor.fetchmany(batch_size):
+            for row in rows:
+                yield json.dumps({"type": "node", **dict(row)}, ensure_ascii=False) + "\n"
+
+        cursor.execute("""
+            SELECT np.child_node_id, np.parent_node_id
+            FROM nodes n JOIN node_parents np ON np.child_node_id = n.node_id
+            WHERE n.tree_id = ?
+            ORDER BY np.child_node_id, np.parent_node_id
+        """, (tree_id,))
+        while rows := cursor.fetchmany(batch_size):
+            for child_id, parent_id in rows:
+                yield json.dumps({"type": "edge", "child": child_id, "parent": parent_id}) + "\n"
+
+
+def import_tree(lines, db_file: str | None = None, into_tree_id: int | None = None,
+                name: str | None = None, batch_size: int = BATCH_SIZE) -> dict:
+    """
+    从 NDJSON 行（str 或 bytes 的可迭代对象）导入一棵树。
+    :param into_tree_id: 合并到已有的树；默认新建一棵树
+    :param name: 新建树的名称，默认使用导出文件中的名称
+    :return: {"tree_id", "nodes", "edges", "remapped"}
+    格式错误时抛出 ValueError，目标树不存在时抛出 LookupError；出错时整个导入回滚。
+    """
+    records = _iter_records(lines)
+    header = next(records, None)
+    if not header or header.get('type') != 'tree':
+        raise ValueError("NDJSON 第一行必须是 tree 记录")
+    if header.get('format') != FORMAT_VERSION:
+        raise ValueError(f"不支持的导出格式版本: {header.get('format')}")
+
+    stats = {"tree_id": None, "nodes": 0, "edges": 0, "remapped": 0}
+    remap = {}  # 只记录发生冲突而被改写的 node_id
+    with database.transaction(db_file) as conn:
+        cursor = conn.cursor()
+        if into_tree_id is None:
+            cursor.execute("INSERT INTO trees (name) VALUES (?)", (name or header.get('name') or '导入的项目',))
+            tree_id = cursor.lastrowid
+        else:
+            if not cursor.execute("SELECT 1 FROM trees WHERE tree_id = ?", (into_tree_id,)).fetchone():
+                raise LookupError(f"未找到 tree_id={into_tree_id} 的项目树。")
+            tree_id = into_tree_id
+        stats["tree_id"] = tree_id
+
+        node_batch, edge_batch = [], []
+        for record in records:
+            record_type = record.get('type')
+            if record_type == 'node':
+                node_batch.append(record)
+                if len(node_batch) >= batch_size:
+                    _flush_nodes(cursor, tree_id, node_batch, remap, stats)
+            elif record_type == 'edge':
+                if node_batch:
+                    _flush_nodes(cursor, tree_id, node_batch, remap, stats)
+                edge_batch.append((remap.get(record['child'], record['child']),
+                                   remap.get(record['parent'], record['parent'])))
+                if len(edge_batch) >= batch_size:
+                    _flush_edges(cursor, edge_batch, stats)
+            else:
+                raise ValueError(f"未知的记录类型: {record_type}")
+        if node_batch:
+            _flush_nodes(cursor, tree_id, node_batch, remap, stats)
+        if edge_batch:
+            _flush_edges(cursor, edge_batch, stats)
+
+        # 批量导入不逐条写变更日志，前端下次会拿到全量数据
+        database._reset_change_log(conn, tree_id)
+
+    print(f"导入完成: 树 {tree_id}，{stats['nodes']} 个节点，{stats['edges']} 条关系，{stats['remapped']} 个 ID 被重新分配。")
+    return stats
+
+
+def _iter_records(lines):
+    for line_no, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"第 {line_no} 行不是合法的 JSON: {e}") from e
+        if not isinstance(record, dict):
+            raise ValueError(f"第 {line_no} 行不是 JSON 对象")
+        yield record
+
+
+def _flush_nodes(cursor: sqlite3.Cursor, tree_id: int, node_batch: list[dict], remap: dict, stats: dict):
+    """写入一批节点：先找出与目标库冲突的 ID 并重新分配，再 executemany 插入节点和资源索引"""
+    cursor.execute(
+        "SELECT node_id FROM nodes WHERE node_id IN (SELECT value FROM json_each(?))",
+        (json.dumps([node['node_id'] for node in node_batch]),)
+    )
+    for (existing_id,) in cursor.fetchall():
+        remap[existing_id] = str(uuid.uuid4())
+        stats["remapped"] += 1
+
+    node_rows, asset_rows = [], []
+    for node in node_batch:
+        node_id = remap.get(node['node_id'], node['node_id'])
+        node_rows.append((
+            node_id, tree_id, node['module_id'], node.get('parameters'), node['title'],
+            node.get('assets'), node.get('media'), node.get('status') or 'completed', node.get('created_at'),
+        ))
+        if node.get('assets'):
+            try:
+                asset_rows.extend(database._asset_rows(node_id, json.loads(node['assets'])))
+            except json.JSONDecodeError:
+                print(f"警告：解析节点 {node['node_id']} 的 assets JSON 失败，跳过资源索引。")
+
+    cursor.executemany(
+        """INSERT INTO nodes (node_id, tree_id, module_id, parameters, title, assets, media, status, created_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        node_rows
+    )
+    cursor.executemany(database._INSERT_NODE_ASSET_SQL, asset_rows)
+    stats["nodes"] += len(node_rows)
+    node_batch.clear()
+
+
+def _flush_edges(cursor: sqlite3.Cursor, edge_batch: list[tuple], stats: dict):
+    cursor.executemany(
+        "INSERT OR IGNORE INTO node_parents (child_node_id, parent_node_id) VALUES (?, ?)",
+        edge_batch
+    )
+    stats["edges"] += len(edge_batch)
+    edge_batch.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="项目树 NDJSON 导出 / 导入")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="把一棵树导出为 NDJSON")
+    export_parser.add_argument("--db", default=database.DATABASE_FILE, help="源数据库文件")
+    export_parser.add_argument("--tree", type=int, required=True, help="要导出的 tree_id")
+    export_parser.add_argument("-o", "--output", default="-", help="输出文件，默认标准输出")
+
+    import_parser = subparsers.add_parser("import", help="从 NDJSON 导入一棵树")
+    import_parser.add_argument("--db", default=database.DATABASE_FILE, help="目标数据库文件")
+    import_parser.add_argument("-i", "--input", default="-", help="输入文件，默认标准输入")
+    import_parser.add_argument("--into-tree", type=int, help="合并到已有的 tree_id，默认新建一棵树")
+    import_parser.add_argument("--name", help="新建树的名称")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+        try:
+            out.writelines(export_tree(args.tree, args.db))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    else:
+        # 导入前确保目标库的表结构是最新的
+        database.init_db(args.db)
+        src = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+        try:
+            import_tree(src, args.db, into_tree_id=args.into_tree, name=args.name)
+        finally:
+            if src is not sys.stdin:
+                src.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+声明式参数注入：请求参数 -> 工作流节点输入。
+
+绑定声明在 workflow_bindings.json 中，按模块ID分组（"*" 对所有模板生效，模块自己的声明追加在其后）：
+    {"param": "time", "node": "Size_Setting", "input": "length", "scale": 8, "offset": 1}
+      param           请求参数名；可以是列表，按顺序取第一个存在的参数
+      node            节点标题；模板中没有该标题的节点时，这条绑定不会编译进执行计划
+      input           节点的输入名
+      scale / offset  数值变换 value * scale + offset
+      default         参数都不存在时写入的值；不写则保持模板中的原值
+
+模板加载时把绑定编译成扁平的 (参数, 节点ID, 输入名, 变换) 列表，注入参数时只遍历这个模板真正用到的目标。
+"""
+import json
+
+_MISSING = object()
+
+# 前端随节点一起保存、但本来就不注入工作流的参数（提示词优化的中间结果、全局上下文、音频波形图等），
+# 不当作"未使用的参数"报告给用户
+NON_WORKFLOW_PARAMETERS = frozenset({
+    'negative_prompt', 'optimized_negative_prompt', 'final_prompt', 'global_context',
+    'description', 'waveform_image', 'mask_filename',
+})
+
+
+def load_declarations(path: str) -> dict[str, list[dict]]:
+    """读取绑定声明文件，格式不对的条目打印警告后跳过"""
+    with open(path, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+
+    declarations = {}
+    for module_id, entries in raw.items():
+        valid = []
+        for entry in entries if isinstance(entries, list) else []:
+            if not isinstance(entry, dict) or not all(entry.get(key) for key in ('param', 'node', 'input')):
+                print(f"警告：忽略格式不正确的参数绑定 ({module_id}): {entry}")
+                continue
+            valid.append(entry)
+        declarations[module_id] = valid
+    return declarations
+
+
+class ParameterPlan:
+    def __init__(self, ops: list[tuple], param_names: frozenset[str]):
+        self.ops = ops
+        self.param_names = param_names  # 这个模板会用到的所有参数名
+
+    def apply(self, workflow: dict, parameters: dict, handled=()) -> list[str]:
+        """
+        把参数写入工作流，返回这个模板用不到的参数名（按字母排序，不含 NON_WORKFLOW_PARAMETERS）。
+        handled 中的参数已由调用方另行处理：既不注入，也不当作未知参数报告。
+        """
+        for names, node_id, input_name, scale, offset, default in self.ops:
+            value = default
+            for name in names:
+                if name in parameters and name not in handled:
+                    value = parameters[name]
+                    break
+            if value is _MISSING:
+                continue
+            if scale != 1 or offset != 0:
+                value = value * scale + offset
+            workflow[node_id]["inputs"][input_name] = value
+        return sorted(
+            name for name in parameters
+            if name not in self.param_names and name not in handled and name not in NON_WORKFLOW_PARAMETERS
+        )
+
+
+def compile_plan(declarations: list[dict], title_index: dict[str, str]) -> ParameterPlan:
+    """根据模板的标题索引把绑定声明编译成执行计划"""
+    ops = []
+    param_names = set()
+    for entry in declarations:
+        node_id = title_index.get(entry['node'])
+        if node_id is None:
+            continue
+        names = tuple(entry['param']) if isinstance(entry['param'], list) else (entry['param'],)
+        ops.append((
+            names, node_id, entry['input'],
+            entry.get('scale', 1), entry.get('offset', 0), entry.get('default', _MISSING),
+        ))
+        param_names.update(names)
+    return ParameterPlan(ops, frozenset(param_names))
@@ -0,0 +1,216 @@
+"""
+工作流模板注册表。
+
+启动时把 workflows/ 下的所有模板解析一次，并为每个模板建好「节点标题 -> 节点ID」索引。
+之后每次请求只做一次 os.stat：文件 mtime 变化才重新解析，否则直接从缓存的模板浅复制一份（写时复制）返回。
+返回的 WorkflowGraph 是普通 dict 的子类（可以直接提交给 ComfyUI），附带只读的 title_index
+和按 workflow_bindings.json 编译好的参数注入计划 plan（见 workflow_bindings）。
+多阶段处理（如先合并两张输入图片）可以用 WorkflowGraph.splice() 把前置工作流拼接进来，作为一个 prompt 提交。
+"""
+import json
+import os
+import threading
+
+from workflow_bindings import ParameterPlan, compile_plan, load_declarations
+
+
+class WorkflowGraph(dict):
+    """带标题索引的工作流。title_index 对应模板的结构，结构性修改（增删节点、改标题）后需调用 reindex()"""
+
+    title_index: dict[str, str] = {}
+    plan: ParameterPlan = ParameterPlan([], frozenset())
+
+    def reindex(self):
+        self.title_index = build_title_index(self)
+
+    def splice(self, source: dict, source_output: list, replace_node_id: str, prefix: str):
+        """
+        把另一个工作流拼接进来，让多阶段处理作为一个 prompt 执行：
+        source 中 source_output（[节点ID, 输出序号]）依赖的节点以 "<prefix>:<节点ID>" 为新 ID 加入本工作流，
+        原来连到 replace_node_id 第 0 个输出的输入改为连到 source_output，然后删除 replace_node_id。
+        source 中不被 source_output 依赖的节点（如 SaveImage）不会加入。完成后自动 reindex()。
+        返回 {source 中的节点ID: 拼接后的节点ID}，调用方按它定位拼接进来的节点（标题可能与本工作流中的节点重复）。
+        """
+        if any(_is_link(value) and value[0] == replace_node_id and value[1] != 0
+               for node_info in self.values() for value in node_info.get('inputs', {}).values()):
+            raise ValueError(f"节点 {replace_node_id} 除第 0 个输出外还有其它输出被使用，无法替换")
+
+        needed = set()
+        pending = [source_output[0]]
+        while pending:
+            node_id = pending.pop()
+            if node_id in needed:
+                continue
+            if node_id not in source:
+                raise ValueError(f"拼接的工作流中不存在节点 {node_id}")
+            needed.add(node_id)
+            pending.extend(value[0] for value in source[node_id].get('inputs', {}).values() if _is_link(value))
+
+        new_ids = {node_id: f"{prefix}:{node_id}" for node_id in needed}
+        if any(new_id in self for new_id in new_ids.values()):
+            raise ValueError(f"工作流中已存在前缀为 '{prefix}:' 的节点")
+        for node_id, node_info in source.items():
+            if node_id in needed:
+                inputs = {
+                    name: [new_ids[value[0]], value[1]] if _is_link(value) else value
+                    for name, value in node_info.get('inputs', {}).items()
+                }
+                self[new_ids[node_id]] = {**node_info, "inputs": inputs}
+
+        # 连线列表与模板共享（见 copy_graph），只能整体替换
+        replacement = [new_ids[source_output[0]], source_output[1]]
+        for node_info in self.values():
+            inputs = node_info.get('inputs', {})
+            for name, value in inputs.items():
+                if _is_link(value) and value[0] == replace_node_id:
+                    inputs[name] = replacement
+        del self[replace_node_id]
+
+        self.reindex()
+        # 参数注入计划仍按原模板编译，去掉指向已删除节点的目标
+        self.plan = ParameterPlan([op for op in self.plan.ops if op[1] in self], self.plan.param_names)
+        return new_ids
+
+
+def _is_link(value) -> bool:
+    """ComfyUI API 格式中节点之间的连线: [上游节点ID, 输出序号]"""
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+def build_title_index(workflow: dict) -> dict[str, str]:
+    """标题 -> 节点ID；同名标题取第一个，与逐个遍历查找的结果一致"""
+    index = {}
+    for node_id, node_info in workflow.items():
+        title = (node_info.get('_meta') or {}).get('title') if isinstance(node_info, dict) else None
+        if title is not None:
+            index.setdefault(title, node_id)
+    return index
+
+
+def copy_graph(graph: dict) -> dict:
+    """
+    写时复制：复制每个节点及其 inputs 字典，inputs 中的值（连线列表等）和 _meta 与模板共享。
+    修改工作流时只能给 inputs[...] 重新赋值，不要原地修改其中的列表。
+    """
+    return {
+        node_id: {**node_info, "inputs": dict(node_info["inputs"])} if "inputs" in node_info else dict(node_info)
+        for node_id, node_info in graph.items()
+    }
+
+
+class _Template:
+    def __init__(self, mtime: float, graph: dict):
+        self.mtime = mtime
+        self.graph = graph
+        self.title_index = build_title_index(graph)
+        self.plan = None
+        self.bindings_version = None  # 编译 plan 时绑定声明文件的 mtime
+
+
+class WorkflowRegistry:
+    def __init__(self, directory: str, bindings_file: str | None = None):
+        self.directory = directory
+        self.bindings_file = bindings_file
+        self._templates: dict[str, _Template] = {}
+        self._declarations: dict[str, list[dict]] = {}
+        self._bindings_version = None
+        self._lock = threading.Lock()
+        self.stats = {"loads": 0, "hits": 0}
+
+    def load_all(self) -> int:
+        """预加载目录下的所有模板，返回加载的数量"""
+        if not os.path.isdir(self.directory):
+            print(f"警告：工作流目录不存在: {self.directory}")
+            return 0
+        count = 0
+        for filename in sorted(os.listdir(self.directory)):
+            module_id, ext = os.path.splitext(filename)
+            if ext == '.json' and self._get_template(module_id) is not None:
+                count += 1
+        print(f"已预加载 {count} 个工作流模板。")
+        return count
+
+    def get(self, module_id: str) -> WorkflowGraph | None:
+        """返回模板的写时复制副本（可直接给节点 inputs 赋值），模板不存在时返回 None"""
+        template = self._get_template(module_id)
+        if template is None:
+            return None
+        graph = WorkflowGraph(copy_graph(template.graph))
+        graph.title_index = template.title_index
+        graph.plan = self._get_plan(module_id, template)
+        return graph
+
+    def get_title_index(self, module_id: str) -> dict[str, str] | None:
+        template = self._get_template(module_id)
+        return template.title_index if template else None
+
+    def module_ids(self) -> list[str]:
+        with self._lock:
+            return sorted(self._templates)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, templates=len(self._templates))
+
+    def _get_plan(self, module_id: str, template: _Template) -> ParameterPlan:
+        """返回模板的参数注入计划，绑定声明文件修改后重新编译"""
+        self._refresh_bindings()
+        with self._lock:
+            if template.plan is None or template.bindings_version != self._bindings_version:
+                declarations = self._declarations.get('*', []) + self._declarations.get(module_id, [])
+                template.plan = compile_plan(declarations, template.title_index)
+                template.bindings_version = self._bindings_version
+            return template.plan
+
+    def _refresh_bindings(self):
+        if not self.bindings_file:
+            return
+        try:
+            mtime = os.stat(self.bindings_file).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._bindings_version:
+            return
+        try:
+            declarations = load_declarations(self.bindings_file) if mtime is not None else {}
+        except (OSError, ValueError) as e:
+            print(f"加载参数绑定 '{self.bindings_file}' 失败: {e}")
+            return
+        with self._lock:
+            self._declarations = declarations
+            self._bindings_version = mtime
+        print(f"已加载参数绑定: {self.bindings_file}")
+
+    def _path(self, module_id: str) -> str:
+        return os.path.join(self.directory, f"{module_id}.json")
+
+    def _get_template(self, module_id: str) -> _Template | None:
+        # module_id 来自请求，不允许跳出 workflows 目录
+        if not module_id or os.path.basename(module_id) != module_id:
+            return None
+        path = self._path(module_id)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            with self._lock:
+                self._templates.pop(module_id, None)
+            return None
+
+        with self._lock:
+            template = self._templates.get(module_id)
+            if template is not None and template.mtime == mtime:
+                self.stats["hits"] += 1
+                return template
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                graph = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"加载工作流 '{module_id}' 失败: {e}")
+            return None
+        template = _Template(mtime, graph)
+        with self._lock:
+            self._templates[module_id] = template
+            self.stats["loads"] += 1
+        print(f"已加载工作流模板: {module_id}")
+        return template
@@ -54,6 +54,13 @@ interface DbNode {
   created_at: string;
 }
 
+// GET /api/trees/<id> 的返回结构（带 ?since= 时为增量结构，full 为 false）
+interface TreePayload {
+  rev?: number;
+  full?: boolean;
+  nodes: DbNode[] | { upserted: DbNode[]; removed: string[] };
+}
+
 // 原始 assets 字段 JSON 解析后的结构
 interface AssetDetails {
   input?: {          // 输入类型资源
@@ -148,6 +155,8 @@ export function useWorkflow() {
   const allNodes = ref<AppNode[]>([]) // D3 将会监听这个
   const rootNodeId = ref<string | null>(null)
   const selectedParentIds = ref<string[]>([]) // 选中的父节点
+  // 最近一次拿到的完整树（原始节点 + 版本号），用于 ?since= 增量加载
+  let lastTree: { rev: number; nodes: Map<string, DbNode> } | null = null
 
   // 视频拼接
   const stitchingClips = reactive<StitchingClip[]>([])
@@ -163,6 +172,84 @@ export function useWorkflow() {
 
   // --- 5. 内部辅助函数 (Helpers) ---
 
+  /** 记住后端返回的完整树，之后 loadAndRender 只需拉取增量 */
+  function rememberTree(tree: TreePayload) {
+    if (typeof tree.rev !== 'number' || !Array.isArray(tree.nodes)) return
+    lastTree = { rev: tree.rev, nodes: new Map(tree.nodes.map(n => [n.node_id, n])) }
+  }
+
+  /**
+   * 处理 POST /api/nodes 的响应：
+   * 生成类模块返回 202 + 任务信息，通过 /api/jobs/<id>/events 实时显示进度，任务结束后重新加载树；
+   * 其它模块直接返回更新后的树。
+   */
+  async function applyCreateNodeResponse(response: Response) {
+    if (response.status !== 202) {
+      const updatedTree: TreePayload = await response.json()
+      rememberTree(updatedTree)
+      processTreeData(updatedTree.nodes as DbNode[], '生成操作完成')
+      return
+    }
+    let job = await response.json()
+    await loadAndRender() // 先显示 pending 状态的节点
+    job = await followJob(job)
+    await loadAndRender()
+    if (job.status === 'failed') throw new Error(`生成失败: ${job.error}`)
+    if (job.status === 'cancelled') {
+      showStatus('生成已取消')
+      return
+    }
+    const unknown: string[] = job.result?.unknown_parameters ?? []
+    showStatus(unknown.length ? `生成操作完成（未使用的参数: ${unknown.join(', ')}）` : '生成操作完成')
+  }
+
+  /** 订阅任务进度 (Server-Sent Events) 并显示在状态栏，返回结束后的任务；连接失败时退回长轮询 */
+  function followJob(job: any): Promise<any> {
+    if (typeof EventSource === 'undefined') return pollJob(job)
+    return new Promise(resolve => {
+      const source = new EventSource(`/api/jobs/${job.job_id}/events`)
+      source.addEventListener('progress', event => {
+        showStatus(describeProgress(JSON.parse((event as MessageEvent).data)))
+      })
+      source.addEventListener('done', event => {
+        source.close()
+        resolve(JSON.parse((event as MessageEvent).data))
+      })
+      source.onerror = () => {
+        source.close()
+        resolve(pollJob(job))
+      }
+    })
+  }
+
+  /** 长轮询 /api/jobs/<id> 直到任务结束 */
+  async function pollJob(job: any): Promise<any> {
+    while (job.status === 'queued' || job.status === 'running') {
+      showStatus(job.status === 'queued' ? '生成任务排队中...' : '正在生成...')
+      const res = await fetch(`/api/jobs/${job.job_id}?wait=30`)
+      if (!res.ok) throw new Error(`查询任务失败: HTTP ${res.status}`)
+      job = await res.json()
+    }
+    return job
+  }
+
+  /** 进度快照 -> 状态栏文本 */
+  function describeProgress(state: any): string {
+    const variant = state.variants > 1 ? `[变体 ${state.variant}/${state.variants}] ` : ''
+    if (state.stage === 'executing') {
+      let text = `${variant}正在执行 ${state.node_title ?? ''}`
+      if (state.progress) text += ` ${state.progress.value}/${state.progress.max}`
+      if (state.eta_seconds != null) text += `，预计剩余 ${Math.ceil(state.eta_seconds)} 秒`
+      return text
+    }
+    if (state.stage === 'queued') {
+      return state.queue_position != null
+        ? `${variant}ComfyUI 排队中（前面还有 ${state.queue_position} 个任务）...`
+        : `${variant}ComfyUI 排队中...`
+    }
+    return state.status === 'queued' ? '生成任务排队中...' : '正在生成...'
+  }
+
   /** 更新顶部状态栏文本 */
   function showStatus(text: string) {
     statusText.value = text
@@ -322,16 +409,30 @@ function toggleNodeCollapse(nodeId: string) {
     isLoadingTree.value = true
     showStatus('正在从数据库加载作品...')
     try {
-      const res = await fetch(DB_API_GET_URL)
+      const url = lastTree ? `${DB_API_GET_URL}?since=${lastTree.rev}` : DB_API_GET_URL
+      const res = await fetch(url)
       if (!res.ok) throw new Error('HTTP ' + res.status)
-      const treeData: { nodes: DbNode[] } = await res.json()
+      const treeData: TreePayload = await res.json()
+
+      let nodes: DbNode[]
+      if (lastTree && treeData.full === false && !Array.isArray(treeData.nodes)) {
+        // 增量：在上次的完整树上应用新增/修改/删除
+        const { upserted, removed } = treeData.nodes
+        removed.forEach(id => lastTree!.nodes.delete(id))
+        upserted.forEach(n => lastTree!.nodes.set(n.node_id, n))
+        lastTree.rev = treeData.rev ?? lastTree.rev
+        nodes = Array.from(lastTree.nodes.values())
+      } else {
+        rememberTree(treeData)
+        nodes = treeData.nodes as DbNode[]
+      }
 
-      if (!treeData.nodes || treeData.nodes.length === 0) {
+      if (!nodes || nodes.length === 0) {
         showStatus('数据库中没有找到任何节点。请在右侧开始您的第一次生成。')
         allNodes.value = []
         return
       }
-      processTreeData(treeData.nodes, '加载完成。')
+      processTreeData(nodes, '加载完成。')
     } catch (err: any) {
       console.error(err)
       showStatus('加载失败: ' + err.message)
@@ -417,6 +518,7 @@ function toggleNodeCollapse(nodeId: string) {
       if (!response.ok) { const errText = await response.text(); throw new Error(`上传失败: ${errText}`) }
 
       const updatedTree: { nodes: DbNode[] } = await response.json() // 后端返回更新后的树
+      rememberTree(updatedTree)
       processTreeData(updatedTree.nodes, '上传成功！新节点已添加到历史树。')
 
       
@@ -494,9 +596,8 @@ function toggleNodeCollapse(nodeId: string) {
           throw new Error(`请求失败: ${errText}`);
         }
 
-         // 4. 接收后端返回的更新后的数据并刷新视图
-        const updatedTree: { nodes: DbNode[] } = await response.json();
-        processTreeData(updatedTree.nodes, '生成操作完成');
+         // 4. 等待生成任务完成（或直接接收更新后的树）并刷新视图
+        await applyCreateNodeResponse(response);
 
       }else{
         let parentIds = [...selectedParentIds.value] // 复制
@@ -523,9 +624,8 @@ function toggleNodeCollapse(nodeId: string) {
           throw new Error(`请求失败: ${errText}`);
         }
 
-         // 4. 接收后端返回的更新后的数据并刷新视图
-        const updatedTree: { nodes: DbNode[] } = await response.json();
-        processTreeData(updatedTree.nodes, '生成操作完成');
+         // 4. 等待生成任务完成（或直接接收更新后的树）并刷新视图
+        await applyCreateNodeResponse(response);
 
       }
 